@@ -1,61 +1,219 @@
+import time
+
+# Start of the app import, for the startup report in /api/ready
+IMPORT_STARTED = time.perf_counter()
+
+import hmac
+import io
+import math
 import os
 import json
 import logging
-from flask import Flask, request, jsonify
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-from PIL import Image
+from upload_store import UploadStore, upload_id_for
+from tensor_store import meta_path
+from PIL import Image, UnidentifiedImageError
+from circuit_breaker import ModelUnavailable
 import numpy as np
-from models import predict_with_model
+from postprocessing import parse_top_k
+from tta import parse_tta
+from jobs import JobManager, public_job
+import cpu_policy
+import metrics
+from metrics import timed
+from structured_logging import configure_logging, log_request
+import lazy_modules
+from lazy_modules import LazyModule
+from model_config import (
+    SERVING_MODELS, MODEL_INPUT_SIZES, DEGRADED_MODE, SIMILAR_DIR,
+    available_models, store_upload_tensors
+)
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging: structured records written by a background thread,
+# one sampled summary per request (see structured_logging.py)
+configure_logging()
 logger = logging.getLogger(__name__)
 
+class InMemoryRequest(Flask.request_class):
+    """
+    Keeps uploaded file parts in memory (bounded by MAX_CONTENT_LENGTH)
+    instead of spooling larger ones to a temporary file
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
+
 app = Flask(__name__)
+app.request_class = InMemoryRequest
 # Allow CORS for both development and production
-CORS(app, origins=[
+CORS_ORIGINS = [
     'http://localhost:3000', 
     'http://127.0.0.1:3000',
     'http://skinvisionai.com',
     'https://skinvisionai.com',
     'http://www.skinvisionai.com',
     'https://www.skinvisionai.com'
-])
+]
+CORS(app, origins=CORS_ORIGINS)
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+# Raw request bodies accepted by /api/analyze, and the extension they are stored with
+IMAGE_MIMETYPES = {'image/jpeg': 'jpg', 'image/png': 'png'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
+# Async analysis jobs: number of inference workers and whether they are
+# processes (default) or threads
+app.config['JOB_WORKERS'] = int(os.environ.get('SKINVISION_JOB_WORKERS', '2'))
+app.config['JOB_WORKER_TYPE'] = os.environ.get('SKINVISION_JOB_WORKER_TYPE', 'process')
+# Hosts job callbacks may go to; without any, only public addresses (see jobs.py)
+app.config['JOB_CALLBACK_HOSTS'] = [
+    host for host in os.environ.get('SKINVISION_JOB_CALLBACK_HOSTS', '').split(',') if host
+]
+# Store model-ready tensors next to each upload (see tensor_store.py)
+app.config['PREPROCESS_ON_UPLOAD'] = os.environ.get('SKINVISION_PREPROCESS_ON_UPLOAD', '1') != '0'
+# Upload retention: uploads not used for this many days, then the least
+# recently used ones beyond the size budget, are deleted (0 disables either)
+app.config['UPLOAD_MAX_AGE_DAYS'] = float(os.environ.get('SKINVISION_UPLOAD_MAX_AGE_DAYS', '30'))
+app.config['UPLOAD_MAX_MB'] = float(os.environ.get('SKINVISION_UPLOAD_MAX_MB', '10240'))
+app.config['UPLOAD_RETENTION_INTERVAL'] = float(os.environ.get('SKINVISION_UPLOAD_RETENTION_INTERVAL', '3600'))
+# Images decoded and run through the models together by /api/analyze/batch;
+# bounds memory regardless of how many images a session contains
+app.config['BATCH_CHUNK_SIZE'] = int(os.environ.get('SKINVISION_BATCH_CHUNK_SIZE', '8'))
+# Bearer token for the /api/admin endpoints; unset disables them
+app.config['ADMIN_TOKEN'] = os.environ.get('SKINVISION_ADMIN_TOKEN')
 
 # Create uploads folder if it doesn't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Uploads are stored by content hash in sharded directories (see upload_store.py)
+upload_store = UploadStore(
+    app.config['UPLOAD_FOLDER'],
+    max_age_seconds=app.config['UPLOAD_MAX_AGE_DAYS'] * 86400,
+    max_total_bytes=app.config['UPLOAD_MAX_MB'] * 1024 * 1024,
+    sweep_interval=app.config['UPLOAD_RETENTION_INTERVAL'],
+)
+
+# The inference code (torch, torchvision and the models) is imported on
+# first use, so endpoints that never run a model (uploads, /api/models,
+# health) are served without waiting for it (see lazy_modules.py). Once it
+# is imported, retrained checkpoints are hot-swapped without a restart
+# (SKINVISION_MODEL_WATCH_INTERVAL).
+models = LazyModule('models', on_import=lambda module: module.start_model_watcher())
+
+# Load and warm every model at startup instead of on the first request.
+# 'background' imports and loads them on a background thread while serving
+# requests (see /api/ready), 'blocking' finishes loading before the app is
+# importable, which together with `gunicorn --preload` lets forked workers
+# share the loaded weights, and 'off' waits for the first request that
+# needs a model.
+EAGER_LOAD = os.environ.get('SKINVISION_EAGER_LOAD', 'background')
+if EAGER_LOAD == 'blocking':
+    models.registry.load_all()
+elif EAGER_LOAD == 'background':
+    models.load_in_background(then=lambda module: module.registry.load_all_in_background())
+
+# Created on first use so every web worker process gets its own pool
+job_manager = None
+
+def get_job_manager():
+    global job_manager
+    if job_manager is None:
+        use_processes = app.config['JOB_WORKER_TYPE'] == 'process'
+        job_manager = JobManager(
+            models.run_analysis_job,
+            workers=app.config['JOB_WORKERS'],
+            use_processes=use_processes,
+            initializer=models.warm_job_worker if use_processes else None,
+            allowed_callback_hosts=app.config['JOB_CALLBACK_HOSTS'] or None,
+        )
+    return job_manager
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+    g.stages, g.trace_token = metrics.start_request_trace()
+    # Extra fields for the request summary (model, top-1, ...)
+    g.log_fields = {}
+
+@app.after_request
+def record_request_metrics(response):
+    # Label by route pattern (not the raw path) to keep cardinality bounded.
+    # Streamed responses are measured up to the start of the body.
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    started = g.get('request_started')
+    duration = time.perf_counter() - started if started is not None else 0.0
+    if started is not None:
+        metrics.request_seconds.observe(duration, endpoint=endpoint, method=request.method)
+    metrics.requests_total.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+        log_request(
+            logger, g.request_id, endpoint, request.method, response.status_code, duration,
+            g.get('stages'), **g.get('log_fields', {})
+        )
+    return response
+
+@app.teardown_request
+def stop_request_trace(exc):
+    # Runs even when a handler or after_request hook raised
+    token = g.pop('trace_token', None)
+    if token is not None:
+        metrics.end_request_trace(token)
+
+# Writes images analyzed straight from the request to disk, off the request path
+persist_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='upload-persist')
+
+def persist_upload(image_bytes, filename):
+    """
+    Save an image analyzed from memory to the upload store so later
+    requests can refer to it by filename
+    """
+    try:
+        upload_id, filepath, created = upload_store.save(image_bytes, filename)
+        if app.config['PREPROCESS_ON_UPLOAD'] and (created or not os.path.exists(meta_path(filepath))):
+            store_upload_tensors(filepath)
+            upload_store.refresh_size(upload_id)
+    except Exception as e:
+        logger.warning("Could not persist %s: %s", filename, e)
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
-    logger.info("=== UPLOAD REQUEST RECEIVED ===")
-    logger.info(f"Request files: {list(request.files.keys())}")
-    
     if 'file' not in request.files:
-        logger.error("No file part in request")
         return jsonify({'error': 'No file part'}), 400
     
     file = request.files['file']
-    logger.info(f"File received: {file.filename}")
     
     if file.filename == '':
-        logger.error("No file selected")
         return jsonify({'error': 'No selected file'}), 400
     
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        logger.info(f"File saved to: {filepath}")
+        stream = file.stream
+        image_bytes = stream.getvalue() if isinstance(stream, io.BytesIO) else file.read()
+        with timed('upload_save'):
+            filename, filepath, created = upload_store.save(image_bytes, secure_filename(file.filename))
+        g.log_fields['filename'] = filename
+
+        # Re-uploads of a stored image reuse its file and tensors
+        if app.config['PREPROCESS_ON_UPLOAD'] and (created or not os.path.exists(meta_path(filepath))):
+            # Decode once now so every later analysis can skip decoding.
+            # This is only an optimization; analysis falls back to the file.
+            try:
+                with timed('upload_preprocess'):
+                    store_upload_tensors(filepath)
+                # The tensors count towards the retention size budget
+                upload_store.refresh_size(filename)
+            except Exception as e:
+                logger.warning("Could not preprocess %s: %s", filepath, e)
         
         return jsonify({
             'success': True,
@@ -63,71 +221,463 @@ def upload_file():
             'message': 'File uploaded successfully'
         })
     
-    logger.error(f"File type not allowed: {file.filename}")
     return jsonify({'error': 'File type not allowed'}), 400
 
 @app.route('/api/analyze', methods=['POST'])
-def analyze_image():
-    logger.info("=== ANALYZE REQUEST RECEIVED ===")
-    logger.info(f"Request headers: {dict(request.headers)}")
-    logger.info(f"Request method: {request.method}")
-    logger.info(f"Request content type: {request.content_type}")
-    
+@app.route('/api/jobs', methods=['POST'], defaults={'force_async': True})
+def analyze_image(force_async=False):
+    if request.files or request.mimetype in IMAGE_MIMETYPES:
+        return _analyze_in_memory(force_async)
+
     if not request.data:
-        logger.error("Empty request body received")
         return jsonify({'error': 'Empty request body'}), 400
 
-    data = request.get_json()
-    logger.info(f"Request data: {data}")
-    
-    if not data or 'filename' not in data or 'model' not in data:
-        logger.error(f"Missing data - filename: {'filename' in data if data else 'N/A'}, model: {'model' in data if data else 'N/A'}")
+    with timed('request_parse'):
+        # Any other body must be JSON (as in asgi.py), whatever its type
+        data = request.get_json(force=True, silent=True)
+    if data is None:
+        return jsonify({'error': 'Invalid JSON body'}), 400
+
+    if isinstance(data, dict) and 'models' in data:
+        # Ensemble: several model ids analyzed in one request
+        data['model'] = data['models']
+
+    if not isinstance(data, dict) or 'filename' not in data or 'model' not in data:
         return jsonify({'error': 'Missing filename or model selection'}), 400
     
     original_filename = data['filename']
     model_name = data['model']
-    logger.info(f"Processing file: {original_filename} with model: {model_name}")
+    g.log_fields['model'] = model_name
+    try:
+        # Clients that only display the top few classes can ask for fewer
+        top_k = parse_top_k(data.get('top_k'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'top_k must be a positive integer'}), 400
+    try:
+        tta_views = parse_tta(data.get('tta'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], original_filename)
-    logger.info(f"Looking for file at: {filepath}")
+    filepath = upload_store.resolve(original_filename)
     
-    if not os.path.exists(filepath):
-        logger.error(f"File not found at path: {filepath}")
-        # List files in upload directory for debugging
-        if os.path.exists(app.config['UPLOAD_FOLDER']):
-            files = os.listdir(app.config['UPLOAD_FOLDER'])
-            logger.info(f"Files in upload directory: {files}")
+    if filepath is None:
+        logger.warning("Upload not found: %s", original_filename)
         return jsonify({'error': 'File not found'}), 404
     
-    try:
-        logger.info("Starting prediction...")
-        # Process the image and get predictions
-        results = predict_with_model(filepath, model_name)
-        logger.info(f"Prediction successful. Results: {results}")
-        return jsonify({
+    if force_async or data.get('async'):
+        # Queue the analysis and return immediately; the client polls
+        # /api/jobs/<id> or is notified at callback_url
+        try:
+            job = get_job_manager().submit(
+                {'filepath': filepath, 'model': model_name, 'top_k': top_k, 'weights': data.get('weights'),
+                 'tta': tta_views},
+                callback_url=data.get('callback_url'),
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        g.log_fields['job_id'] = job['id']
+        response = jsonify({
             'success': True,
-            'results': results
+            'job_id': job['id'],
+            'status': job['status'],
+            'status_url': f"/api/jobs/{job['id']}"
         })
+        response.headers['Location'] = f"/api/jobs/{job['id']}"
+        return response, 202
+
+    return _prediction_response(filepath, model_name, top_k, data.get('weights'), tta_views)
+
+def _analyze_in_memory(force_async=False):
+    """
+    Analyze an image sent in the request itself, as a multipart 'file'
+    field or a raw image/jpeg or image/png body, decoding it from memory.
+    Options come from form fields (multipart) or the query string. With
+    persist=1 the image is also saved in the background and its filename
+    returned for later requests.
+    """
+    if force_async:
+        return jsonify({'error': 'Async jobs need an uploaded filename'}), 400
+
+    if request.files:
+        params = request.form
+        file = request.files.get('file')
+        if file is None or not allowed_file(file.filename or ''):
+            return jsonify({'error': 'Missing or unsupported image file'}), 400
+        stream = file.stream
+        image_bytes = stream.getvalue() if isinstance(stream, io.BytesIO) else file.read()
+        extension = file.filename.rsplit('.', 1)[1].lower()
+    else:
+        params = request.args
+        image_bytes = request.get_data(cache=False)
+        extension = IMAGE_MIMETYPES[request.mimetype]
+    if not image_bytes:
+        return jsonify({'error': 'Empty image'}), 400
+
+    model_ids = [m for value in params.getlist('models') for m in value.split(',') if m]
+    model_name = model_ids or params.get('model')
+    if not model_name:
+        return jsonify({'error': 'Missing model selection'}), 400
+    g.log_fields['model'] = model_name
+    try:
+        top_k = parse_top_k(params.get('top_k'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'top_k must be a positive integer'}), 400
+    try:
+        weights = json.loads(params['weights']) if params.get('weights') else None
+    except ValueError:
+        return jsonify({'error': 'weights must be JSON'}), 400
+    try:
+        tta_views = parse_tta(params.get('tta'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    filename = None
+    if params.get('persist', '').lower() in ('1', 'true', 'yes'):
+        filename = upload_id_for(image_bytes, f"upload.{extension}")
+        persist_executor.submit(persist_upload, image_bytes, filename)
+        g.log_fields['filename'] = filename
+
+    return _prediction_response(image_bytes, model_name, top_k, weights, tta_views, filename=filename)
+
+def _prediction_response(image, model_name, top_k, weights, tta_views=None, **extra):
+    """
+    Run the prediction for an image path or in-memory image bytes and build
+    the /api/analyze response
+    """
+    try:
+        # Process the image and get predictions
+        with timed('predict'):
+            results = models.predict_with_model(image, model_name, top_k, weights, tta_views)
+        g.log_fields['top1'] = results['top_prediction']['code']
+        g.log_fields['top1_probability'] = results['top_prediction']['probability']
+        with timed('serialize'):
+            return jsonify({
+                'success': True,
+                'results': results,
+                **{key: value for key, value in extra.items() if value is not None}
+            })
+    except ModelUnavailable as e:
+        # Breaker open and SKINVISION_DEGRADED_MODE=unavailable
+        return unavailable_response(e)
+    except UnidentifiedImageError:
+        return jsonify({'error': 'Could not decode image'}), 400
+    except ValueError as e:
+        # Bad ensemble model list or weights, or TTA for an ensemble
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        logger.error(f"Error during prediction: {str(e)}", exc_info=True)
+        logger.error("Error during prediction: %s", e, exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+def retry_after_header(error):
+    return str(max(1, math.ceil(error.retry_after)))
+
+def unavailable_response(error):
+    response = jsonify({'error': str(error), 'model': error.model_name})
+    response.headers['Retry-After'] = retry_after_header(error)
+    return response, 503
+
+def _batch_request_items():
+    """
+    Collect (name, source) pairs, model ids and top_k from a batch request, either
+    a JSON body with uploaded filenames or a multipart body with the images
+    (multipart bodies are still subject to MAX_CONTENT_LENGTH)
+    """
+    if request.files:
+        # Keep the (compressed) bytes; the upload streams are closed before
+        # the response body is generated. Decoding still happens per chunk.
+        items = [
+            (secure_filename(f.filename), io.BytesIO(f.read()))
+            for f in request.files.getlist('files')
+            if f.filename and allowed_file(f.filename)
+        ]
+        model_ids = request.form.getlist('models') or request.form.getlist('model')
+        model_ids = [m for value in model_ids for m in value.split(',') if m]
+        return items, model_ids, request.form.get('top_k')
+
+    data = request.get_json(silent=True)
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object')
+    filenames = data.get('filenames', [])
+    if not isinstance(filenames, list) or not all(isinstance(filename, str) for filename in filenames):
+        raise ValueError('filenames must be a list of strings')
+    model_ids = data.get('models') or data.get('model') or []
+    if isinstance(model_ids, str):
+        model_ids = [model_ids]
+    if not isinstance(model_ids, list) or not all(isinstance(model_id, str) for model_id in model_ids):
+        raise ValueError('models must be a model id or a list of model ids')
+    # Unknown uploads (source None) are reported per item
+    items = [(filename, upload_store.resolve(filename)) for filename in filenames]
+    return items, model_ids, data.get('top_k')
+
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """
+    Analyze many images with one or more models, streaming one result per
+    image and model as NDJSON (or SSE with Accept: text/event-stream)
+    """
+    try:
+        items, model_ids, top_k = _batch_request_items()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        top_k = parse_top_k(top_k)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'top_k must be a positive integer'}), 400
+
+    if not items:
+        return jsonify({'error': 'No images provided'}), 400
+    if not model_ids:
+        return jsonify({'error': 'Missing model selection'}), 400
+    unknown = [m for m in model_ids if m not in SERVING_MODELS]
+    if unknown:
+        return jsonify({'error': f"Unknown model(s): {', '.join(unknown)}"}), 400
+
+    use_sse = request.args.get('format') == 'sse' or 'text/event-stream' in request.headers.get('Accept', '')
+    chunk_size = max(1, app.config['BATCH_CHUNK_SIZE'])
+    g.log_fields['images'] = len(items)
+    g.log_fields['model'] = model_ids
+
+    def encode(record):
+        line = json.dumps(record)
+        return f"data: {line}\n\n" if use_sse else f"{line}\n"
+
+    def generate():
+        # Decode one chunk at a time and run it through every model before
+        # moving on, so only chunk_size images are held in memory at once.
+        # Models with the same input size share the decoded tensors, and
+        # each image and model is looked up in the prediction cache first.
+        for start in range(0, len(items), chunk_size):
+            chunk = list(enumerate(items[start:start + chunk_size], start))
+            inputs = {}
+            for model_id in model_ids:
+                size = MODEL_INPUT_SIZES[model_id]
+                if size not in inputs:
+                    inputs[size] = []
+                    for _, (_, source) in chunk:
+                        try:
+                            if source is None or isinstance(source, str) and not os.path.exists(source):
+                                raise FileNotFoundError('File not found')
+                            inputs[size].append(models.load_input(source, model_id))
+                        except Exception as e:
+                            inputs[size].append(e)
+
+                decoded, tensors, image_hashes = [], [], []
+                for (index, (filename, _)), loaded in zip(chunk, inputs[size]):
+                    if isinstance(loaded, Exception):
+                        yield encode({'index': index, 'filename': filename, 'model': model_id,
+                                      'success': False, 'error': str(loaded)})
+                    else:
+                        decoded.append((index, filename))
+                        tensors.append(loaded[0])
+                        image_hashes.append(loaded[1])
+                if not tensors:
+                    continue
+                try:
+                    batch_results = models.predict_tensors(tensors, model_id, top_k, image_hashes)
+                except ModelUnavailable as e:
+                    for index, filename in decoded:
+                        yield encode({'index': index, 'filename': filename, 'model': model_id,
+                                      'success': False, 'error': str(e)})
+                    continue
+                for (index, filename), results in zip(decoded, batch_results):
+                    yield encode({'index': index, 'filename': filename, 'model': model_id,
+                                  'success': True, 'results': results})
+        yield encode({'done': True, 'images': len(items), 'models': model_ids})
+
+    mimetype = 'text/event-stream' if use_sse else 'application/x-ndjson'
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    # Keep reverse proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# Most neighbours one /api/similar request returns
+MAX_SIMILAR = 100
+
+def parse_similar_request(data):
+    """
+    Validate an /api/similar body and return (filename, model, k)
+    """
+    if not isinstance(data, dict) or 'filename' not in data or 'model' not in data:
+        raise ValueError('Missing filename or model selection')
+    if data['model'] not in SERVING_MODELS:
+        raise ValueError(f"Unknown model: {data['model']}")
+    try:
+        k = int(data.get('k', 10))
+    except (TypeError, ValueError):
+        k = 0
+    if not 1 <= k <= MAX_SIMILAR:
+        raise ValueError(f"k must be an integer from 1 to {MAX_SIMILAR}")
+    return data['filename'], data['model'], k
+
+@app.route('/api/similar', methods=['POST'])
+def similar_cases():
+    # Previously analyzed cases closest to an uploaded image in the model's
+    # embedding space; the image itself is indexed if it was not yet
+    if not SIMILAR_DIR:
+        return jsonify({'error': 'Similar-case search is disabled'}), 404
+    try:
+        filename, model_name, k = parse_similar_request(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    g.log_fields['model'] = model_name
+
+    filepath = upload_store.resolve(filename)
+    if filepath is None:
+        return jsonify({'error': 'File not found'}), 404
+    try:
+        with timed('predict'):
+            results = models.find_similar(filepath, model_name, k)
+    except ModelUnavailable as e:
+        return unavailable_response(e)
+    except UnidentifiedImageError:
+        return jsonify({'error': 'Could not decode image'}), 400
+    except ValueError as e:
+        # Backend without embeddings
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error("Error during similar-case search: %s", e, exc_info=True)
+        return jsonify({'error': str(e)}), 500
+    return jsonify({'success': True, 'filename': filename, 'results': results})
+
+@app.route('/api/similar/stats', methods=['GET'])
+def similar_stats():
+    # Vector index sizes and search settings
+    return jsonify(models.get_similar_stats())
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(public_job(job))
+
+@app.route('/api/jobs/stats', methods=['GET'])
+def job_stats():
+    # Queue depth, wait and execution times of async analysis jobs
+    return jsonify(get_job_manager().stats())
+
 @app.route('/api/models', methods=['GET'])
 def get_models():
-    models = [
-        {
-            'id': 'inceptionv3',
-            'name': 'InceptionV3',
-            'description': 'Google InceptionV3 model trained for skin lesion classification'
-        },
-        {
-            'id': 'resnet50',
-            'name': 'ResNet50',
-            'description': 'ResNet50 model trained for skin lesion classification'
+    # Read from the training configs in results/, without importing the models
+    return jsonify(available_models())
+
+@app.route('/api/health', methods=['GET'])
+def health():
+    # Liveness plus per-model circuit breaker state; 'degraded' while any
+    # model is refused (the process itself stays healthy)
+    return jsonify(model_health())
+
+def model_health():
+    # No breakers yet while the inference code has not been imported
+    registry = models.registry if models.loaded else None
+    breakers = {model_name: breaker.status() for model_name, breaker in registry.breakers.items()} if registry else {}
+    healthy = all(breaker['state'] == 'closed' for breaker in breakers.values())
+    return {
+        'status': 'ok' if healthy else 'degraded',
+        'degraded_mode': DEGRADED_MODE,
+        'models': breakers,
+    }
+
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    # Readiness probe: only green once every model is loaded and warm
+    status = readiness()
+    return jsonify(status), 200 if status['ready'] else 503
+
+def readiness():
+    """
+    Model load state, CPU policy and how long startup took: the app import
+    and each deferred import (in seconds)
+    """
+    if models.loaded:
+        status = models.registry.status()
+    else:
+        status = {
+            'ready': False,
+            'loading': models.loading,
+            'models': {
+                model_name: {'loaded': False, 'warm': False, 'error': None}
+                for model_name in SERVING_MODELS
+            },
         }
-    ]
-    
-    return jsonify(models)
+    status['cpu'] = cpu_policy.current_policy()
+    status['startup'] = {
+        'app_import_seconds': APP_IMPORT_SECONDS,
+        'deferred_imports': dict(lazy_modules.import_seconds),
+    }
+    return status
+
+def admin_authorized(authorization):
+    token = app.config['ADMIN_TOKEN']
+    return bool(token) and hmac.compare_digest(authorization or '', f"Bearer {token}")
+
+def reload_model(model_name, checkpoint=None):
+    """
+    Hot-swap model_name to a new checkpoint: checkpoint is a file name in
+    the models directory, or None to reload its configured file. Returns
+    the response body and status code.
+    """
+    if model_name not in SERVING_MODELS:
+        return {'error': f"Unknown model: {model_name}"}, 404
+    checkpoint_path = None
+    if checkpoint:
+        if os.path.basename(checkpoint) != checkpoint or not checkpoint.endswith('.pth'):
+            return {'error': 'checkpoint must be a .pth file name in the models directory'}, 400
+        checkpoint_path = os.path.join(os.path.dirname(models.get_model_path(model_name)), checkpoint)
+        if not os.path.isfile(checkpoint_path):
+            return {'error': f"Checkpoint not found: {checkpoint}"}, 404
+    try:
+        entry = models.registry.reload(model_name, checkpoint_path)
+    except Exception as e:
+        return {'error': f"Reload failed, the previous version keeps serving: {e}"}, 500
+    return {
+        'success': True,
+        'model': model_name,
+        'version': entry.version,
+        'checkpoint': entry.checkpoint_path,
+    }, 200
+
+@app.route('/api/admin/models/<model_name>/reload', methods=['POST'])
+def admin_reload_model(model_name):
+    # Loads and warms the new weights while the current ones keep serving.
+    # Applies to this worker process; use the file watcher for all workers.
+    if not app.config['ADMIN_TOKEN']:
+        return jsonify({'error': 'Admin API disabled'}), 403
+    if not admin_authorized(request.headers.get('Authorization')):
+        return jsonify({'error': 'Unauthorized'}), 401
+    data = request.get_json(silent=True)
+    data = data if isinstance(data, dict) else {}
+    body, status = reload_model(model_name, data.get('checkpoint'))
+    return jsonify(body), status
+
+@app.route('/api/batching/stats', methods=['GET'])
+def batching_stats():
+    # Throughput/latency counters per model, used to tune the batch size
+    # and deadline (SKINVISION_BATCH_MAX_SIZE / SKINVISION_BATCH_MAX_WAIT_MS)
+    return jsonify(models.get_batching_stats())
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    # Prediction cache hit/miss/eviction counts for monitoring
+    return jsonify(models.get_cache_stats())
+
+@app.route('/api/uploads/stats', methods=['GET'])
+def upload_stats():
+    # Stored upload count and size against the retention limits
+    return jsonify(upload_store.stats())
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    # Stage latency histograms and counters in Prometheus text format
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+# How long importing the app took (with SKINVISION_EAGER_LOAD=blocking,
+# including loading the models)
+APP_IMPORT_SECONDS = round(time.perf_counter() - IMPORT_STARTED, 3)
+logger.info("App imported in %.2fs", APP_IMPORT_SECONDS)
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,73 @@
+"""
+Torch model architectures served by the backend.
+
+Imported by models.build_model when a model is first built, so processes
+that serve only ONNX graphs never import torch or torchvision.
+"""
+import torch
+import torch.nn as nn
+from torchvision import models
+
+# Define the SkinLesionClassifier class based on test.ipynb
+class SkinLesionClassifier(nn.Module):
+    def __init__(self, num_classes=40):  # Updated to 40 classes to match checkpoint
+        super(SkinLesionClassifier, self).__init__()
+        # Load ResNet50 and replace the final fc layer with custom layers
+        resnet = models.resnet50(pretrained=False)
+        
+        # Copy all layers except the final fc layer
+        self.conv1 = resnet.conv1
+        self.bn1 = resnet.bn1
+        self.relu = resnet.relu
+        self.maxpool = resnet.maxpool
+        self.layer1 = resnet.layer1
+        self.layer2 = resnet.layer2
+        self.layer3 = resnet.layer3
+        self.layer4 = resnet.layer4
+        self.avgpool = resnet.avgpool
+        
+        # Custom fc layers (matching the saved model structure exactly)
+        # The saved model has fc.0, fc.3, fc.6 as Linear layers
+        self.fc = nn.Sequential(
+            nn.Linear(2048, 512),      # fc.0 - matches fc.0.weight, fc.0.bias
+            nn.ReLU(inplace=True),     # fc.1 - ReLU activation
+            nn.Dropout(0.5),           # fc.2 - Dropout
+            nn.Linear(512, 256),       # fc.3 - matches fc.3.weight, fc.3.bias  
+            nn.ReLU(inplace=True),     # fc.4 - ReLU activation
+            nn.Dropout(0.3),           # fc.5 - Dropout
+            nn.Linear(256, num_classes)# fc.6 - matches fc.6.weight, fc.6.bias
+        )
+    
+    def forward(self, x):
+        x = self.conv1(x)
+        x = self.bn1(x)
+        x = self.relu(x)
+        x = self.maxpool(x)
+        
+        x = self.layer1(x)
+        x = self.layer2(x)
+        x = self.layer3(x)
+        x = self.layer4(x)
+        
+        x = self.avgpool(x)
+        x = torch.flatten(x, 1)
+        x = self.fc(x)
+        return x
+
+def create_model_architecture(model_name, num_classes):
+    """
+    Create the model architecture based on the model name
+    """
+    if model_name == 'resnet50':
+        model = SkinLesionClassifier(num_classes=num_classes)
+    elif model_name == 'inceptionv3':
+        # For inceptionv3, we'll still use the basic model for now
+        model = models.inception_v3(weights=None, aux_logits=False)
+        model.fc = nn.Linear(model.fc.in_features, num_classes)
+    elif model_name == 'skinnet':
+        # For skinnet, we'll use the SkinLesionClassifier as well
+        model = SkinLesionClassifier(num_classes=num_classes)
+    else:
+        raise ValueError(f"Unknown model: {model_name}")
+    
+    return model
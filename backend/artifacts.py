@@ -0,0 +1,35 @@
+"""
+Optimized model artifacts: which inference backends exist, where each
+backend's artifact for a checkpoint is stored and how it is loaded.
+
+Kept apart from optimize.py (which builds the artifacts with torch) so a
+process serving only ONNX graphs can load them without importing torch.
+"""
+import os
+
+BACKENDS = ('eager', 'torchscript', 'int8_dynamic', 'int8_static', 'channels_last', 'onnx')
+
+
+def artifact_path(checkpoint_path, backend):
+    """
+    Where the optimized artifact for a checkpoint and backend is stored
+    """
+    root, _ = os.path.splitext(checkpoint_path)
+    if backend == 'onnx':
+        return f"{root}.onnx"
+    return f"{root}.{backend}.pt"
+
+
+def load_artifact(path, intra_op_threads=0):
+    """
+    Load a saved optimized model. intra_op_threads (0 = default) limits the
+    threads of ONNX Runtime sessions; torch's intra-op pool is process-wide.
+    """
+    if path.endswith('.onnx'):
+        from onnx_runtime import INTRA_OP_THREADS, OnnxModel
+        return OnnxModel(path, intra_op_threads=intra_op_threads or INTRA_OP_THREADS)
+    import torch
+
+    model = torch.jit.load(path, map_location=torch.device('cpu'))
+    model.eval()
+    return model
@@ -0,0 +1,547 @@
+"""
+ASGI serving mode.
+
+Serves the /api/upload, /api/analyze and /api/models contract of app.py
+(plus readiness, job, stats and metrics endpoints) on an event loop.
+Request bodies are received and parsed asynchronously and upload-store
+I/O runs in a thread pool, while CPU-bound inference is handed to a
+bounded executor: once every inference thread is busy and
+SKINVISION_INFERENCE_QUEUE requests are waiting, further requests get
+429 with a Retry-After estimate instead of piling up threads.
+
+  pip install starlette uvicorn python-multipart
+  python serve.py --workers 4          # production launcher
+  uvicorn asgi:app --port 5000         # development
+
+  SKINVISION_INFERENCE_WORKERS  concurrent inference calls per process (default 2)
+  SKINVISION_INFERENCE_QUEUE    requests allowed to wait for one (default 16)
+
+Everything else (upload store, models, batching, logging) is configured
+as for the Flask app, which is imported for it. /api/analyze/batch is
+only served by the Flask app.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from PIL import UnidentifiedImageError
+from werkzeug.utils import secure_filename
+
+import app as wsgi
+from circuit_breaker import ModelUnavailable
+import metrics
+from metrics import timed
+from model_config import SIMILAR_DIR, available_models, store_upload_tensors
+from jobs import public_job
+from postprocessing import parse_top_k
+from tta import parse_tta
+from structured_logging import log_request
+from tensor_store import meta_path
+from upload_store import upload_id_for
+
+logger = logging.getLogger(__name__)
+
+config = wsgi.app.config
+upload_store = wsgi.upload_store
+# The inference code, imported on first use (see lazy_modules.py)
+models = wsgi.models
+
+
+def run_model(function_name, *args):
+    """
+    Call a function of models.py. Run off the event loop: the first call
+    may have to wait for the models to be imported.
+    """
+    return getattr(models, function_name)(*args)
+
+
+class ServerBusy(Exception):
+    """
+    Raised when the inference queue is full
+    """
+
+    def __init__(self, retry_after):
+        super(ServerBusy, self).__init__('Server busy, retry later')
+        self.retry_after = retry_after
+
+
+class RequestTooLarge(Exception):
+    """
+    Raised while receiving a body larger than MAX_CONTENT_LENGTH
+    """
+
+
+class InferenceExecutor:
+    """
+    Runs blocking calls on a fixed number of threads and admits at most
+    max_queue calls waiting for one; beyond that run() raises ServerBusy
+    """
+
+    def __init__(self, workers, max_queue):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.completed = 0
+        self.rejected = 0
+        self._pending = 0
+        self._service_time = None  # moving average, seconds
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='inference')
+
+    def retry_after(self):
+        # Seconds until the current backlog should have drained
+        service_time = self._service_time or 1.0
+        return max(1, math.ceil(self._pending * service_time / self.workers))
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                self.rejected += 1
+                metrics.overload_rejections_total.inc()
+                raise ServerBusy(self.retry_after())
+            self._pending += 1
+        # Run in a copy of the request's context so stage timings reach its trace
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, context.run, self._call, fn, args)
+
+    def _call(self, fn, args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                # Released here rather than by the awaiting request, so a
+                # disconnected client does not free a still-busy slot
+                self._pending -= 1
+                self.completed += 1
+                if self._service_time is None:
+                    self._service_time = elapsed
+                else:
+                    self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'pending': self._pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'avg_service_ms': round(self._service_time * 1000, 3) if self._service_time else None,
+            }
+
+
+inference = InferenceExecutor(
+    workers=int(os.environ.get('SKINVISION_INFERENCE_WORKERS', '2')),
+    max_queue=int(os.environ.get('SKINVISION_INFERENCE_QUEUE', '16')),
+)
+
+
+def error(message, status_code, headers=None):
+    return JSONResponse({'error': message}, status_code=status_code, headers=headers)
+
+
+def log_fields(request):
+    return request.scope['state']['log_fields']
+
+
+async def upload_file(request):
+    form = await request.form()
+    file = form.get('file')
+    if file is None or isinstance(file, str):
+        return error('No file part', 400)
+    if not file.filename:
+        return error('No selected file', 400)
+    if not wsgi.allowed_file(file.filename):
+        return error('File type not allowed', 400)
+
+    image_bytes = await file.read()
+    with timed('upload_save'):
+        filename, filepath, created = await run_in_threadpool(
+            upload_store.save, image_bytes, secure_filename(file.filename)
+        )
+    log_fields(request)['filename'] = filename
+
+    # Re-uploads of a stored image reuse its file and tensors
+    if config['PREPROCESS_ON_UPLOAD'] and (created or not os.path.exists(meta_path(filepath))):
+        # Decoding competes with inference for the CPU, so it shares the
+        # inference executor; when that is saturated the (optional) step
+        # is skipped and analysis decodes the file later
+        try:
+            with timed('upload_preprocess'):
+                await inference.run(store_upload_tensors, filepath)
+        except ServerBusy:
+            logger.debug("Skipped preprocessing %s: inference queue full", filepath)
+        except Exception as e:
+            logger.warning("Could not preprocess %s: %s", filepath, e)
+
+    return JSONResponse({
+        'success': True,
+        'filename': filename,
+        'message': 'File uploaded successfully'
+    })
+
+
+async def analyze_image(request, force_async=False):
+    mimetype = request.headers.get('content-type', '').split(';', 1)[0].strip().lower()
+    if mimetype == 'multipart/form-data' or mimetype in wsgi.IMAGE_MIMETYPES:
+        return await analyze_in_memory(request, mimetype, force_async)
+
+    body = await request.body()
+    if not body:
+        return error('Empty request body', 400)
+
+    with timed('request_parse'):
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return error('Invalid JSON body', 400)
+
+    if isinstance(data, dict) and 'models' in data:
+        # Ensemble: several model ids analyzed in one request
+        data['model'] = data['models']
+
+    if not isinstance(data, dict) or 'filename' not in data or 'model' not in data:
+        return error('Missing filename or model selection', 400)
+
+    original_filename = data['filename']
+    model_name = data['model']
+    log_fields(request)['model'] = model_name
+    try:
+        top_k = parse_top_k(data.get('top_k'))
+    except (TypeError, ValueError):
+        return error('top_k must be a positive integer', 400)
+    try:
+        tta_views = parse_tta(data.get('tta'))
+    except ValueError as e:
+        return error(str(e), 400)
+
+    filepath = await run_in_threadpool(upload_store.resolve, original_filename)
+    if filepath is None:
+        logger.warning("Upload not found: %s", original_filename)
+        return error('File not found', 404)
+
+    if force_async or data.get('async'):
+        try:
+            # Creating the job manager may import the models (off the loop)
+            job_manager = await run_in_threadpool(wsgi.get_job_manager)
+            job = await run_in_threadpool(
+                job_manager.submit,
+                {'filepath': filepath, 'model': model_name, 'top_k': top_k, 'weights': data.get('weights'),
+                 'tta': tta_views},
+                data.get('callback_url'),
+            )
+        except ValueError as e:
+            return error(str(e), 400)
+        log_fields(request)['job_id'] = job['id']
+        return JSONResponse({
+            'success': True,
+            'job_id': job['id'],
+            'status': job['status'],
+            'status_url': f"/api/jobs/{job['id']}"
+        }, status_code=202, headers={'Location': f"/api/jobs/{job['id']}"})
+
+    return await prediction_response(request, filepath, model_name, top_k, data.get('weights'), tta_views)
+
+
+async def submit_job(request):
+    return await analyze_image(request, force_async=True)
+
+
+async def analyze_in_memory(request, mimetype, force_async=False):
+    """
+    Analyze an image sent in the request itself (see app._analyze_in_memory)
+    """
+    if force_async:
+        return error('Async jobs need an uploaded filename', 400)
+
+    if mimetype == 'multipart/form-data':
+        params = await request.form()
+        file = params.get('file')
+        if file is None or isinstance(file, str) or not wsgi.allowed_file(file.filename or ''):
+            return error('Missing or unsupported image file', 400)
+        image_bytes = await file.read()
+        extension = file.filename.rsplit('.', 1)[1].lower()
+    else:
+        params = request.query_params
+        image_bytes = await request.body()
+        extension = wsgi.IMAGE_MIMETYPES[mimetype]
+    if not image_bytes:
+        return error('Empty image', 400)
+
+    model_ids = [m for value in params.getlist('models') for m in value.split(',') if m]
+    model_name = model_ids or params.get('model')
+    if not model_name:
+        return error('Missing model selection', 400)
+    log_fields(request)['model'] = model_name
+    try:
+        top_k = parse_top_k(params.get('top_k'))
+    except (TypeError, ValueError):
+        return error('top_k must be a positive integer', 400)
+    try:
+        weights = json.loads(params['weights']) if params.get('weights') else None
+    except ValueError:
+        return error('weights must be JSON', 400)
+    try:
+        tta_views = parse_tta(params.get('tta'))
+    except ValueError as e:
+        return error(str(e), 400)
+
+    filename = None
+    if params.get('persist', '').lower() in ('1', 'true', 'yes'):
+        filename = upload_id_for(image_bytes, f"upload.{extension}")
+        wsgi.persist_executor.submit(wsgi.persist_upload, image_bytes, filename)
+        log_fields(request)['filename'] = filename
+
+    return await prediction_response(request, image_bytes, model_name, top_k, weights, tta_views, filename=filename)
+
+
+async def prediction_response(request, image, model_name, top_k, weights, tta_views=None, **extra):
+    """
+    Run the prediction on the inference executor and build the
+    /api/analyze response
+    """
+    try:
+        with timed('predict'):
+            results = await inference.run(run_model, 'predict_with_model', image, model_name, top_k, weights, tta_views)
+    except ServerBusy as e:
+        return error(str(e), 429, headers={'Retry-After': str(e.retry_after)})
+    except ModelUnavailable as e:
+        return JSONResponse(
+            {'error': str(e), 'model': e.model_name}, status_code=503,
+            headers={'Retry-After': wsgi.retry_after_header(e)}
+        )
+    except UnidentifiedImageError:
+        return error('Could not decode image', 400)
+    except ValueError as e:
+        # Bad ensemble model list or weights, or TTA for an ensemble
+        return error(str(e), 400)
+    except Exception as e:
+        logger.error("Error during prediction: %s", e, exc_info=True)
+        return error(str(e), 500)
+
+    log_fields(request)['top1'] = results['top_prediction']['code']
+    log_fields(request)['top1_probability'] = results['top_prediction']['probability']
+    with timed('serialize'):
+        return JSONResponse({
+            'success': True,
+            'results': results,
+            **{key: value for key, value in extra.items() if value is not None}
+        })
+
+
+async def similar_cases(request):
+    """
+    Previously analyzed cases closest to an uploaded image (see
+    app.similar_cases)
+    """
+    if not SIMILAR_DIR:
+        return error('Similar-case search is disabled', 404)
+    try:
+        data = json.loads(await request.body())
+    except ValueError:
+        data = None
+    try:
+        filename, model_name, k = wsgi.parse_similar_request(data)
+    except ValueError as e:
+        return error(str(e), 400)
+    log_fields(request)['model'] = model_name
+
+    filepath = await run_in_threadpool(upload_store.resolve, filename)
+    if filepath is None:
+        return error('File not found', 404)
+    try:
+        with timed('predict'):
+            results = await inference.run(run_model, 'find_similar', filepath, model_name, k)
+    except ServerBusy as e:
+        return error(str(e), 429, headers={'Retry-After': str(e.retry_after)})
+    except ModelUnavailable as e:
+        return JSONResponse(
+            {'error': str(e), 'model': e.model_name}, status_code=503,
+            headers={'Retry-After': wsgi.retry_after_header(e)}
+        )
+    except UnidentifiedImageError:
+        return error('Could not decode image', 400)
+    except ValueError as e:
+        return error(str(e), 400)
+    except Exception as e:
+        logger.error("Error during similar-case search: %s", e, exc_info=True)
+        return error(str(e), 500)
+    return JSONResponse({'success': True, 'filename': filename, 'results': results})
+
+
+async def similar_stats(request):
+    return JSONResponse(await run_in_threadpool(run_model, 'get_similar_stats'))
+
+
+async def get_job(request):
+    job_manager = await run_in_threadpool(wsgi.get_job_manager)
+    job = job_manager.get(request.path_params['job_id'])
+    if job is None:
+        return error('Job not found', 404)
+    return JSONResponse(public_job(job))
+
+
+async def job_stats(request):
+    job_manager = await run_in_threadpool(wsgi.get_job_manager)
+    return JSONResponse(job_manager.stats())
+
+
+async def get_models(request):
+    return JSONResponse(await run_in_threadpool(available_models))
+
+
+async def health(request):
+    return JSONResponse(wsgi.model_health())
+
+
+async def ready(request):
+    status = wsgi.readiness()
+    return JSONResponse(status, status_code=200 if status['ready'] else 503)
+
+
+async def inference_stats(request):
+    # Inference executor occupancy and 429 rejections in this process
+    return JSONResponse(inference.stats())
+
+
+async def batching_stats(request):
+    return JSONResponse(await run_in_threadpool(run_model, 'get_batching_stats'))
+
+
+async def cache_stats(request):
+    return JSONResponse(await run_in_threadpool(run_model, 'get_cache_stats'))
+
+
+async def upload_stats(request):
+    return JSONResponse(await run_in_threadpool(upload_store.stats))
+
+
+async def prometheus_metrics(request):
+    return Response(metrics.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+async def admin_reload_model(request):
+    if not config['ADMIN_TOKEN']:
+        return error('Admin API disabled', 403)
+    if not wsgi.admin_authorized(request.headers.get('authorization')):
+        return error('Unauthorized', 401)
+    try:
+        data = json.loads(await request.body() or b'{}')
+    except ValueError:
+        data = {}
+    data = data if isinstance(data, dict) else {}
+    body, status_code = await run_in_threadpool(
+        wsgi.reload_model, request.path_params['model_name'], data.get('checkpoint')
+    )
+    return JSONResponse(body, status_code=status_code)
+
+
+async def request_too_large(request, exc):
+    return error('Request too large', 413)
+
+
+routes = [
+    Route('/api/upload', upload_file, methods=['POST']),
+    Route('/api/analyze', analyze_image, methods=['POST']),
+    Route('/api/jobs', submit_job, methods=['POST']),
+    Route('/api/similar', similar_cases, methods=['POST']),
+    Route('/api/similar/stats', similar_stats, methods=['GET']),
+    Route('/api/jobs/stats', job_stats, methods=['GET']),
+    Route('/api/jobs/{job_id}', get_job, methods=['GET']),
+    Route('/api/models', get_models, methods=['GET']),
+    Route('/api/health', health, methods=['GET']),
+    Route('/api/ready', ready, methods=['GET']),
+    Route('/api/inference/stats', inference_stats, methods=['GET']),
+    Route('/api/batching/stats', batching_stats, methods=['GET']),
+    Route('/api/cache/stats', cache_stats, methods=['GET']),
+    Route('/api/uploads/stats', upload_stats, methods=['GET']),
+    Route('/api/admin/models/{model_name}/reload', admin_reload_model, methods=['POST']),
+    Route('/metrics', prometheus_metrics, methods=['GET']),
+]
+
+# Metric and log label of each endpoint: its route pattern, as in app.py
+ENDPOINT_PATHS = {route.endpoint: route.path for route in routes}
+
+
+class RequestMiddleware:
+    """
+    The ASGI counterpart of app.py's request hooks: request id, stage
+    trace, metrics and summary log per request, plus the body size limit
+    """
+
+    def __init__(self, app, max_content_length):
+        self.app = app
+        self.max_content_length = max_content_length
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        headers = {key.decode('latin-1'): value.decode('latin-1') for key, value in scope['headers']}
+        request_id = headers.get('x-request-id') or uuid.uuid4().hex[:16]
+        stages, trace_token = metrics.start_request_trace()
+        scope.setdefault('state', {})['log_fields'] = {}
+        status_code = 500
+        received = 0
+
+        async def receive_limited():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.max_content_length:
+                    raise RequestTooLarge()
+            return message
+
+        async def send_with_request_id(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                message['headers'] = list(message.get('headers', [])) + [
+                    (b'x-request-id', request_id.encode('latin-1'))
+                ]
+            await send(message)
+
+        try:
+            if int(headers.get('content-length') or 0) > self.max_content_length:
+                await error('Request too large', 413)(scope, receive, send_with_request_id)
+            else:
+                await self.app(scope, receive_limited, send_with_request_id)
+        finally:
+            # stages stays readable for the summary below
+            metrics.end_request_trace(trace_token)
+            endpoint = ENDPOINT_PATHS.get(scope.get('endpoint'), 'unmatched')
+            duration = time.perf_counter() - started
+            metrics.request_seconds.observe(duration, endpoint=endpoint, method=scope['method'])
+            metrics.requests_total.inc(endpoint=endpoint, method=scope['method'], status=status_code)
+            log_request(
+                logger, request_id, endpoint, scope['method'], status_code, duration,
+                stages, **scope['state']['log_fields']
+            )
+
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=wsgi.CORS_ORIGINS, allow_methods=['*'], allow_headers=['*']),
+        Middleware(RequestMiddleware, max_content_length=config['MAX_CONTENT_LENGTH']),
+    ],
+    exception_handlers={RequestTooLarge: request_too_large},
+)
@@ -0,0 +1,167 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Collects single inference requests into small batches.
+
+    Callers submit one item at a time and get a Future back. A background
+    thread flushes the pending queue as soon as it holds max_batch_size
+    items or the oldest item has waited max_wait_ms, runs run_batch once
+    over the whole batch and hands each caller its own result.
+    """
+
+    def __init__(self, name, run_batch, max_batch_size=8, max_wait_ms=10.0):
+        self.name = name
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+
+        # Counters for tuning the batch size / deadline tradeoff
+        self._stats_lock = threading.Lock()
+        self._requests = 0
+        self._batches = 0
+        self._errors = 0
+        self._busy_time = 0.0
+        self._queue_wait_total = 0.0
+        self._batch_sizes = deque(maxlen=1024)
+        self._latencies = deque(maxlen=1024)
+        self._started_at = time.time()
+
+    def submit(self, item):
+        """
+        Queue one item for the next batch and return a Future for its result
+        """
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"Batcher for {self.name} is closed")
+            self._ensure_worker()
+            self._pending.append((item, future, time.perf_counter()))
+            self._cond.notify()
+        return future
+
+    def close(self):
+        """
+        Stop the worker thread once the queue has been drained
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join()
+
+    def _ensure_worker(self):
+        # Threads do not survive fork, so gunicorn workers start their own
+        # thread on first use instead of inheriting a dead one.
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._worker, name=f"batcher-{self.name}", daemon=True
+            )
+            self._thread.start()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                if self._closed:
+                    return None
+                self._cond.wait()
+
+            # Wait for more items until the batch is full or the oldest
+            # request hits its deadline.
+            deadline = self._pending[0][2] + self.max_wait
+            while len(self._pending) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            size = min(len(self._pending), self.max_batch_size)
+            return [self._pending.popleft() for _ in range(size)]
+
+    def _worker(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            items = [item for item, _, _ in batch]
+            started = time.perf_counter()
+            try:
+                results = self.run_batch(items)
+                if len(results) != len(items):
+                    raise RuntimeError(
+                        f"run_batch returned {len(results)} results for {len(items)} items"
+                    )
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                self._record(batch, started, failed=True)
+                continue
+
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+            self._record(batch, started)
+
+    def _record(self, batch, started, failed=False):
+        finished = time.perf_counter()
+        with self._stats_lock:
+            self._requests += len(batch)
+            self._batches += 1
+            if failed:
+                self._errors += 1
+            self._busy_time += finished - started
+            self._batch_sizes.append(len(batch))
+            for _, _, enqueued in batch:
+                self._queue_wait_total += started - enqueued
+                self._latencies.append(finished - enqueued)
+
+    def stats(self):
+        """
+        Snapshot of throughput and latency counters
+        """
+        with self._stats_lock:
+            latencies = sorted(self._latencies)
+            batch_sizes = list(self._batch_sizes)
+            requests = self._requests
+            batches = self._batches
+            busy_time = self._busy_time
+            queue_wait_total = self._queue_wait_total
+            errors = self._errors
+        with self._cond:
+            queue_depth = len(self._pending)
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            index = min(len(latencies) - 1, int(round(p / 100.0 * (len(latencies) - 1))))
+            return round(latencies[index] * 1000, 3)
+
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'queue_depth': queue_depth,
+            'requests': requests,
+            'batches': batches,
+            'errors': errors,
+            'avg_batch_size': round(sum(batch_sizes) / len(batch_sizes), 3) if batch_sizes else 0.0,
+            'avg_queue_wait_ms': round(queue_wait_total / requests * 1000, 3) if requests else 0.0,
+            'images_per_second': round(requests / busy_time, 3) if busy_time else 0.0,
+            'latency_ms': {
+                'p50': percentile(50),
+                'p95': percentile(95),
+                'p99': percentile(99),
+            },
+            'uptime_seconds': round(time.time() - self._started_at, 3),
+        }
@@ -0,0 +1,487 @@
+"""
+Inference benchmark suite and load generator.
+
+Measures the serving path on synthetic images so runs are comparable
+between releases and machines:
+
+  load        model load and warm-up time per model
+  preprocess  preprocess_image at several source resolutions
+  forward     each model's forward pass at several batch sizes
+  analyze     /api/upload + /api/analyze round trips per resolution and model
+  load_test   concurrent /api/analyze requests (in-process or against --url)
+
+Every stage reports p50/p95/p99 latency and images/sec; the report also
+records peak RSS and is written as JSON. Models whose checkpoint is
+missing or still a Git LFS pointer run with randomly initialized weights
+(flagged in the report), so the suite works on a fresh CPU-only checkout.
+
+Usage:
+  python benchmark.py --output results/benchmark_report.json
+  python benchmark.py --baseline results/benchmark_report.json --threshold 0.2
+
+With --baseline the run exits with status 1 if any p50 latency regressed
+by more than --threshold (a fraction) compared to the baseline report.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+
+# Measure real inference: no loading at import time and no cached predictions
+os.environ.setdefault('SKINVISION_EAGER_LOAD', 'off')
+os.environ['SKINVISION_CACHE_SIZE'] = '0'
+os.environ.pop('SKINVISION_CACHE_DIR', None)
+
+import numpy as np
+import torch
+from PIL import Image
+
+import models
+
+STAGES = ('load', 'preprocess', 'forward', 'analyze', 'load_test')
+LFS_POINTER_PREFIX = b'version https://git-lfs'
+
+
+def parse_resolution(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def synthetic_jpeg(width, height, seed=0, quality=90):
+    """
+    JPEG bytes of a smooth random image, so compression and decoding
+    behave roughly like a photo
+    """
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 256, size=(height // 32 + 1, width // 32 + 1, 3), dtype=np.uint8)
+    img = Image.fromarray(base).resize((width, height), Image.BICUBIC)
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def summarize(samples, images_per_sample=1):
+    """
+    Latency percentiles (ms) and throughput of a list of durations in seconds
+    """
+    values = sorted(samples)
+    if not values:
+        return {'count': 0}
+
+    def percentile(p):
+        index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+        return round(values[index] * 1000, 3)
+
+    mean = sum(values) / len(values)
+    return {
+        'count': len(values),
+        'mean_ms': round(mean * 1000, 3),
+        'p50_ms': percentile(50),
+        'p95_ms': percentile(95),
+        'p99_ms': percentile(99),
+        'images_per_second': round(images_per_sample / mean, 3) if mean else 0.0,
+    }
+
+
+def time_calls(fn, repeats, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process in MB, or None where the
+    resource module is unavailable
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def is_lfs_pointer(path):
+    with open(path, 'rb') as f:
+        return f.read(len(LFS_POINTER_PREFIX)) == LFS_POINTER_PREFIX
+
+
+def prepare_checkpoints(model_names, workdir, random_weights=False):
+    """
+    Point the model registry at usable checkpoints. Models whose checkpoint
+    is missing or an LFS pointer (or all models with random_weights) get a
+    randomly initialized checkpoint written to workdir. Returns
+    {model: {'checkpoint': path, 'random_weights': bool}}.
+    """
+    checkpoints = {}
+    for model_name in model_names:
+        path = models.get_model_path(model_name)
+        usable = os.path.exists(path) and not is_lfs_pointer(path)
+        if random_weights or not usable:
+            # Same file name as the real checkpoint, so models sharing a
+            # checkpoint (skinnet/resnet50) still share the random one
+            path = os.path.join(workdir, os.path.basename(path))
+            if not os.path.exists(path):
+                torch.manual_seed(0)
+                torch.save(models.build_model(model_name).state_dict(), path)
+        checkpoints[model_name] = {'checkpoint': path, 'random_weights': random_weights or not usable}
+
+    models.registry.get_checkpoint_path = lambda model_name: checkpoints[model_name]['checkpoint']
+    return checkpoints
+
+
+def bench_load(model_names):
+    results = []
+    for model_name in model_names:
+        started = time.perf_counter()
+        entry = models.registry.load(model_name)
+        load_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        models.registry.warm_up(entry, model_name)
+        warm_up_seconds = time.perf_counter() - started
+        results.append({
+            'stage': 'load',
+            'name': f"load/{model_name}",
+            'model': model_name,
+            'backend': entry.backend,
+            'mmapped': entry.mmapped,
+            'load_seconds': round(load_seconds, 3),
+            'warm_up_seconds': round(warm_up_seconds, 3),
+        })
+    return results
+
+
+def bench_preprocess(images, sizes, repeats):
+    results = []
+    for resolution, data in images.items():
+        for size in sizes:
+            samples = time_calls(lambda: models.preprocess_image(io.BytesIO(data), size), repeats)
+            results.append({
+                'stage': 'preprocess',
+                'name': f"preprocess/{resolution}/{size}",
+                'resolution': resolution,
+                'size': size,
+                **summarize(samples),
+            })
+    return results
+
+
+def distinct_models(model_names):
+    # Models sharing a loaded checkpoint would only be measured twice
+    seen = {}
+    for model_name in model_names:
+        seen.setdefault(id(models.registry.get_entry(model_name)), model_name)
+    return list(seen.values())
+
+
+def bench_forward(model_names, batch_sizes, repeats):
+    results = []
+    for model_name in distinct_models(model_names):
+        size = models.MODEL_INPUT_SIZES[model_name]
+        for batch_size in batch_sizes:
+            inputs = list(torch.randn(batch_size, 1, 3, size, size))
+            samples = time_calls(lambda: models.run_model_batch(model_name, inputs), repeats)
+            results.append({
+                'stage': 'forward',
+                'name': f"forward/{model_name}/batch{batch_size}",
+                'model': model_name,
+                'batch_size': batch_size,
+                **summarize(samples, images_per_sample=batch_size),
+            })
+    return results
+
+
+class InProcessClient:
+    """
+    Calls the Flask app directly through its test client
+    """
+
+    def __init__(self):
+        import app
+        self.client = app.app.test_client()
+
+    def upload(self, filename, data):
+        response = self.client.post(
+            '/api/upload', data={'file': (io.BytesIO(data), filename)},
+            content_type='multipart/form-data'
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"Upload failed ({response.status_code}): {response.get_data(as_text=True)}")
+        return response.get_json()['filename']
+
+    def analyze(self, filename, model_name):
+        response = self.client.post('/api/analyze', json={'filename': filename, 'model': model_name})
+        if response.status_code != 200:
+            raise RuntimeError(f"Analyze failed ({response.status_code})")
+        return response.get_json()
+
+    def remove(self, filename):
+        import app
+        app.upload_store.remove(filename)
+
+
+class HttpClient:
+    """
+    Calls a running backend over HTTP
+    """
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def _post(self, path, body, content_type):
+        request = urllib.request.Request(
+            f"{self.url}{path}", data=body, method='POST', headers={'Content-Type': content_type}
+        )
+        with urllib.request.urlopen(request, timeout=120) as response:
+            return json.loads(response.read())
+
+    def upload(self, filename, data):
+        boundary = uuid.uuid4().hex
+        body = (
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+            f"Content-Type: image/jpeg\r\n\r\n"
+        ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+        return self._post('/api/upload', body, f"multipart/form-data; boundary={boundary}")['filename']
+
+    def analyze(self, filename, model_name):
+        body = json.dumps({'filename': filename, 'model': model_name}).encode()
+        return self._post('/api/analyze', body, 'application/json')
+
+    def remove(self, filename):
+        # The API has no delete endpoint; uploads stay on the server
+        pass
+
+
+def upload_images(client, images):
+    uploaded = {}
+    for resolution, data in images.items():
+        uploaded[resolution] = client.upload(f"benchmark_{resolution}_{uuid.uuid4().hex[:8]}.jpg", data)
+    return uploaded
+
+
+def bench_analyze(client, uploaded, model_names, repeats):
+    results = []
+    for resolution, filename in uploaded.items():
+        for model_name in model_names:
+            samples = time_calls(lambda: client.analyze(filename, model_name), repeats)
+            results.append({
+                'stage': 'analyze',
+                'name': f"analyze/{resolution}/{model_name}",
+                'resolution': resolution,
+                'model': model_name,
+                **summarize(samples),
+            })
+    return results
+
+
+def bench_load_test(make_client, uploaded, model_names, concurrency, requests):
+    """
+    Issue requests /api/analyze calls from concurrency threads, cycling
+    through the uploaded images and models
+    """
+    work = [
+        (list(uploaded.values())[i % len(uploaded)], model_names[i % len(model_names)])
+        for i in range(requests)
+    ]
+    lock = threading.Lock()
+    samples = []
+    errors = []
+
+    def worker():
+        client = make_client()
+        while True:
+            with lock:
+                if not work:
+                    return
+                filename, model_name = work.pop()
+            started = time.perf_counter()
+            try:
+                client.analyze(filename, model_name)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                samples.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    summary = summarize(samples)
+    # Throughput of the whole run, not of a single request
+    summary['images_per_second'] = round(len(samples) / elapsed, 3) if elapsed else 0.0
+    return [{
+        'stage': 'load_test',
+        'name': f"load_test/concurrency{concurrency}",
+        'concurrency': concurrency,
+        'requests': requests,
+        'errors': len(errors),
+        'elapsed_seconds': round(elapsed, 3),
+        **summary,
+    }]
+
+
+def compare_reports(baseline, current, threshold):
+    """
+    Names of results whose p50 latency grew by more than threshold
+    (a fraction) relative to the baseline report
+    """
+    previous = {row['name']: row for row in baseline.get('results', []) if 'p50_ms' in row}
+    regressions = []
+    for row in current['results']:
+        before = previous.get(row['name'])
+        if before is None or 'p50_ms' not in row or not before['p50_ms']:
+            continue
+        change = row['p50_ms'] / before['p50_ms'] - 1
+        if change > threshold:
+            regressions.append({
+                'name': row['name'],
+                'baseline_p50_ms': before['p50_ms'],
+                'p50_ms': row['p50_ms'],
+                'change': round(change, 4),
+            })
+    return regressions
+
+
+def run(model_names=None, stages=STAGES, resolutions=((640, 480), (2048, 1536), (4032, 3024)),
+        batch_sizes=(1, 4, 8), repeats=10, concurrency=4, requests=40, url=None,
+        random_weights=False, workdir=None):
+    """
+    Run the selected stages and return the report
+    """
+    model_names = list(model_names or models.SERVING_MODELS)
+    images = {f"{width}x{height}": synthetic_jpeg(width, height) for width, height in resolutions}
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'torch': torch.__version__,
+            'torch_threads': torch.get_num_threads(),
+            'target': url or 'in-process',
+        },
+        'results': [],
+    }
+
+    if url is None:
+        workdir = workdir or tempfile.mkdtemp(prefix='skinvision-benchmark-')
+        checkpoints = prepare_checkpoints(model_names, workdir, random_weights)
+        report['checkpoints'] = checkpoints
+        if any(info['random_weights'] for info in checkpoints.values()):
+            print("Using randomly initialized weights for: " + ", ".join(
+                model_name for model_name, info in checkpoints.items() if info['random_weights']
+            ))
+        report['environment']['backends'] = {
+            model_name: models.get_backend(model_name) for model_name in model_names
+        }
+
+        if 'load' in stages:
+            print("Benchmarking model load...")
+            report['results'] += bench_load(model_names)
+        if 'preprocess' in stages:
+            print("Benchmarking preprocessing...")
+            sizes = sorted({models.MODEL_INPUT_SIZES[model_name] for model_name in model_names})
+            report['results'] += bench_preprocess(images, sizes, repeats)
+        if 'forward' in stages:
+            print("Benchmarking forward passes...")
+            report['results'] += bench_forward(model_names, batch_sizes, repeats)
+        make_client = InProcessClient
+    else:
+        make_client = lambda: HttpClient(url)
+
+    if 'analyze' in stages or 'load_test' in stages:
+        uploaded = upload_images(make_client(), images)
+        if 'analyze' in stages:
+            print("Benchmarking /api/analyze round trips...")
+            report['results'] += bench_analyze(make_client(), uploaded, model_names, repeats)
+        if 'load_test' in stages:
+            print(f"Running load test ({requests} requests, concurrency {concurrency})...")
+            report['results'] += bench_load_test(make_client, uploaded, model_names, concurrency, requests)
+        client = make_client()
+        for filename in uploaded.values():
+            client.remove(filename)
+
+    report['peak_rss_mb'] = peak_rss_mb()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark preprocessing, inference and the analyze API')
+    parser.add_argument('--model', nargs='+', default=models.SERVING_MODELS, choices=models.SERVING_MODELS)
+    parser.add_argument('--stage', nargs='+', default=list(STAGES), choices=STAGES)
+    parser.add_argument('--resolution', nargs='+', default=['640x480', '2048x1536', '4032x3024'],
+                        help='synthetic source image sizes, WIDTHxHEIGHT')
+    parser.add_argument('--batch-size', nargs='+', type=int, default=[1, 4, 8])
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=40, help='total requests in the load test')
+    parser.add_argument('--url', help='benchmark a running backend (analyze and load_test stages only)')
+    parser.add_argument('--random-weights', action='store_true',
+                        help='use random weights even when real checkpoints are present')
+    parser.add_argument('--output', default=os.path.join('results', 'benchmark_report.json'))
+    parser.add_argument('--baseline', help='earlier report to check for latency regressions')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed p50 latency increase over the baseline, as a fraction')
+    args = parser.parse_args()
+
+    report = run(
+        model_names=args.model,
+        stages=args.stage,
+        resolutions=[parse_resolution(value) for value in args.resolution],
+        batch_sizes=args.batch_size,
+        repeats=args.repeats,
+        concurrency=args.concurrency,
+        requests=args.requests,
+        url=args.url,
+        random_weights=args.random_weights,
+    )
+
+    for row in report['results']:
+        if 'p50_ms' in row:
+            print(f"{row['name']:<40} p50 {row['p50_ms']:>9.2f} ms  p95 {row['p95_ms']:>9.2f} ms  "
+                  f"p99 {row['p99_ms']:>9.2f} ms  {row['images_per_second']:>8.2f} img/s")
+        else:
+            print(f"{row['name']:<40} load {row['load_seconds']:.3f} s  warm-up {row['warm_up_seconds']:.3f} s")
+    print(f"Peak RSS: {report['peak_rss_mb']} MB")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_reports(baseline, report, args.threshold)
+        report['regressions'] = regressions
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+
+    if regressions:
+        for regression in regressions:
+            print(f"REGRESSION {regression['name']}: {regression['baseline_p50_ms']} ms -> "
+                  f"{regression['p50_ms']} ms ({regression['change']:+.0%})")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Per-model circuit breaker.
+
+A model that fails to load (e.g. a checkpoint that is still a Git LFS
+pointer) or whose forward pass fails is not tried again on every request:
+after failure_threshold consecutive failures its breaker opens and
+requests are refused immediately for a backoff window, which doubles
+after every failed retry up to max_backoff. Once the window has passed
+the breaker is half-open and requests may try the model again; the first
+success closes it, the first failure opens it again.
+"""
+import threading
+import time
+
+from metrics import breaker_transitions_total
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class ModelUnavailable(Exception):
+    """
+    Raised instead of using a model whose breaker is open
+    """
+
+    def __init__(self, model_name, retry_after, reason=None):
+        # The arguments, not the message, go to Exception so the error
+        # survives pickling (e.g. out of a job worker process)
+        super(ModelUnavailable, self).__init__(model_name, retry_after, reason)
+        self.model_name = model_name
+        self.retry_after = retry_after
+        self.reason = reason
+
+    def __str__(self):
+        return f"Model {self.model_name} is unavailable" + (f": {self.reason}" if self.reason else '')
+
+
+class CircuitBreaker:
+    """
+    Failure tracking and backoff for one model. clock returns the current
+    time in seconds for the backoff windows (tests pass a fake one).
+    """
+
+    def __init__(self, name, failure_threshold=1, backoff=30.0, max_backoff=600.0, clock=time.monotonic):
+        self.name = name
+        self.clock = clock
+        self.failure_threshold = failure_threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.failures = 0
+        self.opened = 0  # consecutive openings; sets the backoff window
+        self.last_error = None
+        self.last_failure_at = None
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened == 0:
+            return CLOSED
+        return OPEN if self.clock() < self._open_until else HALF_OPEN
+
+    def retry_after(self):
+        """
+        Seconds until the model may be tried again (0 when it may be now)
+        """
+        return max(0.0, self._open_until - self.clock())
+
+    def check(self):
+        """
+        Raise ModelUnavailable while the breaker is open
+        """
+        if self.opened and self.clock() < self._open_until:
+            raise ModelUnavailable(self.name, self.retry_after(), self.last_error)
+
+    def record_success(self):
+        if self.failures == 0 and self.opened == 0:
+            return
+        with self._lock:
+            was_open = self.opened > 0
+            self.failures = 0
+            self.opened = 0
+            self._open_until = 0.0
+        if was_open:
+            breaker_transitions_total.inc(model=self.name, state=CLOSED)
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            self.last_failure_at = time.time()
+            if self.failures < self.failure_threshold and self.opened == 0:
+                return
+            # Trip (or, after a failed half-open retry, re-trip) with a longer window
+            self.opened += 1
+            window = min(self.backoff * 2 ** (self.opened - 1), self.max_backoff)
+            self._open_until = self.clock() + window
+        breaker_transitions_total.inc(model=self.name, state=OPEN)
+
+    def status(self):
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'retry_after_seconds': round(self.retry_after(), 3),
+            'last_error': self.last_error,
+            'last_failure_at': self.last_failure_at,
+        }
@@ -0,0 +1,332 @@
+"""
+Threading and core affinity policy for CPU inference workers.
+
+With several Gunicorn (or uvicorn) workers each running torch with its
+default thread pool, N workers x all-cores threads fight over the same
+cores. This module owns the per-worker thread counts and, optionally,
+pins every worker to its own disjoint set of cores:
+
+  SKINVISION_INTRA_OP_THREADS   torch intra-op threads per worker (0 = torch default)
+  SKINVISION_INTER_OP_THREADS   torch inter-op threads per worker (0 = torch default)
+  SKINVISION_CPU_AFFINITY       off (default), auto (split the cores evenly between
+                                workers) or explicit core sets per worker, e.g. "0-3;4-7"
+  SKINVISION_THREAD_POLICY      manual (default) or auto: pick the workers x threads
+                                split by calibrating the forward pass at startup
+  SKINVISION_CALIBRATION_MODEL  model whose forward pass is calibrated (default resnet50)
+  SKINVISION_CALIBRATION_FILE   where the calibration result is kept between
+                                starts (default results/thread_policy.json)
+
+Thread settings are applied to every process that imports torch through
+models.py (processes serving only ONNX models never import it); worker
+slots and pinning need the Gunicorn hooks in gunicorn.conf.py:
+
+  gunicorn -c gunicorn.conf.py app:app
+"""
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+CALIBRATION_FILE = os.environ.get(
+    'SKINVISION_CALIBRATION_FILE', os.path.join(os.path.dirname(__file__), 'results', 'thread_policy.json')
+)
+
+# Settings applied in this process (reported by /api/ready)
+_policy = {}
+# Torch thread counts requested for this process, applied once torch is imported
+_thread_settings = {}
+
+
+def available_cores():
+    """
+    Cores this process may run on
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def parse_core_sets(value):
+    """
+    Parse "0-3;4-7" (or "0,1;2,3") into [[0, 1, 2, 3], [4, 5, 6, 7]]
+    """
+    core_sets = []
+    for group in value.split(';'):
+        cores = []
+        for part in group.split(','):
+            part = part.strip()
+            if not part:
+                continue
+            if '-' in part:
+                first, last = part.split('-', 1)
+                cores.extend(range(int(first), int(last) + 1))
+            else:
+                cores.append(int(part))
+        if cores:
+            core_sets.append(cores)
+    return core_sets
+
+
+def worker_core_sets(workers, cores=None):
+    """
+    Split the available cores into one disjoint, contiguous block per
+    worker (left-over cores go to the first blocks)
+    """
+    cores = cores or available_cores()
+    workers = max(1, min(workers, len(cores)))
+    size, extra = divmod(len(cores), workers)
+    core_sets, start = [], 0
+    for index in range(workers):
+        end = start + size + (1 if index < extra else 0)
+        core_sets.append(cores[start:end])
+        start = end
+    return core_sets
+
+
+def core_set_for(slot, workers):
+    """
+    Cores worker `slot` should be pinned to under SKINVISION_CPU_AFFINITY,
+    or None when pinning is off
+    """
+    setting = os.environ.get('SKINVISION_CPU_AFFINITY', 'off').strip()
+    if setting in ('', 'off', '0'):
+        return None
+    core_sets = worker_core_sets(workers) if setting == 'auto' else parse_core_sets(setting)
+    return core_sets[slot % len(core_sets)]
+
+
+def apply_thread_settings(intra_op_threads=None, inter_op_threads=None):
+    """
+    Set torch's intra- and inter-op thread pools for this process
+    (None reads the environment; 0 keeps torch's default). Until torch is
+    imported the counts are only recorded; import_torch applies them.
+    """
+    if intra_op_threads is None:
+        intra_op_threads = int(os.environ.get('SKINVISION_INTRA_OP_THREADS', '0'))
+    if inter_op_threads is None:
+        inter_op_threads = int(os.environ.get('SKINVISION_INTER_OP_THREADS', '0'))
+    _thread_settings.update(intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads)
+    if 'torch' in sys.modules:
+        _set_torch_threads()
+
+
+def import_torch():
+    """
+    Import torch and apply the thread settings of this process (those of
+    the environment unless apply_thread_settings was called) the first time
+    """
+    import torch
+
+    if 'intra_op_threads' not in _policy:
+        if _thread_settings:
+            _set_torch_threads()
+        else:
+            apply_thread_settings()
+    return torch
+
+
+def _set_torch_threads():
+    import torch
+
+    intra_op_threads = _thread_settings['intra_op_threads']
+    inter_op_threads = _thread_settings['inter_op_threads']
+    if intra_op_threads > 0:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads > 0:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError as e:
+            # Can only be set before the inter-op pool first runs work
+            logger.warning("Could not set inter-op threads to %d: %s", inter_op_threads, e)
+
+    _policy.update({
+        'intra_op_threads': torch.get_num_threads(),
+        'inter_op_threads': torch.get_num_interop_threads(),
+    })
+
+
+def pin_to_cores(cores):
+    """
+    Restrict this process to the given cores. Call it before the process
+    starts threads: threads inherit the affinity of their creator.
+    """
+    if not hasattr(os, 'sched_setaffinity'):
+        logger.warning("Core pinning is not supported on this platform")
+        return
+    os.sched_setaffinity(0, cores)
+    _policy['cores'] = sorted(cores)
+
+
+def configure_worker(slot, workers):
+    """
+    Apply the policy in worker `slot` of `workers`: pin it to its cores and
+    size its thread pools to them. Meant for Gunicorn's post_fork hook.
+    """
+    cores = core_set_for(slot, workers)
+    if cores:
+        pin_to_cores(cores)
+    intra_op_threads = int(os.environ.get('SKINVISION_INTRA_OP_THREADS', '0'))
+    if intra_op_threads <= 0 and cores:
+        # Pinned workers default to one thread per core they own
+        intra_op_threads = len(cores)
+    apply_thread_settings(intra_op_threads)
+    _policy.update({'worker_slot': slot, 'workers': workers})
+    logger.info("Worker %d/%d CPU policy: %s", slot, workers, _policy)
+    return dict(_policy)
+
+
+def current_policy():
+    """
+    Thread and affinity settings applied in this process
+    """
+    return dict(_policy)
+
+
+def _calibration_worker(model_name, cores, threads, batch_size, iterations, barrier, results, timeout):
+    import torch
+    import models
+
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(threads)
+    size = models.MODEL_INPUT_SIZES[model_name]
+    # Random weights: only the speed of the forward pass matters here
+    model = models.build_model(model_name).eval()
+    inputs = torch.randn(batch_size, 3, size, size)
+    with torch.inference_mode():
+        model(inputs)
+        # Raises BrokenBarrierError (and the worker exits) if another
+        # worker died instead of reaching the barrier
+        barrier.wait(timeout)
+        started = time.perf_counter()
+        for _ in range(iterations):
+            model(inputs)
+        elapsed = time.perf_counter() - started
+    results.put(batch_size * iterations / elapsed)
+
+
+def _collect(processes, results, deadline):
+    # One result per worker; fails as soon as a worker exits without one
+    values = []
+    while len(values) < len(processes):
+        try:
+            values.append(results.get(timeout=0.5))
+        except queue.Empty:
+            exitcodes = [process.exitcode for process in processes]
+            if any(code not in (None, 0) for code in exitcodes):
+                raise RuntimeError(f"worker exit codes {exitcodes}")
+            if time.monotonic() > deadline:
+                raise RuntimeError('timed out')
+    return values
+
+
+def default_plan(cores=None, model_name='resnet50'):
+    """
+    The plan used when calibration fails: one worker with a thread per core
+    """
+    cores = cores or available_cores()
+    return {'workers': 1, 'threads': len(cores), 'model': model_name, 'cores': cores, 'candidates': [],
+            'calibrated': False}
+
+
+def calibrate(model_name='resnet50', cores=None, batch_size=1, iterations=3, timeout=300):
+    """
+    Measure aggregate throughput (images/sec) of every workers x threads
+    split of the cores that uses all of them, running the workers
+    concurrently on disjoint cores, and return the fastest split with the
+    measurements. A split whose workers fail or take longer than timeout
+    seconds is skipped; if none succeeds, default_plan is returned.
+    """
+    cores = cores or available_cores()
+    context = multiprocessing.get_context('spawn')
+    candidates = []
+    for threads in range(1, len(cores) + 1):
+        if len(cores) % threads:
+            continue
+        workers = len(cores) // threads
+        barrier = context.Barrier(workers)
+        results = context.Queue()
+        processes = [
+            context.Process(
+                target=_calibration_worker,
+                args=(model_name, core_set, threads, batch_size, iterations, barrier, results, timeout),
+            )
+            for core_set in worker_core_sets(workers, cores)
+        ]
+        for process in processes:
+            process.start()
+        try:
+            throughput = sum(_collect(processes, results, time.monotonic() + timeout))
+        except RuntimeError as e:
+            logger.warning("Calibration %d workers x %d threads failed (%s); skipping it", workers, threads, e)
+            throughput = None
+        for process in processes:
+            process.join(timeout=5 if throughput is not None else 0)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        if throughput is None:
+            continue
+        candidates.append({'workers': workers, 'threads': threads, 'images_per_second': round(throughput, 3)})
+        logger.info("Calibration %d workers x %d threads: %.2f images/sec", workers, threads, throughput)
+
+    if not candidates:
+        logger.error("Thread calibration failed for every split; using %s", default_plan(cores, model_name))
+        return default_plan(cores, model_name)
+    best = max(candidates, key=lambda candidate: candidate['images_per_second'])
+    return {
+        'workers': best['workers'],
+        'threads': best['threads'],
+        'model': model_name,
+        'cores': cores,
+        'candidates': candidates,
+        'calibrated': True,
+    }
+
+
+def plan():
+    """
+    The workers x threads split to serve with under SKINVISION_THREAD_POLICY=auto.
+    Reuses the saved calibration when it was made for the same cores and
+    model, otherwise calibrates (a few seconds per candidate) and saves it.
+    A failed calibration falls back to default_plan and is not saved, so
+    the next start tries again.
+    """
+    model_name = os.environ.get('SKINVISION_CALIBRATION_MODEL', 'resnet50')
+    cores = available_cores()
+    try:
+        with open(CALIBRATION_FILE) as f:
+            saved = json.load(f)
+        if saved.get('cores') == cores and saved.get('model') == model_name:
+            return saved
+    except (OSError, ValueError):
+        pass
+
+    result = calibrate(model_name, cores)
+    if not result['calibrated']:
+        return result
+    try:
+        os.makedirs(os.path.dirname(CALIBRATION_FILE), exist_ok=True)
+        with open(CALIBRATION_FILE, 'w') as f:
+            json.dump(result, f, indent=2)
+    except OSError as e:
+        logger.warning("Could not save thread calibration: %s", e)
+    return result
+
+
+def apply_plan(result):
+    """
+    Export a plan's thread count so workers started afterwards use it,
+    and return its worker count
+    """
+    os.environ['SKINVISION_INTRA_OP_THREADS'] = str(result['threads'])
+    if os.environ.get('SKINVISION_CPU_AFFINITY', 'off') in ('', 'off', '0'):
+        # The calibration measured workers on disjoint cores
+        os.environ['SKINVISION_CPU_AFFINITY'] = 'auto'
+    logger.info("Thread policy: %d workers x %d threads", result['workers'], result['threads'])
+    return result['workers']
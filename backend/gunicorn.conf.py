@@ -0,0 +1,33 @@
+"""
+Gunicorn configuration applying the CPU policy of cpu_policy.py:
+
+  gunicorn -c gunicorn.conf.py app:app
+
+Every worker gets a stable slot (reused when a worker is replaced) that
+selects its core set under SKINVISION_CPU_AFFINITY. With
+SKINVISION_THREAD_POLICY=auto the worker count and threads per worker
+come from a startup calibration instead of SKINVISION_WORKERS and
+SKINVISION_INTRA_OP_THREADS.
+"""
+import os
+
+import cpu_policy
+
+bind = f"{os.environ.get('SKINVISION_HOST', '127.0.0.1')}:{os.environ.get('SKINVISION_PORT', '5000')}"
+workers = int(os.environ.get('SKINVISION_WORKERS', '1'))
+timeout = 120
+
+
+def on_starting(server):
+    if os.environ.get('SKINVISION_THREAD_POLICY', 'manual') == 'auto':
+        server.num_workers = cpu_policy.apply_plan(cpu_policy.plan())
+
+
+def pre_fork(server, worker):
+    # Runs in the master, so slots of live workers are known
+    taken = {getattr(other, 'cpu_slot', None) for other in server.WORKERS.values()}
+    worker.cpu_slot = next(slot for slot in range(len(taken) + 1) if slot not in taken)
+
+
+def post_fork(server, worker):
+    cpu_policy.configure_worker(worker.cpu_slot, server.num_workers)
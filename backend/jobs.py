@@ -0,0 +1,393 @@
+"""
+Asynchronous analysis jobs.
+
+POST /api/analyze with "async": true (or POST /api/jobs) returns a job id
+straight away. A dispatcher thread feeds queued jobs to a pool of
+inference workers; clients poll GET /api/jobs/<id> or pass a callback_url
+that receives the finished job as a JSON POST.
+
+Queueing and job state go through a small backend interface. The bundled
+LocalQueueBackend keeps both in this process, so with several web workers
+a client must poll the worker that accepted its job (or use a callback);
+a shared backend such as Redis only has to implement the same methods.
+
+Callbacks go to the hosts in allowed_callback_hosts; without an allowlist
+only hosts that resolve to public addresses are accepted (no loopback,
+private, link-local or reserved ones). The host is checked again right
+before the POST, which then connects to the address that was checked
+rather than resolving the name a second time; redirects are not followed.
+"""
+import http.client
+import ipaddress
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+import time
+import urllib.parse
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+
+
+class LocalQueueBackend:
+    """
+    In-process job queue and job store.
+
+    Interface expected by JobManager:
+      enqueue(job)              persist a new job and queue its id
+      dequeue(timeout)          next queued job id, or None after timeout
+      save(job) / load(job_id)  persist / fetch a job record
+      depth()                   number of queued jobs
+    """
+
+    def __init__(self, max_jobs=10000, ttl_seconds=3600):
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.max_jobs = max_jobs
+        self.ttl_seconds = ttl_seconds
+
+    def enqueue(self, job):
+        self.save(job)
+        self._queue.put(job['id'])
+
+    def dequeue(self, timeout=None):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def save(self, job):
+        with self._lock:
+            self._jobs[job['id']] = dict(job)
+            self._expire()
+
+    def load(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def _expire(self):
+        # Forget finished jobs after ttl_seconds, and the oldest ones once
+        # more than max_jobs are stored
+        now = time.time()
+        finished = (JOB_SUCCEEDED, JOB_FAILED)
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job['status'] in finished and now - (job.get('finished_at') or now) > self.ttl_seconds
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+        if len(self._jobs) > self.max_jobs:
+            oldest = sorted(
+                (job['created_at'], job_id) for job_id, job in self._jobs.items()
+                if job['status'] in finished
+            )
+            for _, job_id in oldest[:len(self._jobs) - self.max_jobs]:
+                del self._jobs[job_id]
+
+
+def is_public_address(address):
+    """
+    Whether an IP address is globally routable, i.e. not loopback,
+    private, link-local, reserved, multicast or unspecified
+    """
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+class _PinnedHTTPConnection(http.client.HTTPConnection):
+    # Connects to a vetted address (None: resolve the host as usual) while
+    # the Host header still names the host
+    def __init__(self, host, address=None, **kwargs):
+        super().__init__(host, **kwargs)
+        self.address = address
+
+    def connect(self):
+        self.sock = socket.create_connection((self.address or self.host, self.port), self.timeout)
+
+
+class _PinnedHTTPSConnection(http.client.HTTPSConnection):
+    # Same for https; SNI and certificate checks use the host name
+    def __init__(self, host, address=None, **kwargs):
+        super().__init__(host, **kwargs)
+        self.address = address
+
+    def connect(self):
+        sock = socket.create_connection((self.address or self.host, self.port), self.timeout)
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+
+def _timed_call(run_job, payload):
+    # Runs in the worker; times the job itself, excluding pool overhead
+    started = time.time()
+    result = run_job(payload)
+    return started, time.time(), result
+
+
+class JobManager:
+    """
+    Runs queued jobs on a pool of inference workers and records queue
+    depth, wait time and execution time per job
+    """
+
+    def __init__(self, run_job, backend=None, workers=2, use_processes=True,
+                 start_method='spawn', initializer=None, callback_timeout=5, allowed_callback_hosts=None):
+        self.run_job = run_job
+        self.initializer = initializer
+        self.backend = backend or LocalQueueBackend()
+        self.workers = max(1, int(workers))
+        self.use_processes = use_processes
+        self.start_method = start_method
+        self.callback_timeout = callback_timeout
+        self.allowed_callback_hosts = allowed_callback_hosts
+
+        self._executor = None
+        self._dispatcher = None
+        self._pid = None
+        self._slots = threading.Semaphore(self.workers)
+        self._start_lock = threading.Lock()
+        self._callbacks = ThreadPoolExecutor(max_workers=2, thread_name_prefix='job-callback')
+
+        self._stats_lock = threading.Lock()
+        self._running = 0
+        self._counts = {'submitted': 0, JOB_SUCCEEDED: 0, JOB_FAILED: 0, 'callbacks_failed': 0}
+        self._wait_times = deque(maxlen=1024)
+        self._exec_times = deque(maxlen=1024)
+
+    def _new_executor(self):
+        if self.use_processes:
+            return ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(self.start_method),
+                initializer=self.initializer,
+            )
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job-worker')
+
+    def _ensure_started(self):
+        # Pools and threads do not survive fork, so each web worker
+        # process starts its own on first use
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._executor = self._new_executor()
+            self._dispatcher = threading.Thread(target=self._dispatch, name='job-dispatcher', daemon=True)
+            self._pid = os.getpid()
+            self._dispatcher.start()
+
+    def _replace_broken_executor(self, broken):
+        # A worker process died: the pool is unusable from now on, so start
+        # a new one (once, however many jobs noticed)
+        with self._start_lock:
+            if self._executor is broken:
+                logger.error("Job worker pool broken, starting a new one")
+                broken.shutdown(wait=False)
+                self._executor = self._new_executor()
+            return self._executor
+
+    def validate_callback_url(self, callback_url):
+        """
+        Only http(s) callbacks to an allowed host: one of
+        allowed_callback_hosts, or without an allowlist a host whose
+        addresses are all public
+        """
+        self._callback_address(callback_url)
+        return callback_url
+
+    def _callback_address(self, callback_url):
+        # The checked address to connect to, or None for allowlisted hosts
+        parsed = urllib.parse.urlparse(callback_url)
+        if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+            raise ValueError('callback_url must be an http(s) URL')
+        if self.allowed_callback_hosts:
+            if parsed.hostname not in self.allowed_callback_hosts:
+                raise ValueError(f"callback host not allowed: {parsed.hostname}")
+            return None
+        try:
+            port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+            addresses = [info[4][0] for info in socket.getaddrinfo(parsed.hostname, port, proto=socket.IPPROTO_TCP)]
+        except (OSError, ValueError) as e:
+            raise ValueError(f"callback host cannot be resolved: {parsed.hostname}") from e
+        if not addresses or not all(is_public_address(address) for address in addresses):
+            raise ValueError(f"callback host not allowed: {parsed.hostname} is not a public address")
+        return addresses[0]
+
+    def submit(self, payload, callback_url=None):
+        """
+        Queue a job and return its record
+        """
+        if callback_url:
+            self.validate_callback_url(callback_url)
+        self._ensure_started()
+        job = {
+            'id': uuid.uuid4().hex,
+            'status': JOB_QUEUED,
+            'payload': payload,
+            'callback_url': callback_url,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'wait_ms': None,
+            'execution_ms': None,
+            'result': None,
+            'error': None,
+        }
+        self.backend.enqueue(job)
+        with self._stats_lock:
+            self._counts['submitted'] += 1
+        return job
+
+    def get(self, job_id):
+        return self.backend.load(job_id)
+
+    def _dispatch(self):
+        while True:
+            # Only take a job off the queue when a worker is free, so the
+            # queue depth reflects jobs that are actually waiting
+            self._slots.acquire()
+            job_id = self.backend.dequeue(timeout=None)
+            job = self.backend.load(job_id) if job_id else None
+            if job is None:
+                self._slots.release()
+                continue
+
+            job['status'] = JOB_RUNNING
+            job['started_at'] = time.time()
+            self.backend.save(job)
+            with self._stats_lock:
+                self._running += 1
+            executor = self._executor
+            try:
+                try:
+                    future = executor.submit(_timed_call, self.run_job, job['payload'])
+                except BrokenProcessPool:
+                    # Broken before this job reached it; run it on a new pool
+                    executor = self._replace_broken_executor(executor)
+                    future = executor.submit(_timed_call, self.run_job, job['payload'])
+            except Exception as e:
+                self._finish(job, error=e)
+                continue
+            future.add_done_callback(lambda f, job=job, executor=executor: self._finish(job, f, executor=executor))
+
+    def _finish(self, job, future=None, error=None, executor=None):
+        try:
+            if error is None:
+                error = future.exception()
+                if isinstance(error, BrokenProcessPool):
+                    # Every job running in the pool fails with the worker
+                    self._replace_broken_executor(executor)
+                    error = RuntimeError(f"Inference worker process died: {error}")
+            if error is None:
+                started, finished, result = future.result()
+                job['status'] = JOB_SUCCEEDED
+                job['result'] = result
+                job['started_at'] = started
+            else:
+                finished = time.time()
+                job['status'] = JOB_FAILED
+                job['error'] = str(error)
+            job['finished_at'] = finished
+            job['wait_ms'] = round((job['started_at'] - job['created_at']) * 1000, 3)
+            job['execution_ms'] = round((finished - job['started_at']) * 1000, 3)
+            self.backend.save(job)
+
+            with self._stats_lock:
+                self._counts[job['status']] += 1
+                self._wait_times.append(job['wait_ms'])
+                self._exec_times.append(job['execution_ms'])
+        finally:
+            with self._stats_lock:
+                self._running -= 1
+            self._slots.release()
+
+        if job.get('callback_url'):
+            self._callbacks.submit(self._send_callback, job)
+
+    def _send_callback(self, job):
+        body = json.dumps(public_job(job)).encode()
+        parsed = urllib.parse.urlparse(job['callback_url'])
+        path = (parsed.path or '/') + (f"?{parsed.query}" if parsed.query else '')
+        connection = None
+        try:
+            # The host may resolve differently than when the job was submitted,
+            # or between this check and the connection: connect to the
+            # address that was checked
+            address = self._callback_address(job['callback_url'])
+            connection_class = _PinnedHTTPSConnection if parsed.scheme == 'https' else _PinnedHTTPConnection
+            port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+            connection = connection_class(parsed.hostname, address, port=port, timeout=self.callback_timeout)
+            connection.request('POST', path, body=body, headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            # Redirects are not followed: they could point at an internal address
+            if response.status >= 300:
+                raise RuntimeError(f"HTTP {response.status}")
+        except Exception as e:
+            logger.warning("Job callback to %s failed: %s", job['callback_url'], e)
+            with self._stats_lock:
+                self._counts['callbacks_failed'] += 1
+        finally:
+            if connection is not None:
+                connection.close()
+
+    def stats(self):
+        with self._stats_lock:
+            counts = dict(self._counts)
+            running = self._running
+            wait_times = sorted(self._wait_times)
+            exec_times = sorted(self._exec_times)
+
+        def summary(values):
+            if not values:
+                return {'avg': 0.0, 'p50': 0.0, 'p95': 0.0, 'max': 0.0}
+            pick = lambda p: values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+            return {
+                'avg': round(sum(values) / len(values), 3),
+                'p50': pick(50),
+                'p95': pick(95),
+                'max': values[-1],
+            }
+
+        return {
+            'workers': self.workers,
+            'worker_type': 'process' if self.use_processes else 'thread',
+            'queue_depth': self.backend.depth(),
+            'running': running,
+            **counts,
+            'wait_ms': summary(wait_times),
+            'execution_ms': summary(exec_times),
+        }
+
+
+def public_job(job):
+    """
+    Job record as returned to clients
+    """
+    return {
+        'job_id': job['id'],
+        'status': job['status'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+        'wait_ms': job['wait_ms'],
+        'execution_ms': job['execution_ms'],
+        'results': job['result'],
+        'error': job['error'],
+    }
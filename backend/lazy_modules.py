@@ -0,0 +1,79 @@
+"""
+Deferred imports of the ML modules.
+
+Importing models.py pulls in torch and torchvision, which takes seconds.
+The HTTP layer refers to it through a LazyModule instead, so the server
+starts without it: the module is imported by the first request that runs
+a model, or ahead of that on a background thread at startup
+(SKINVISION_EAGER_LOAD). How long each deferred import took is recorded
+for the startup report (/api/ready and startup_report.py).
+"""
+import importlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Module name -> seconds its deferred import took
+import_seconds = {}
+
+
+class LazyModule:
+    """
+    Stands in for a module until one of its attributes is used, which
+    imports it (once, whichever thread gets there first)
+    """
+
+    def __init__(self, name, on_import=None):
+        self._name = name
+        # Called with the module once it is imported, e.g. to start its threads
+        self._on_import = on_import
+        self._module = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    @property
+    def loading(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def load(self):
+        """
+        Import the module if it is not imported yet and return it
+        """
+        module = self._module
+        if module is not None:
+            return module
+        with self._lock:
+            if self._module is None:
+                start = time.perf_counter()
+                module = importlib.import_module(self._name)
+                import_seconds[self._name] = round(time.perf_counter() - start, 3)
+                logger.info("Imported %s in %.2fs", self._name, import_seconds[self._name])
+                if self._on_import is not None:
+                    self._on_import(module)
+                self._module = module
+            return self._module
+
+    def load_in_background(self, then=None):
+        """
+        Import the module on a daemon thread, then call then(module)
+        """
+        def run():
+            try:
+                module = self.load()
+                if then is not None:
+                    then(module)
+            except Exception as e:
+                logger.error("Failed to import %s: %s", self._name, e)
+
+        self._thread = threading.Thread(target=run, name=f"import-{self._name}", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def __getattr__(self, attribute):
+        return getattr(self.load(), attribute)
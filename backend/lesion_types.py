@@ -0,0 +1,43 @@
+# Dictionary of skin lesion types
+LESION_TYPES = {
+    'acb': 'melanocytic, benign, banal, compound, acral',
+    'acd': 'melanocytic, benign, dysplastic, compound, acral',
+    'ajb': 'melanocytic, benign, banal, junctional, acral',
+    'ajd': 'melanocytic, benign, dysplastic, junctional, acral',
+    'ak': 'nonmelanocytic, indeterminate, keratinocytic, keratinocytic, actinic_keratosis',
+    'alm': 'melanocytic, malignant, melanoma, melanoma, acral_lentiginious',
+    'angk': 'nonmelanocytic, benign, vascular, vascular, angiokeratoma',
+    'anm': 'melanocytic, malignant, melanoma, melanoma, acral_nodular',
+    'bcc': 'nonmelanocytic, malignant, keratinocytic, keratinocytic, basal_cell_carcinoma',
+    'bd': 'nonmelanocytic, malignant, keratinocytic, keratinocytic, bowen_disease',
+    'bdb': 'melanocytic, benign, banal, dermal, blue',
+    'cb': 'melanocytic, benign, banal, compound, compound',
+    'ccb': 'melanocytic, benign, banal, compound, congenital',
+    'ccd': 'melanocytic, benign, dysplastic, compound, congenital',
+    'cd': 'melanocytic, benign, dysplastic, compound, compound',
+    'ch': 'nonmelanocytic, malignant, keratinocytic, keratinocytic, cutaneous_horn',
+    'cjb': 'melanocytic, benign, banal, junctional, congenital',
+    'db': 'melanocytic, benign, banal, dermal, dermal',
+    'df': 'nonmelanocytic, benign, fibro_histiocytic, fibro_histiocytic, dermatofibroma',
+    'dfsp': 'nonmelanocytic, malignant, fibro_histiocytic, fibro_histiocytic, dermatofibrosarcoma_protuberans',
+    'ha': 'nonmelanocytic, benign, vascular, vascular, hemangioma',
+    'isl': 'melanocytic, neging, lentigo, lentigo, ink_spot_lentigo',
+    'jb': 'melanocytic, benign, banal, junctional, junctional',
+    'jd': 'melanocytic, benign, dysplastic, junctional, junctional',
+    'ks': 'nonmelanocytic, malignant, vascular, vascular, kaposi_sarcoma',
+    'la': 'nonmelanocytic, benign, vascular, vascular, lymphangioma',
+    'lk': 'nonmelanocytic, benign, keratinocytic, keratinocytic, lichenoid_keratosis',
+    'lm': 'melanocytic, malignant, melanoma, melanoma, lentigo_maligna',
+    'lmm': 'melanocytic, malignant, melanoma, melanoma, lentigo_maligna_melanoma',
+    'ls': 'melanocytic, benign, lentigo, lentigo, lentigo_simplex',
+    'mcb': 'melanocytic, benign, banal, compound, Miescher',
+    'mel': 'melanocytic, malignant, melanoma, melanoma, melanoma',
+    'mpd': 'nonmelanocytic, malignant, keratinocytic, keratinocytic, mammary_paget_disease',
+    'pg': 'nonmelanocytic, benign, vascular, vascular, pyogenic_granuloma',
+    'rd': 'melanocytic, benign, dysplastic, recurrent, recurrent',
+    'sa': 'nonmelanocytic, benign, vascular, vascular, spider_angioma',
+    'scc': 'nonmelanocytic, malignant, keratinocytic, keratinocytic, squamous_cell_carcinoma',
+    'sk': 'nonmelanocytic, benign, keratinocytic, keratinocytic, seborrheic_keratosis',
+    'sl': 'melanocytic, benign, lentigo, lentigo, solar_lentigo',
+    'srjd': 'melanocytic, benign, dysplastic, junctional, spitz_reed'
+}
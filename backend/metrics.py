@@ -0,0 +1,216 @@
+"""
+Request and pipeline metrics in Prometheus text format.
+
+Dependency-free counters and histograms cheap enough for the hot path
+(one perf_counter pair, a bisect and a short lock per observation).
+Every stage of an analysis is timed into skinvision_stage_seconds (and
+into the per-request trace used for the request log summary), e.g.
+
+    with timed('decode'):
+        img = decode_image(...)
+
+and GET /metrics renders everything registered here. Values are per
+process: with several Gunicorn workers each scrape sees one worker.
+"""
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+
+# Seconds; covers sub-millisecond cache hits up to slow first model loads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_metrics = []
+
+# Stage timings of the request currently being handled (see start_request_trace)
+_request_stages = contextvars.ContextVar('skinvision_request_stages', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic counter, optionally split by labels
+    """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Cumulative histogram of observed values, optionally split by labels
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, **labels):
+        return Span(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_number(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_number(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Span:
+    """
+    Context manager recording its duration (seconds) into a histogram
+    """
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class StageSpan(Span):
+    """
+    Span over one stage; also adds its duration to the current request's
+    trace when there is one
+    """
+    __slots__ = ()
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.started
+        self.histogram.observe(elapsed, **self.labels)
+        stages = _request_stages.get()
+        if stages is not None:
+            stage = self.labels['stage']
+            stages[stage] = stages.get(stage, 0.0) + elapsed
+        return False
+
+
+stage_seconds = Histogram(
+    'skinvision_stage_seconds', 'Time spent in each stage of upload and analysis', ['stage']
+)
+request_seconds = Histogram(
+    'skinvision_request_seconds', 'HTTP request duration by endpoint', ['endpoint', 'method']
+)
+requests_total = Counter(
+    'skinvision_requests_total', 'HTTP requests by endpoint and status code', ['endpoint', 'method', 'status']
+)
+simulation_fallbacks_total = Counter(
+    'skinvision_simulation_fallbacks_total', 'Predictions served by the simulation fallback', ['model']
+)
+cache_lookups_total = Counter(
+    'skinvision_cache_lookups_total', 'Prediction cache lookups by result (hit or miss)', ['result']
+)
+model_loads_total = Counter(
+    'skinvision_model_loads_total', 'Models loaded from disk', ['model', 'backend']
+)
+breaker_transitions_total = Counter(
+    'skinvision_breaker_transitions_total', 'Model circuit breakers opening and closing', ['model', 'state']
+)
+overload_rejections_total = Counter(
+    'skinvision_overload_rejections_total', 'Requests rejected with 429 because the inference queue was full'
+)
+
+
+def timed(stage):
+    """
+    Time a block into skinvision_stage_seconds{stage=...}
+    """
+    return StageSpan(stage_seconds, {'stage': stage})
+
+
+def start_request_trace():
+    """
+    Collect the stage timings of the current request (thread or context)
+    into a fresh dict of stage -> seconds. Returns the dict and the token
+    to pass to end_request_trace once the request is done.
+    """
+    stages = {}
+    return stages, _request_stages.set(stages)
+
+
+def end_request_trace(token):
+    """
+    Stop collecting into the trace started with token, so work done later
+    in the same thread or context is not added to a finished request
+    """
+    _request_stages.reset(token)
+
+
+def render():
+    """
+    All registered metrics in the Prometheus text exposition format
+    """
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
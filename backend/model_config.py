@@ -0,0 +1,156 @@
+"""
+Model configuration that is cheap to import.
+
+Which models are served, their architectures, input sizes and checkpoint
+paths, the serving options read from the environment, and the model list
+of /api/models with what the training configs in results/ record. None of this
+needs torch, so the HTTP layer imports it directly and leaves models.py
+(torch, torchvision and the inference code) to be imported on first use.
+"""
+import glob
+import json
+import logging
+import os
+import threading
+
+import tensor_store
+
+logger = logging.getLogger(__name__)
+
+# Models served by the backend and the architecture each one is built with.
+# Models with the same architecture and checkpoint share one loaded instance.
+SERVING_MODELS = ['resnet50', 'inceptionv3', 'skinnet']
+MODEL_ARCHITECTURES = {
+    'resnet50': 'skin_lesion_resnet50',
+    'inceptionv3': 'inception_v3',
+    'skinnet': 'skin_lesion_resnet50',
+}
+# Size of the pooled features each architecture feeds its classifier head
+EMBEDDING_DIMS = {
+    'skin_lesion_resnet50': 2048,
+    'inception_v3': 2048,
+}
+# Input resolution each model expects; InceptionV3 is built for 299x299
+MODEL_INPUT_SIZES = {
+    'resnet50': 224,
+    'inceptionv3': 299,
+    'skinnet': 224,
+}
+
+# What requests get while a model's circuit breaker is open (see models.py):
+# 'simulate' answers at once with simulated predictions flagged as degraded,
+# 'unavailable' fails fast (503 from the API)
+DEGRADED_MODE = os.environ.get('SKINVISION_DEGRADED_MODE', 'simulate')
+
+# Similar-case search: with SKINVISION_SIMILAR_DIR set, the embedding of
+# every analyzed image (the pooled features fed to the classifier head) is
+# captured during its forward pass and stored in a vector index per loaded
+# checkpoint (see vector_index.py)
+SIMILAR_DIR = os.environ.get('SKINVISION_SIMILAR_DIR')
+SIMILAR_INDEX_OPTIONS = {
+    'kind': os.environ.get('SKINVISION_SIMILAR_INDEX', 'ivf'),
+    'nprobe': int(os.environ.get('SKINVISION_SIMILAR_NPROBE', '8')),
+    'pq_subspaces': int(os.environ.get('SKINVISION_SIMILAR_PQ_SUBSPACES', '64')),
+    'train_min': int(os.environ.get('SKINVISION_SIMILAR_TRAIN_MIN', '20000')),
+}
+
+# Training configs (<model>_config.json) written next to the training results;
+# /api/models lists the served models that have one or a description
+RESULTS_DIR = os.environ.get('SKINVISION_RESULTS_DIR', 'results')
+
+# Display name and description of each model in /api/models
+MODEL_DESCRIPTIONS = {
+    'inceptionv3': {
+        'name': 'InceptionV3',
+        'description': 'Google InceptionV3 model trained for skin lesion classification'
+    },
+    'resnet50': {
+        'name': 'ResNet50',
+        'description': 'ResNet50 model trained for skin lesion classification'
+    },
+}
+
+def get_model_path(model_name):
+    """
+    Get the path to the model file
+    """
+    if model_name == 'resnet50':
+        return os.path.join('models', 'resnet50_model.pth')
+    elif model_name == 'inceptionv3':
+        return os.path.join('models', 'inceptionv3_model.pth')
+    elif model_name == 'skinnet':
+        # For skinnet, we'll use resnet50 as a base
+        return os.path.join('models', 'resnet50_model.pth')
+    else:
+        raise ValueError(f"Unknown model: {model_name}")
+
+def store_upload_tensors(upload_path):
+    """
+    Preprocess a new upload once for every model input size
+    """
+    return tensor_store.store_preprocessed(upload_path, set(MODEL_INPUT_SIZES.values()))
+
+# Parsed training configs by path, reread when the file changes
+_training_configs = {}
+_training_configs_lock = threading.Lock()
+
+def read_training_config(model_name):
+    """
+    The training config of model_name from RESULTS_DIR, or an empty dict
+    when it is missing, empty or not valid JSON
+    """
+    path = os.path.join(RESULTS_DIR, f"{model_name}_config.json")
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return {}
+    if stat.st_size == 0:
+        return {}
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _training_configs_lock:
+        cached = _training_configs.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    try:
+        with open(path) as f:
+            config = json.load(f)
+        if not isinstance(config, dict):
+            raise ValueError('expected a JSON object')
+    except ValueError as e:
+        logger.warning("Ignoring training config %s: %s", path, e)
+        config = {}
+    with _training_configs_lock:
+        _training_configs[path] = (signature, config)
+    return config
+
+def available_models():
+    """
+    The /api/models list: every served model with a description in
+    MODEL_DESCRIPTIONS or a training config in RESULTS_DIR, with what the
+    config records about it. Without a config (results/ is not checked
+    in) or with an empty or unreadable one, the model is listed with its
+    defaults.
+    """
+    configured = {
+        os.path.basename(path)[:-len('_config.json')]
+        for path in glob.glob(os.path.join(RESULTS_DIR, '*_config.json'))
+    }
+    listed = []
+    for model_name in sorted((configured | set(MODEL_DESCRIPTIONS)) & set(SERVING_MODELS)):
+        config = read_training_config(model_name)
+        entry = {
+            'id': model_name,
+            **MODEL_DESCRIPTIONS.get(model_name, {
+                'name': model_name,
+                'description': f"{model_name} model trained for skin lesion classification",
+            }),
+        }
+        entry['input_size'] = config.get('image_size', MODEL_INPUT_SIZES[model_name])
+        if 'num_classes' in config:
+            entry['num_classes'] = config['num_classes']
+        if 'pretrained' in config:
+            entry['pretrained'] = config['pretrained']
+        if 'start_epoch' in config:
+            entry['epochs_trained'] = config['start_epoch']
+        listed.append(entry)
+    return listed
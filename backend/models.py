@@ -1,234 +1,185 @@
+import io
+import logging
 import os
 import numpy as np
-import torch
-import torch.nn as nn
-from torchvision import models, transforms
-from PIL import Image
 import random
+import threading
 import time
+import weakref
+from concurrent.futures import Future
+from PIL import UnidentifiedImageError
+from batching import MicroBatcher
+from circuit_breaker import ModelUnavailable
+import cpu_policy
+from metrics import cache_lookups_total, simulation_fallbacks_total, timed
+from lesion_types import LESION_TYPES
+from postprocessing import LESION_CODES, format_batch, format_predictions, softmax_percent
+from registry import ModelRegistry
+from artifacts import BACKENDS
+from prediction_cache import PredictionCache, make_cache_key, hash_bytes
+import preprocessing
+import tensor_store
+import tta
+from vector_index import VectorIndex
+from preprocessing import PREPROCESS_VERSION
+# Served models, paths and serving options (importable without torch)
+from model_config import (
+    SERVING_MODELS, MODEL_ARCHITECTURES, MODEL_INPUT_SIZES, EMBEDDING_DIMS, DEGRADED_MODE,
+    SIMILAR_DIR, SIMILAR_INDEX_OPTIONS, get_model_path, store_upload_tensors
+)
 
-# Dictionary of skin lesion types
-LESION_TYPES = {
-    'acb': 'melanocytic, benign, banal, compound, acral',
-    'acd': 'melanocytic, benign, dysplastic, compound, acral',
-    'ajb': 'melanocytic, benign, banal, junctional, acral',
-    'ajd': 'melanocytic, benign, dysplastic, junctional, acral',
-    'ak': 'nonmelanocytic, indeterminate, keratinocytic, keratinocytic, actinic_keratosis',
-    'alm': 'melanocytic, malignant, melanoma, melanoma, acral_lentiginious',
-    'angk': 'nonmelanocytic, benign, vascular, vascular, angiokeratoma',
-    'anm': 'melanocytic, malignant, melanoma, melanoma, acral_nodular',
-    'bcc': 'nonmelanocytic, malignant, keratinocytic, keratinocytic, basal_cell_carcinoma',
-    'bd': 'nonmelanocytic, malignant, keratinocytic, keratinocytic, bowen_disease',
-    'bdb': 'melanocytic, benign, banal, dermal, blue',
-    'cb': 'melanocytic, benign, banal, compound, compound',
-    'ccb': 'melanocytic, benign, banal, compound, congenital',
-    'ccd': 'melanocytic, benign, dysplastic, compound, congenital',
-    'cd': 'melanocytic, benign, dysplastic, compound, compound',
-    'ch': 'nonmelanocytic, malignant, keratinocytic, keratinocytic, cutaneous_horn',
-    'cjb': 'melanocytic, benign, banal, junctional, congenital',
-    'db': 'melanocytic, benign, banal, dermal, dermal',
-    'df': 'nonmelanocytic, benign, fibro_histiocytic, fibro_histiocytic, dermatofibroma',
-    'dfsp': 'nonmelanocytic, malignant, fibro_histiocytic, fibro_histiocytic, dermatofibrosarcoma_protuberans',
-    'ha': 'nonmelanocytic, benign, vascular, vascular, hemangioma',
-    'isl': 'melanocytic, neging, lentigo, lentigo, ink_spot_lentigo',
-    'jb': 'melanocytic, benign, banal, junctional, junctional',
-    'jd': 'melanocytic, benign, dysplastic, junctional, junctional',
-    'ks': 'nonmelanocytic, malignant, vascular, vascular, kaposi_sarcoma',
-    'la': 'nonmelanocytic, benign, vascular, vascular, lymphangioma',
-    'lk': 'nonmelanocytic, benign, keratinocytic, keratinocytic, lichenoid_keratosis',
-    'lm': 'melanocytic, malignant, melanoma, melanoma, lentigo_maligna',
-    'lmm': 'melanocytic, malignant, melanoma, melanoma, lentigo_maligna_melanoma',
-    'ls': 'melanocytic, benign, lentigo, lentigo, lentigo_simplex',
-    'mcb': 'melanocytic, benign, banal, compound, Miescher',
-    'mel': 'melanocytic, malignant, melanoma, melanoma, melanoma',
-    'mpd': 'nonmelanocytic, malignant, keratinocytic, keratinocytic, mammary_paget_disease',
-    'pg': 'nonmelanocytic, benign, vascular, vascular, pyogenic_granuloma',
-    'rd': 'melanocytic, benign, dysplastic, recurrent, recurrent',
-    'sa': 'nonmelanocytic, benign, vascular, vascular, spider_angioma',
-    'scc': 'nonmelanocytic, malignant, keratinocytic, keratinocytic, squamous_cell_carcinoma',
-    'sk': 'nonmelanocytic, benign, keratinocytic, keratinocytic, seborrheic_keratosis',
-    'sl': 'melanocytic, benign, lentigo, lentigo, solar_lentigo',
-    'srjd': 'melanocytic, benign, dysplastic, junctional, spitz_reed'
-}
+logger = logging.getLogger(__name__)
+
+# Cache of finished predictions keyed by image content, model and checkpoint.
+# SKINVISION_CACHE_SIZE=0 disables the memory tier, SKINVISION_CACHE_DIR
+# enables a SQLite disk tier that survives restarts.
+prediction_cache = PredictionCache(
+    max_entries=int(os.environ.get('SKINVISION_CACHE_SIZE', '1024')),
+    disk_path=(
+        os.path.join(os.environ['SKINVISION_CACHE_DIR'], 'predictions.sqlite3')
+        if os.environ.get('SKINVISION_CACHE_DIR') else None
+    ),
+    disk_max_bytes=int(os.environ.get('SKINVISION_CACHE_DISK_MAX_MB', '512')) * 1024 * 1024,
+)
 
-# Define the transformation for the input images
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-])
+# Micro-batching: requests for the same model are grouped into one forward
+# pass. A batch is flushed when it is full or its oldest request has waited
+# BATCH_MAX_WAIT_MS. Set SKINVISION_BATCH_MAX_SIZE=1 to disable batching.
+BATCH_MAX_SIZE = int(os.environ.get('SKINVISION_BATCH_MAX_SIZE', '8'))
+BATCH_MAX_WAIT_MS = float(os.environ.get('SKINVISION_BATCH_MAX_WAIT_MS', '10'))
 
-# Cache for loaded models to avoid reloading them for each prediction
-model_cache = {}
+# One batcher per model and loaded version (model name -> (entry, batcher)),
+# created on first use and closed once that version is swapped out
+batchers = {}
+batchers_lock = threading.Lock()
 
-def preprocess_image(image_path):
+# Poll checkpoint files and hot-swap models whose file changed (0 disables)
+MODEL_WATCH_INTERVAL = float(os.environ.get('SKINVISION_MODEL_WATCH_INTERVAL', '0'))
+
+# Circuit breaker around every model (see circuit_breaker.py); what requests
+# get while one is open is DEGRADED_MODE (see model_config.py)
+BREAKER_OPTIONS = {
+    'failure_threshold': int(os.environ.get('SKINVISION_BREAKER_FAILURES', '1')),
+    'backoff': float(os.environ.get('SKINVISION_BREAKER_BACKOFF', '30')),
+    'max_backoff': float(os.environ.get('SKINVISION_BREAKER_MAX_BACKOFF', '600')),
+}
+
+# Open vector indexes for similar-case search, one per embedding space
+similar_indexes = {}
+similar_indexes_lock = threading.Lock()
+
+def preprocess_image(image_path, size=224):
     """
     Preprocess the image for model input
     """
     try:
-        img = Image.open(image_path).convert('RGB')
-        img_tensor = transform(img)
-        return img_tensor.unsqueeze(0)  # Add batch dimension
+        with timed('decode'):
+            img = preprocessing.decode_image(image_path, size)
+        with timed('transform'):
+            # [1, 3, size, size] float32, batch dimension included
+            array = np.empty((1, 3, size, size), dtype=np.float32)
+            preprocessing.normalize_into(img, array[0])
+        return array
+    except UnidentifiedImageError:
+        # Bad input rather than a server error (400 from the API)
+        raise
     except Exception as e:
         raise Exception(f"Error preprocessing image: {str(e)}")
 
-def get_model_path(model_name):
+def load_input(source, model_name):
     """
-    Get the path to the model file
+    Model-ready input tensor and image hash for source (a path or file-like
+    object), using the tensor stored at upload time when there is an
+    up-to-date one
     """
-    if model_name == 'resnet50':
-        return os.path.join('models', 'resnet50_model.pth')
-    elif model_name == 'inceptionv3':
-        return os.path.join('models', 'inceptionv3_model.pth')
-    elif model_name == 'skinnet':
-        # For skinnet, we'll use resnet50 as a base
-        return os.path.join('models', 'resnet50_model.pth')
+    size = MODEL_INPUT_SIZES[model_name]
+    if isinstance(source, str):
+        stored = tensor_store.load_preprocessed(source, size)
+        if stored is not None:
+            return stored[0], stored[1]
+        with open(source, 'rb') as f:
+            image_bytes = f.read()
     else:
-        raise ValueError(f"Unknown model: {model_name}")
-
-# Define the SkinLesionClassifier class based on test.ipynb
-class SkinLesionClassifier(nn.Module):
-    def __init__(self, num_classes=40):  # Updated to 40 classes to match checkpoint
-        super(SkinLesionClassifier, self).__init__()
-        # Load ResNet50 and replace the final fc layer with custom layers
-        resnet = models.resnet50(pretrained=False)
-        
-        # Copy all layers except the final fc layer
-        self.conv1 = resnet.conv1
-        self.bn1 = resnet.bn1
-        self.relu = resnet.relu
-        self.maxpool = resnet.maxpool
-        self.layer1 = resnet.layer1
-        self.layer2 = resnet.layer2
-        self.layer3 = resnet.layer3
-        self.layer4 = resnet.layer4
-        self.avgpool = resnet.avgpool
-        
-        # Custom fc layers (matching the saved model structure exactly)
-        # The saved model has fc.0, fc.3, fc.6 as Linear layers
-        self.fc = nn.Sequential(
-            nn.Linear(2048, 512),      # fc.0 - matches fc.0.weight, fc.0.bias
-            nn.ReLU(inplace=True),     # fc.1 - ReLU activation
-            nn.Dropout(0.5),           # fc.2 - Dropout
-            nn.Linear(512, 256),       # fc.3 - matches fc.3.weight, fc.3.bias  
-            nn.ReLU(inplace=True),     # fc.4 - ReLU activation
-            nn.Dropout(0.3),           # fc.5 - Dropout
-            nn.Linear(256, num_classes)# fc.6 - matches fc.6.weight, fc.6.bias
-        )
-    
-    def forward(self, x):
-        x = self.conv1(x)
-        x = self.bn1(x)
-        x = self.relu(x)
-        x = self.maxpool(x)
-        
-        x = self.layer1(x)
-        x = self.layer2(x)
-        x = self.layer3(x)
-        x = self.layer4(x)
-        
-        x = self.avgpool(x)
-        x = torch.flatten(x, 1)
-        x = self.fc(x)
-        return x
+        source.seek(0)
+        image_bytes = source.read()
+    return preprocess_image(io.BytesIO(image_bytes), size), hash_bytes(image_bytes)
+
+# Inference backend per model (see optimize.py), e.g.
+# SKINVISION_BACKEND=torchscript or SKINVISION_BACKEND_RESNET50=int8_static.
+# Non-eager backends need their artifact built with `python optimize.py`.
+def get_backend(model_name):
+    backend = os.environ.get(f"SKINVISION_BACKEND_{model_name.upper()}") or os.environ.get('SKINVISION_BACKEND', 'eager')
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend for {model_name}: {backend}")
+    return backend
+
+# Intra-op threads per model (0 = library default), e.g.
+# SKINVISION_INTRA_OP_THREADS_INCEPTIONV3=2, so models running side by side in
+# an ensemble do not oversubscribe the cores. ONNX Runtime sessions are limited
+# per model; torch's intra-op pool is process-wide and uses
+# SKINVISION_INTRA_OP_THREADS for every torch backend.
+def get_intra_op_threads(model_name):
+    return int(
+        os.environ.get(f"SKINVISION_INTRA_OP_THREADS_{model_name.upper()}")
+        or os.environ.get('SKINVISION_INTRA_OP_THREADS', '0')
+    )
 
-def create_model_architecture(model_name, num_classes):
+def uses_torch():
     """
-    Create the model architecture based on the model name
+    Whether any served model runs on a torch backend (not ONNX Runtime)
     """
-    if model_name == 'resnet50':
-        model = SkinLesionClassifier(num_classes=num_classes)
-    elif model_name == 'inceptionv3':
-        # For inceptionv3, we'll still use the basic model for now
-        model = models.inception_v3(weights=None, aux_logits=False)
-        model.fc = nn.Linear(model.fc.in_features, num_classes)
-    elif model_name == 'skinnet':
-        # For skinnet, we'll use the SkinLesionClassifier as well
-        model = SkinLesionClassifier(num_classes=num_classes)
-    else:
-        raise ValueError(f"Unknown model: {model_name}")
-    
-    return model
+    try:
+        return any(get_backend(model_name) != 'onnx' for model_name in SERVING_MODELS)
+    except ValueError:
+        # Reported when the model loads
+        return True
 
+# Torch and its process-wide thread pools (see cpu_policy.py for per-worker
+# pinning). A process serving every model with ONNX Runtime never imports
+# torch: inputs are NumPy arrays and the architectures live in
+# architectures.py.
+if uses_torch():
+    cpu_policy.import_torch()
 
-def simulate_predictions(image_path, model_name):
+def simulated_probabilities(model_name):
     """
-    Simulate predictions when model loading fails
+    Random but plausible-looking probabilities (in percent) for model_name
     """
-    print(f"Using simulation for {model_name} predictions")
-    
-    # Check if the image exists
-    if not os.path.exists(image_path):
-        raise Exception(f"Image not found at path: {image_path}")
-        
-    # Simulate processing time
-    time.sleep(1)
-    
-    # Create random probabilities for each lesion type
-    labels = list(LESION_TYPES.keys())
-    
+    simulation_fallbacks_total.inc(model=model_name)
+    num_labels = len(LESION_TYPES)
+
     if model_name == 'resnet50':
         # ResNet50 model simulation
         # Create a more focused distribution with a clear top prediction
-        num_labels = len(labels)
-        
-        # Select a random top label
+        raw_probs = np.empty(num_labels)
+
+        # Select a random top label and assign it a high probability
         top_label_idx = random.randint(0, num_labels - 1)
-        top_label = labels[top_label_idx]
-        
-        # Create the predictions dictionary
-        predictions = {}
-        
-        # Assign a high probability to the top label
         top_prob = random.uniform(60.0, 80.0)
-        predictions[top_label] = {
-            'name': LESION_TYPES[top_label],
-            'probability': round(top_prob, 2)
-        }
-        
+        raw_probs[top_label_idx] = top_prob
+
         # Distribute remaining probability among other labels
         remaining_prob = 100.0 - top_prob
-        remaining_labels = [label for label in labels if label != top_label]
-        
+        remaining_idx = np.delete(np.arange(num_labels), top_label_idx)
+
         # Assign higher probabilities to a few runner-up labels
-        num_runners = min(4, len(remaining_labels))
-        runner_labels = random.sample(remaining_labels, num_runners)
-        runner_probs = np.random.dirichlet(np.ones(num_runners)) * remaining_prob * 0.8
-        
-        for i, label in enumerate(runner_labels):
-            predictions[label] = {
-                'name': LESION_TYPES[label],
-                'probability': round(float(runner_probs[i]), 2)
-            }
-        
+        num_runners = min(4, len(remaining_idx))
+        runner_idx = np.random.choice(remaining_idx, num_runners, replace=False)
+        raw_probs[runner_idx] = np.random.dirichlet(np.ones(num_runners)) * remaining_prob * 0.8
+
         # Assign very small probabilities to the rest
-        rest_labels = [label for label in remaining_labels if label not in runner_labels]
-        rest_prob = remaining_prob * 0.2
-        rest_probs = np.random.dirichlet(np.ones(len(rest_labels))) * rest_prob
-        
-        for i, label in enumerate(rest_labels):
-            predictions[label] = {
-                'name': LESION_TYPES[label],
-                'probability': round(float(rest_probs[i]), 2)
-            }
-        
+        rest_idx = np.setdiff1d(remaining_idx, runner_idx)
+        raw_probs[rest_idx] = np.random.dirichlet(np.ones(len(rest_idx))) * remaining_prob * 0.2
+
     elif model_name == 'inceptionv3':
         # InceptionV3 model simulation
         # Create a more balanced distribution
-        raw_probs = np.random.dirichlet(np.ones(len(labels)) * 0.5) * 100
-        
-        # Create the predictions dictionary
-        predictions = {}
-        for i, label in enumerate(labels):
-            predictions[label] = {
-                'name': LESION_TYPES[label],
-                'probability': round(float(raw_probs[i]), 2)
-            }
-            
+        raw_probs = np.random.dirichlet(np.ones(num_labels) * 0.5) * 100
+
     elif model_name == 'skinnet':
         # SkinNet model simulation
         # Create a distribution with high confidence
-        raw_probs = np.random.dirichlet(np.ones(len(labels)) * 0.3) * 100
+        raw_probs = np.random.dirichlet(np.ones(num_labels) * 0.3) * 100
         
         # Boost the top prediction even more
         max_idx = np.argmax(raw_probs)
@@ -238,118 +189,768 @@ def simulate_predictions(image_path, model_name):
         
         # Normalize to sum to 100
         raw_probs = raw_probs / np.sum(raw_probs) * 100
-        
-        # Create the predictions dictionary
-        predictions = {}
-        for i, label in enumerate(labels):
-            predictions[label] = {
-                'name': LESION_TYPES[label],
-                'probability': round(float(raw_probs[i]), 2)
-            }
     else:
         # Default model simulation
-        raw_probs = np.random.dirichlet(np.ones(len(labels))) * 100
-        
-        # Create the predictions dictionary
-        predictions = {}
-        for i, label in enumerate(labels):
-            predictions[label] = {
-                'name': LESION_TYPES[label],
-                'probability': round(float(raw_probs[i]), 2)
-            }
-    
-    # Sort by probability (descending)
-    sorted_predictions = dict(sorted(
-        predictions.items(),
-        key=lambda item: item[1]['probability'],
-        reverse=True
-    ))
-    
-    # Get the top prediction
-    top_prediction = next(iter(sorted_predictions))
-    
+        raw_probs = np.random.dirichlet(np.ones(num_labels)) * 100
+
+    return raw_probs
+
+def simulated_predictions(model_name, top_k=None):
+    """
+    Random but plausible-looking predictions for model_name
+    """
+    return format_predictions(simulated_probabilities(model_name), top_k)
+
+def model_unavailable(model_name, error):
+    """
+    The ModelUnavailable error for a model that cannot be used right now;
+    raised straight away with SKINVISION_DEGRADED_MODE=unavailable
+    """
+    if not isinstance(error, ModelUnavailable):
+        error = ModelUnavailable(model_name, registry.breakers[model_name].retry_after(), str(error))
+    if DEGRADED_MODE == 'unavailable':
+        raise error
+    logger.warning("Using simulation for %s predictions: %s", model_name, error.reason)
+    return error
+
+def degraded_predictions(model_name, top_k, error):
+    """
+    Simulated predictions flagged as degraded for a model that cannot be
+    used right now (see model_unavailable). Never waits.
+    """
+    error = model_unavailable(model_name, error)
+    result = simulated_predictions(model_name, top_k)
+    result.update({
+        'model_version': None,
+        'degraded': True,
+        'simulated': True,
+        'degraded_reason': str(error),
+    })
+    return result
+
+def record_model_failure(model_name, error):
+    """
+    Count a failed forward pass against model_name's circuit breaker
+    """
+    logger.error("Error making prediction with %s: %s", model_name, error)
+    if not isinstance(error, ModelUnavailable):
+        registry.breakers[model_name].record_failure(error)
+
+def build_model(model_name):
+    """
+    Create an untrained model architecture with the serving head size
+    """
+    cpu_policy.import_torch()
+    from architectures import create_model_architecture
+
+    return create_model_architecture(model_name, len(LESION_TYPES))
+
+# All models are loaded and warmed through the registry, which also makes
+# skinnet share the resnet50 weights instead of loading them twice
+registry = ModelRegistry(
+    SERVING_MODELS,
+    build_model=build_model,
+    get_checkpoint_path=get_model_path,
+    get_architecture=lambda model_name: MODEL_ARCHITECTURES[model_name],
+    get_input_size=lambda model_name: MODEL_INPUT_SIZES[model_name],
+    get_backend=get_backend,
+    get_intra_op_threads=get_intra_op_threads,
+    use_mmap=os.environ.get('SKINVISION_MMAP_WEIGHTS', '1') != '0',
+    on_retire=lambda entry: retire_batchers(entry),
+    breaker_options=BREAKER_OPTIONS,
+)
+
+def load_model(model_name):
+    """
+    Return the model for model_name, loading it into the registry on first use
+    """
+    return registry.get(model_name)
+
+def export_onnx(model_name, output_path=None, opset_version=17, model=None):
+    """
+    Export model_name to an ONNX graph with a dynamic batch dimension.
+    Pass model to export an already built module instead of loading the
+    checkpoint (the parity test uses this when the LFS files are absent).
+    """
+    import torch
+    from artifacts import artifact_path
+    from registry import load_checkpoint
+
+    if model is None:
+        model = build_model(model_name)
+        load_checkpoint(model, get_model_path(model_name), use_mmap=False)
+    model.eval()
+
+    if output_path is None:
+        output_path = artifact_path(get_model_path(model_name), 'onnx')
+    size = MODEL_INPUT_SIZES[model_name]
+    example = torch.zeros(1, 3, size, size)
+    export_args = dict(
+        input_names=['input'],
+        output_names=['logits'],
+        dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}},
+        opset_version=opset_version,
+    )
+    with torch.no_grad():
+        try:
+            # Newer torch defaults to the dynamo exporter; the TorchScript
+            # based one handles these CNNs fine and needs no extra packages
+            torch.onnx.export(model, (example,), output_path, dynamo=False, **export_args)
+        except TypeError:
+            torch.onnx.export(model, (example,), output_path, **export_args)
+    print(f"Exported {model_name} to {output_path}")
+    return output_path
+
+# Embeddings captured by the classifier head hooks of the forward pass
+# running in this thread
+_embedding_capture = threading.local()
+embedding_hooks = weakref.WeakKeyDictionary()
+embedding_hooks_lock = threading.Lock()
+
+def _capture_head_input(module, args):
+    captured = getattr(_embedding_capture, 'embeddings', None)
+    if captured is not None:
+        features = args[0].detach()
+        if features.is_quantized:
+            features = features.dequantize()
+        captured.append(features.reshape(features.shape[0], -1).numpy().copy())
+
+def hook_embeddings(entry):
+    """
+    Install the hook capturing the input of entry's classifier head (fc)
+    on first use. False for backends that do not expose it (ONNX,
+    TorchScript).
+    """
+    import torch
+
+    with embedding_hooks_lock:
+        if entry not in embedding_hooks:
+            head = getattr(entry.model, 'fc', None)
+            supported = isinstance(head, torch.nn.Module) and not isinstance(head, torch.jit.ScriptModule)
+            if supported:
+                head.register_forward_pre_hook(_capture_head_input)
+            embedding_hooks[entry] = supported
+        return embedding_hooks[entry]
+
+def forward_batch(model_name, input_tensors, entry=None):
+    """
+    Run one forward pass over a list of preprocessed [N, C, H, W] arrays
+    (or torch tensors) and return the per-image probabilities (in percent)
+    and, with similar-case search enabled, the per-image embeddings (else
+    None).
+    entry pins the loaded version to use; by default the one currently
+    serving.
+    """
+    entry = entry or registry.get_entry(model_name)
+    if entry.backend == 'onnx':
+        # ONNX Runtime works on NumPy arrays; torch tensors convert without a copy
+        batch = np.concatenate([np.asarray(t) for t in input_tensors], axis=0)
+        with timed('forward'):
+            return list(softmax_percent(entry.model(batch))), None
+
+    torch = cpu_policy.import_torch()
+    batch = torch.cat([torch.as_tensor(t) for t in input_tensors], dim=0)
+    captured = [] if SIMILAR_DIR and hook_embeddings(entry) else None
+    _embedding_capture.embeddings = captured
+    try:
+        with timed('forward'), torch.no_grad():
+            output = entry.model(batch)
+            probabilities = torch.nn.functional.softmax(output, dim=1) * 100
+    finally:
+        _embedding_capture.embeddings = None
+    return list(probabilities.numpy()), (list(captured[0]) if captured else None)
+
+def run_model_batch(model_name, input_tensors, entry=None):
+    """
+    The per-image probabilities (in percent) of one forward pass (see
+    forward_batch)
+    """
+    return forward_batch(model_name, input_tensors, entry)[0]
+
+def run_batch_items(model_name, input_tensors, entry):
+    # Batcher results: one (probabilities, embedding or None) per input
+    probabilities, embeddings = forward_batch(model_name, input_tensors, entry)
+    return list(zip(probabilities, embeddings or [None] * len(probabilities)))
+
+def get_batcher(model_name, entry=None):
+    """
+    Return the micro-batcher running model_name on entry (by default the
+    version currently serving), creating it on first use
+    """
+    entry = entry or registry.get_entry(model_name)
+    with batchers_lock:
+        if entry.retired:
+            raise RuntimeError(f"Version {entry.version} of {model_name} was replaced")
+        current = batchers.get(model_name)
+        if current is not None and current[0] is entry:
+            return current[1]
+        batcher = MicroBatcher(
+            model_name,
+            lambda tensors: run_batch_items(model_name, tensors, entry),
+            max_batch_size=BATCH_MAX_SIZE,
+            max_wait_ms=BATCH_MAX_WAIT_MS,
+        )
+        batchers[model_name] = (entry, batcher)
+    if current is not None:
+        # Requests already queued on the older version still run on it
+        current[1].close()
+    return batcher
+
+def retire_batchers(entry):
+    """
+    Close the batchers of a swapped-out version once their queues drain
+    """
+    with batchers_lock:
+        retired = [model_name for model_name, (owner, _) in batchers.items() if owner is entry]
+        closing = [batchers.pop(model_name)[1] for model_name in retired]
+    for batcher in closing:
+        batcher.close()
+
+def submit_inference(model_name, entry, input_tensor):
+    """
+    Queue one input for the next batch of model_name on the loaded version
+    entry and return a Future for its (probabilities, embedding or None).
+    If that version was swapped out in the meantime the input runs on it
+    unbatched, so the result always matches the version reported (and
+    cached) for it.
+    """
+    try:
+        return get_batcher(model_name, entry).submit(input_tensor)
+    except RuntimeError:
+        # Retired version, or its batcher closed by a concurrent swap
+        future = Future()
+        try:
+            future.set_result(run_batch_items(model_name, [input_tensor], entry)[0])
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+def get_batching_stats():
+    """
+    Throughput and latency counters for every active batcher
+    """
+    with batchers_lock:
+        active = dict(batchers)
     return {
-        'predictions': sorted_predictions,
-        'top_prediction': {
-            'code': top_prediction,
-            'name': sorted_predictions[top_prediction]['name'],
-            'probability': sorted_predictions[top_prediction]['probability']
-        }
+        model_name: {**batcher.stats(), 'version': entry.version}
+        for model_name, (entry, batcher) in active.items()
     }
 
-def predict_with_model(image_path, model_name):
+def start_model_watcher():
     """
-    Make predictions using the specified model
+    Hot-swap models whose checkpoint file changes, if
+    SKINVISION_MODEL_WATCH_INTERVAL is set
+    """
+    if MODEL_WATCH_INTERVAL > 0:
+        registry.watch(MODEL_WATCH_INTERVAL)
+
+def similar_index(entry):
+    """
+    The vector index of entry's embedding space (its architecture and
+    checkpoint), opened on first use, or None with similar-case search
+    disabled. Embeddings of different checkpoints are not comparable, so
+    a new version starts a new index.
+    """
+    if not SIMILAR_DIR:
+        return None
+    space = f"{entry.architecture}-{entry.version}"
+    with similar_indexes_lock:
+        index = similar_indexes.get(space)
+        if index is None:
+            index = VectorIndex(os.path.join(SIMILAR_DIR, space), EMBEDDING_DIMS[entry.architecture],
+                                **SIMILAR_INDEX_OPTIONS)
+            similar_indexes[space] = index
+    return index
+
+def index_embedding(entry, model_name, image_hash, embedding, probabilities, filename=None):
     """
+    Store an analyzed image's embedding as a case for similar-case search.
+    Failures are logged, never raised: the analysis itself succeeded.
+    """
+    if embedding is None or not SIMILAR_DIR:
+        return
     try:
-        # Check if the image exists
-        if not os.path.exists(image_path):
-            raise Exception(f"Image not found at path: {image_path}")
-        
-        # If model is already in cache, use it
-        if model_name in model_cache:
-            model = model_cache[model_name]
-            print(f"Using cached {model_name} model")
+        top = int(np.argmax(probabilities))
+        with timed('index_embedding'):
+            similar_index(entry).add(
+                image_hash, embedding, filename, model_name, LESION_CODES[top], round(float(probabilities[top]), 2)
+            )
+    except Exception as e:
+        logger.error("Could not index the embedding of %s: %s", image_hash, e)
+
+def find_similar(image_path, model_name, k=10):
+    """
+    The k stored cases whose embedding under model_name is closest to the
+    image's (a path or the image bytes). An image that is not indexed yet
+    is embedded with one forward pass and indexed as a case itself.
+    """
+    started = time.perf_counter()
+    if not SIMILAR_DIR:
+        raise ValueError('Similar-case search is disabled (set SKINVISION_SIMILAR_DIR)')
+    in_memory = is_image_bytes(image_path)
+    if not in_memory and not os.path.exists(image_path):
+        raise Exception(f"Image not found at path: {image_path}")
+    entry = registry.get_entry(model_name)
+    if entry.backend == 'onnx' or not hook_embeddings(entry):
+        raise ValueError(f"The {entry.backend} backend of {model_name} does not expose embeddings")
+    index = similar_index(entry)
+
+    size = MODEL_INPUT_SIZES[model_name]
+    stored = None if in_memory else tensor_store.load_preprocessed(image_path, size)
+    if stored is not None:
+        input_tensor, image_hash = stored[0], stored[1]
+    else:
+        if in_memory:
+            image_bytes = image_path
         else:
-            # Create model architecture
-            num_classes = len(LESION_TYPES)
-            model = create_model_architecture(model_name, num_classes)
-            
-            # Get model path
-            model_path = get_model_path(model_name)
-            
-            # Load model weights
-            print(f"Loading {model_name} model from {model_path}")
-            checkpoint = torch.load(model_path, map_location=torch.device('cpu'))
-            
-            # Check if the checkpoint contains model_state_dict or is a direct state dict
-            if 'model_state_dict' in checkpoint:
-                model.load_state_dict(checkpoint['model_state_dict'])
-            else:
-                model.load_state_dict(checkpoint)
-                
-            model.eval()  # Set to evaluation mode
-            
-            # Cache the model
-            model_cache[model_name] = model
-        
-        # Preprocess the image
-        input_tensor = preprocess_image(image_path)
-        
-        # Make prediction
-        with torch.no_grad():
-            output = model(input_tensor)
-            probabilities = torch.nn.functional.softmax(output[0], dim=0) * 100
-        
-        # Convert to dictionary
-        predictions = {}
-        for i, (code, name) in enumerate(LESION_TYPES.items()):
-            predictions[code] = {
-                'name': name,
-                'probability': round(float(probabilities[i]), 2)
-            }
-        
-        # Sort by probability (descending)
-        sorted_predictions = dict(sorted(
-            predictions.items(),
-            key=lambda item: item[1]['probability'],
-            reverse=True
-        ))
-        
-        # Get the top prediction
-        top_prediction = next(iter(sorted_predictions))
-        
-        return {
-            'predictions': sorted_predictions,
-            'top_prediction': {
-                'code': top_prediction,
-                'name': sorted_predictions[top_prediction]['name'],
-                'probability': sorted_predictions[top_prediction]['probability']
-            }
+            with open(image_path, 'rb') as f:
+                image_bytes = f.read()
+        input_tensor, image_hash = None, hash_bytes(image_bytes)
+
+    embedding = index.get(image_hash)
+    if embedding is None:
+        if input_tensor is None:
+            input_tensor = preprocess_image(io.BytesIO(image_bytes), size)
+        try:
+            probabilities, embedding = submit_inference(model_name, entry, input_tensor).result()
+        except Exception as e:
+            record_model_failure(model_name, e)
+            raise ModelUnavailable(model_name, registry.breakers[model_name].retry_after(), str(e)) from e
+        registry.breakers[model_name].record_success()
+        index_embedding(
+            entry, model_name, image_hash, embedding, probabilities,
+            None if in_memory else os.path.basename(image_path)
+        )
+
+    with timed('similar_search'):
+        similar = index.search(embedding, k, exclude=image_hash)
+    return {
+        'case_id': image_hash,
+        'model': model_name,
+        'model_version': entry.version,
+        'similar': similar,
+        'latency_ms': round((time.perf_counter() - started) * 1000, 3),
+    }
+
+def get_similar_stats():
+    """
+    Size and search settings of every vector index opened in this process
+    """
+    with similar_indexes_lock:
+        active = dict(similar_indexes)
+    return {space: index.stats() for space, index in active.items()}
+
+def predict_tensors(input_tensors, model_name, top_k=None, image_hashes=None):
+    """
+    Predict a whole list of preprocessed images with one forward pass.
+    With image_hashes (one per tensor) the prediction cache is used as in
+    predict_with_model: cached images are not run again and the others
+    are stored. Models that cannot be used get degraded_predictions.
+    """
+    probabilities = [None] * len(input_tensors)
+    cache_keys = [None] * len(input_tensors)
+    misses = []
+    try:
+        entry = registry.get_entry(model_name)
+        if image_hashes is not None and prediction_cache.enabled:
+            for index, image_hash in enumerate(image_hashes):
+                cache_keys[index] = make_cache_key(
+                    image_hash, model_name, entry.checkpoint_hash, PREPROCESS_VERSION
+                )
+                cached = prediction_cache.get(cache_keys[index])
+                cache_lookups_total.inc(result='miss' if cached is None else 'hit')
+                if cached is not None:
+                    probabilities[index] = np.asarray(cached)
+        misses = [index for index, value in enumerate(probabilities) if value is None]
+        if misses:
+            batch = run_model_batch(model_name, [input_tensors[index] for index in misses], entry)
+            for index, value in zip(misses, batch):
+                probabilities[index] = value
+    except Exception as e:
+        record_model_failure(model_name, e)
+        return [degraded_predictions(model_name, top_k, e) for _ in input_tensors]
+    if misses:
+        registry.breakers[model_name].record_success()
+    for index in misses:
+        if cache_keys[index] is not None:
+            prediction_cache.put(cache_keys[index], probabilities[index].tolist())
+    results = format_batch(np.stack(probabilities), top_k)
+    for result in results:
+        result['model_version'] = entry.version
+    return results
+
+def get_cache_stats():
+    """
+    Hit/miss/eviction counters of the prediction cache
+    """
+    return prediction_cache.stats()
+
+def ensemble_weights(model_names, weights=None):
+    """
+    Normalized weight per model from a {model: weight} dict, a list in
+    model_names order, or None for equal weights
+    """
+    if weights is None:
+        weights = [1.0] * len(model_names)
+    elif isinstance(weights, dict):
+        unknown = set(weights) - set(model_names)
+        if unknown:
+            raise ValueError(f"Weights given for models not in the ensemble: {sorted(unknown)}")
+        weights = [weights.get(model_name, 1.0) for model_name in model_names]
+    elif len(weights) != len(model_names):
+        raise ValueError('Expected one weight per model')
+
+    weights = [float(weight) for weight in weights]
+    if any(weight < 0 for weight in weights) or sum(weights) <= 0:
+        raise ValueError('Weights must be non-negative and not all zero')
+    total = sum(weights)
+    return {model_name: weight / total for model_name, weight in zip(model_names, weights)}
+
+def is_image_bytes(image):
+    """
+    True if image is encoded image data held in memory rather than a path
+    """
+    return isinstance(image, (bytes, bytearray, memoryview))
+
+def predict_ensemble(image_path, model_names, weights=None, top_k=None):
+    """
+    Run several models on one image (a path or the image bytes) and
+    combine their probabilities.
+
+    The image is read once and decoded once per input size, models that
+    resolve to the same loaded checkpoint (skinnet and resnet50) run once,
+    and the distinct models run concurrently on their own batcher threads.
+    Returns the weighted average plus every model's result and latency.
+    """
+    started = time.perf_counter()
+    model_names = list(model_names)
+    if not model_names:
+        raise ValueError('No models given for the ensemble')
+    # A repeat would silently shift the weights (and list weights by position)
+    duplicates = sorted({model_name for model_name in model_names if model_names.count(model_name) > 1})
+    if duplicates:
+        raise ValueError(f"Models listed more than once: {duplicates}")
+    unknown = [model_name for model_name in model_names if model_name not in SERVING_MODELS]
+    if unknown:
+        raise ValueError(f"Unknown models: {unknown}")
+    normalized = ensemble_weights(model_names, weights)
+
+    in_memory = is_image_bytes(image_path)
+    if not in_memory and not os.path.exists(image_path):
+        raise Exception(f"Image not found at path: {image_path}")
+
+    # Group models by loaded instance so shared checkpoints run once
+    groups = {}
+    failed = []
+    errors = {}
+    for model_name in model_names:
+        try:
+            entry = registry.get_entry(model_name)
+        except ModelUnavailable as e:
+            # Logged once per request by model_unavailable below
+            failed.append(model_name)
+            errors[model_name] = e
+            continue
+        groups.setdefault(id(entry), (entry, []))[1].append(model_name)
+    versions = {
+        model_name: entry.version for entry, members in groups.values() for model_name in members
+    }
+
+    # Image hash and any stored tensors, read once for all models
+    sizes = {MODEL_INPUT_SIZES[model_name] for model_name in model_names}
+    inputs = {}
+    image_hash = None
+    image_bytes = None
+    if in_memory:
+        image_bytes = image_path
+        image_hash = hash_bytes(image_bytes)
+    for size in sizes if not in_memory else ():
+        stored = tensor_store.load_preprocessed(image_path, size)
+        if stored is not None:
+            inputs[size] = stored[0]
+            image_hash = stored[1]
+    if image_bytes is None and (image_hash is None or len(inputs) < len(sizes)):
+        with open(image_path, 'rb') as f:
+            image_bytes = f.read()
+        image_hash = image_hash or hash_bytes(image_bytes)
+
+    results = {}
+    pending = []
+    for entry, members in groups.values():
+        cache_keys = {}
+        cached = None
+        if prediction_cache.enabled:
+            for model_name in members:
+                cache_keys[model_name] = make_cache_key(
+                    image_hash, model_name, entry.checkpoint_hash, PREPROCESS_VERSION
+                )
+                cached = cached or prediction_cache.get(cache_keys[model_name])
+            cache_lookups_total.inc(result='miss' if cached is None else 'hit')
+        if cached is not None:
+            for model_name in members:
+                results[model_name] = (np.asarray(cached), 0.0, True)
+            continue
+        pending.append((entry, members, cache_keys))
+
+    missing = {MODEL_INPUT_SIZES[members[0]] for _, members, _ in pending} - set(inputs)
+    if missing:
+        # One decode per distinct draft scale serves every remaining size
+        inputs.update(preprocessing.preprocess_sizes(io.BytesIO(image_bytes), missing))
+
+    # Submit every distinct model before waiting on any of them
+    futures = []
+    for entry, members, cache_keys in pending:
+        submitted = time.perf_counter()
+        try:
+            future = submit_inference(members[0], entry, inputs[MODEL_INPUT_SIZES[members[0]]])
+        except Exception as e:
+            record_model_failure(members[0], e)
+            failed.extend(members)
+            errors.update((model_name, e) for model_name in members)
+            continue
+        finished = {}
+        future.add_done_callback(lambda f, finished=finished: finished.setdefault('at', time.perf_counter()))
+        futures.append((future, submitted, finished, members, cache_keys, entry))
+
+    filename = None if in_memory else os.path.basename(image_path)
+    for future, submitted, finished, members, cache_keys, entry in futures:
+        try:
+            probabilities, embedding = future.result()
+        except Exception as e:
+            record_model_failure(members[0], e)
+            failed.extend(members)
+            errors.update((model_name, e) for model_name in members)
+            continue
+        registry.breakers[members[0]].record_success()
+        index_embedding(entry, members[0], image_hash, embedding, probabilities, filename)
+        latency_ms = (finished.get('at', time.perf_counter()) - submitted) * 1000
+        for model_name in members:
+            results[model_name] = (probabilities, latency_ms, False)
+            if model_name in cache_keys:
+                prediction_cache.put(cache_keys[model_name], probabilities.tolist())
+
+    # Models that could not run are degraded as in single requests
+    for model_name in failed:
+        model_unavailable(model_name, errors[model_name])
+        results[model_name] = (simulated_probabilities(model_name), 0.0, False)
+
+    combined = sum(normalized[model_name] * np.asarray(results[model_name][0]) for model_name in model_names)
+    response = format_predictions(combined, top_k)
+    response['models'] = {}
+    for model_name in model_names:
+        probabilities, latency_ms, cached = results[model_name]
+        response['models'][model_name] = {
+            **format_predictions(probabilities, top_k),
+            'weight': round(normalized[model_name], 6),
+            'latency_ms': round(latency_ms, 3),
+            'cached': cached,
+            'simulated': model_name in failed,
+            'model_version': None if model_name in failed else versions[model_name],
         }
-            
+    if failed:
+        response['degraded'] = True
+    response['latency_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    return response
+
+def predict_tta(image_path, model_name, views, top_k=None):
+    """
+    Predict one image (a path or the image bytes) with test-time
+    augmentation: the views (see tta.py) are built from a single decode and
+    run as one batch in one forward pass, outside the micro-batcher since
+    they already fill a batch. Returns the averaged predictions plus the
+    per-view results and their agreement under 'tta'.
+    """
+    started = time.perf_counter()
+    in_memory = is_image_bytes(image_path)
+    if not in_memory and not os.path.exists(image_path):
+        raise Exception(f"Image not found at path: {image_path}")
+
+    try:
+        with timed('model_load'):
+            entry = registry.get_entry(model_name)
+    except ModelUnavailable as e:
+        return degraded_predictions(model_name, top_k, e)
+
+    size = MODEL_INPUT_SIZES[model_name]
+    inputs = {}
+    image_bytes = None
+    if in_memory:
+        image_bytes = image_path
+        with timed('hash'):
+            image_hash = hash_bytes(image_bytes)
+    else:
+        stored = None
+        if tta.input_sizes(views, size) == {size}:
+            # Flips and rotations only need the tensor stored at upload time
+            with timed('tensor_store'):
+                stored = tensor_store.load_preprocessed(image_path, size)
+        if stored is not None:
+            inputs[size] = stored[0]
+            image_hash = stored[1]
+        else:
+            with timed('file_read'):
+                with open(image_path, 'rb') as f:
+                    image_bytes = f.read()
+            with timed('hash'):
+                image_hash = hash_bytes(image_bytes)
+
+    cache_key = None
+    view_probabilities = None
+    if prediction_cache.enabled:
+        # Cached per view set; the per-view rows are kept for the agreement
+        cache_key = make_cache_key(
+            image_hash, f"{model_name}+tta:{','.join(views)}", entry.checkpoint_hash, PREPROCESS_VERSION
+        )
+        with timed('cache_lookup'):
+            view_probabilities = prediction_cache.get(cache_key)
+        cache_lookups_total.inc(result='miss' if view_probabilities is None else 'hit')
+
+    forward_ms = 0.0
+    if view_probabilities is None:
+        with timed('tta_views'):
+            if not inputs:
+                inputs = tta.preprocess_inputs(io.BytesIO(image_bytes), views, size)
+            batch = tta.build_views(inputs, views, size)
+        forward_started = time.perf_counter()
+        try:
+            with timed('inference'):
+                view_probabilities, embeddings = forward_batch(model_name, [batch], entry)
+        except Exception as e:
+            record_model_failure(model_name, e)
+            return degraded_predictions(model_name, top_k, e)
+        registry.breakers[model_name].record_success()
+        forward_ms = (time.perf_counter() - forward_started) * 1000
+        view_probabilities = np.stack(view_probabilities)
+        if embeddings is not None and 'original' in views:
+            # Only the unaugmented view is comparable with other cases
+            original = views.index('original')
+            index_embedding(
+                entry, model_name, image_hash, embeddings[original], view_probabilities[original],
+                None if in_memory else os.path.basename(image_path)
+            )
+        if cache_key is not None:
+            with timed('cache_store'):
+                prediction_cache.put(cache_key, view_probabilities.tolist())
+
+    with timed('postprocess'):
+        averaged, summary = tta.summarize(view_probabilities, views)
+        result = dict(format_predictions(averaged, top_k), model_version=entry.version)
+    summary['forward_ms'] = round(forward_ms, 3)
+    summary['latency_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    result['tta'] = summary
+    return result
+
+def predict_with_model(image_path, model_name, top_k=None, weights=None, tta_views=None):
+    """
+    Make predictions using the specified model. image_path may also be
+    the encoded image bytes, which are then decoded from memory without
+    touching the filesystem. With top_k only the top_k most likely
+    classes are returned. A list of model ids runs them as an ensemble
+    (see predict_ensemble), optionally weighted. tta_views (see
+    tta.parse_tta) averages the model over augmented views of the image
+    (see predict_tta). A model that cannot be used gives
+    degraded_predictions.
+    """
+    if isinstance(model_name, (list, tuple)):
+        if tta_views:
+            raise ValueError('Test-time augmentation is not supported for ensembles')
+        return predict_ensemble(image_path, model_name, weights, top_k)
+    if tta_views:
+        return predict_tta(image_path, model_name, tta_views, top_k)
+
+    in_memory = is_image_bytes(image_path)
+    # Check if the image exists
+    if not in_memory and not os.path.exists(image_path):
+        raise Exception(f"Image not found at path: {image_path}")
+
+    # Load the model up front so load errors are not batched with others.
+    # While its breaker is open this fails at once, without a load attempt.
+    try:
+        with timed('model_load'):
+            entry = registry.get_entry(model_name)
+    except ModelUnavailable as e:
+        return degraded_predictions(model_name, top_k, e)
+
+    # Prefer the tensor stored at upload time; it also records the image
+    # hash so the file does not need to be read at all
+    input_tensor = None
+    image_bytes = None
+    stored = None
+    if not in_memory:
+        with timed('tensor_store'):
+            stored = tensor_store.load_preprocessed(image_path, MODEL_INPUT_SIZES[model_name])
+    if stored is not None:
+        input_tensor = stored[0]
+        image_hash = stored[1]
+    elif in_memory:
+        image_bytes = image_path
+        with timed('hash'):
+            image_hash = hash_bytes(image_bytes)
+    else:
+        # Read the file once: the bytes are both hashed for the cache and decoded
+        with timed('file_read'):
+            with open(image_path, 'rb') as f:
+                image_bytes = f.read()
+        with timed('hash'):
+            image_hash = hash_bytes(image_bytes)
+
+    cache_key = None
+    if prediction_cache.enabled:
+        cache_key = make_cache_key(
+            image_hash, model_name, entry.checkpoint_hash, PREPROCESS_VERSION
+        )
+        # The cache holds the full probability vector so one entry
+        # serves every top_k
+        with timed('cache_lookup'):
+            cached = prediction_cache.get(cache_key)
+        if cached is not None:
+            cache_lookups_total.inc(result='hit')
+            with timed('postprocess'):
+                return dict(format_predictions(cached, top_k), model_version=entry.version)
+        cache_lookups_total.inc(result='miss')
+
+    # Preprocess the image
+    if input_tensor is None:
+        input_tensor = preprocess_image(io.BytesIO(image_bytes), MODEL_INPUT_SIZES[model_name])
+
+    # Make prediction as part of the next batch for this model. The
+    # inference stage includes waiting for the batch to fill.
+    try:
+        with timed('inference'):
+            probabilities, embedding = submit_inference(model_name, entry, input_tensor).result()
+    except Exception as e:
+        record_model_failure(model_name, e)
+        return degraded_predictions(model_name, top_k, e)
+    registry.breakers[model_name].record_success()
+    index_embedding(
+        entry, model_name, image_hash, embedding, probabilities, None if in_memory else os.path.basename(image_path)
+    )
+
+    if cache_key is not None:
+        with timed('cache_store'):
+            prediction_cache.put(cache_key, probabilities.tolist())
+    with timed('postprocess'):
+        return dict(format_predictions(probabilities, top_k), model_version=entry.version)
+
+def warm_job_worker():
+    """
+    Initializer for async job worker processes: load every model up front
+    """
+    from structured_logging import configure_logging
+    configure_logging()
+    registry.load_all()
+    start_model_watcher()
+
+def run_analysis_job(payload):
+    """
+    Entry point for async analysis jobs (see jobs.py). Errors are passed
+    back as plain RuntimeErrors carrying the message, so a worker process
+    never sends the pool an exception it cannot unpickle.
+    """
+    try:
+        return predict_with_model(
+            payload['filepath'], payload['model'], payload.get('top_k'), payload.get('weights'),
+            payload.get('tta'),
+        )
     except Exception as e:
-        print(f"Error making prediction: {str(e)}")
-        # If there's an error, we'll still return a result using the simulation
-        # This ensures the app doesn't crash if there's an issue with the model
-        return simulate_predictions(image_path, model_name)
+        raise RuntimeError(str(e)) from None
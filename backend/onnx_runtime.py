@@ -0,0 +1,44 @@
+"""
+ONNX Runtime serving backend.
+
+Runs the ONNX graphs exported by models.export_onnx without torch. Thread
+counts are set explicitly so several workers on one box do not each
+spawn one thread per core:
+
+  SKINVISION_ONNX_INTRA_OP_THREADS  threads used inside one operator (0 = all cores)
+  SKINVISION_ONNX_INTER_OP_THREADS  threads running independent operators in parallel
+"""
+import os
+import numpy as np
+
+INTRA_OP_THREADS = int(os.environ.get('SKINVISION_ONNX_INTRA_OP_THREADS', '0'))
+INTER_OP_THREADS = int(os.environ.get('SKINVISION_ONNX_INTER_OP_THREADS', '1'))
+
+
+class OnnxModel:
+    """
+    Callable wrapper around an onnxruntime InferenceSession taking a
+    [N, 3, H, W] float32 batch and returning [N, classes] logits
+    """
+
+    def __init__(self, path, intra_op_threads=INTRA_OP_THREADS, inter_op_threads=INTER_OP_THREADS):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        self.path = path
+        self.session = ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_name = self.session.get_outputs()[0].name
+
+    def __call__(self, batch):
+        batch = np.ascontiguousarray(np.asarray(batch, dtype=np.float32))
+        return self.session.run([self.output_name], {self.input_name: batch})[0]
+
+    def eval(self):
+        # Same interface as torch modules so callers can treat both alike
+        return self
@@ -0,0 +1,234 @@
+"""
+Optimized CPU inference backends.
+
+Converts the eager fp32 models into faster variants and saves each one as
+a TorchScript artifact next to its checkpoint, e.g.
+models/resnet50_model.int8_static.pt. The registry serves whichever
+backend is selected per model (see get_backend in models.py).
+
+Backends:
+  eager          plain fp32 module loaded from the .pth checkpoint
+  torchscript    traced and frozen TorchScript graph (BN folded into conv)
+  int8_dynamic   fp32 convolutions, dynamically quantized int8 Linear layers
+  int8_static    fully int8 model, statically quantized (FX) with calibration
+  channels_last  BN folded into conv, channels_last memory format
+  onnx           ONNX graph served by ONNX Runtime (see onnx_runtime.py)
+
+Usage:
+  python optimize.py --model resnet50 --backend torchscript int8_static \
+      --images path/to/held_out_images
+
+writes the artifacts and an accuracy/latency report comparing every
+backend against eager fp32 on the held-out images.
+"""
+import argparse
+import json
+import os
+import time
+import torch
+import torch.nn as nn
+
+# Backend names and artifact paths live in artifacts.py (no torch needed)
+from artifacts import BACKENDS, artifact_path, load_artifact
+
+
+class ChannelsLast(nn.Module):
+    """
+    Runs the wrapped model on channels_last inputs
+    """
+
+    def __init__(self, model):
+        super(ChannelsLast, self).__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model(x.contiguous(memory_format=torch.channels_last))
+
+
+def _trace(model, example):
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example, check_trace=False)
+    return torch.jit.freeze(traced.eval())
+
+
+def optimize_model(model, backend, example, calibration_batches=()):
+    """
+    Convert an eager fp32 model in eval mode to backend. example is a
+    representative input batch; calibration_batches feed int8_static.
+    Returns a TorchScript module (or the model itself for eager).
+    """
+    model = model.eval()
+    if backend == 'eager':
+        return model
+
+    if backend == 'torchscript':
+        # Freezing inlines the weights and folds BatchNorm into the convs
+        return _trace(model, example)
+
+    if backend == 'int8_dynamic':
+        quantized = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+        return _trace(quantized, example)
+
+    if backend == 'int8_static':
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+        qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+        prepared = prepare_fx(model, qconfig_mapping, (example,))
+        with torch.no_grad():
+            for batch in calibration_batches or (example,):
+                prepared(batch)
+        return _trace(convert_fx(prepared), example)
+
+    if backend == 'channels_last':
+        from torch.fx.experimental.optimization import fuse
+        fused = fuse(model)  # folds BatchNorm into the preceding conv
+        wrapped = ChannelsLast(fused.to(memory_format=torch.channels_last)).eval()
+        with torch.no_grad():
+            return torch.jit.trace(wrapped, example, check_trace=False)
+
+    raise ValueError(f"Unknown inference backend: {backend}")
+
+
+def _latency_ms(model, batch, repeats):
+    with torch.no_grad():
+        model(batch)
+        started = time.perf_counter()
+        for _ in range(repeats):
+            model(batch)
+    return (time.perf_counter() - started) / repeats * 1000
+
+
+def compare(reference, candidate, inputs, batch_size=8, repeats=5):
+    """
+    Accuracy delta of candidate vs reference on inputs ([N, 3, H, W]) plus
+    single-image and batched latency of both
+    """
+    ref_probs, cand_probs = [], []
+    with torch.no_grad():
+        for start in range(0, len(inputs), batch_size):
+            batch = inputs[start:start + batch_size]
+            ref_probs.append(torch.softmax(reference(batch), dim=1))
+            cand_probs.append(torch.softmax(torch.as_tensor(candidate(batch)), dim=1))
+    ref_probs = torch.cat(ref_probs)
+    cand_probs = torch.cat(cand_probs)
+    diff = (ref_probs - cand_probs).abs()
+
+    single = inputs[:1]
+    batched = inputs[:batch_size]
+    return {
+        'images': len(inputs),
+        'top1_agreement': float((ref_probs.argmax(1) == cand_probs.argmax(1)).float().mean()),
+        'max_abs_prob_diff': float(diff.max()),
+        'mean_abs_prob_diff': float(diff.mean()),
+        'latency_ms_batch1': round(_latency_ms(candidate, single, repeats), 3),
+        'latency_ms_batch1_reference': round(_latency_ms(reference, single, repeats), 3),
+        f'latency_ms_batch{len(batched)}': round(_latency_ms(candidate, batched, repeats), 3),
+        f'latency_ms_batch{len(batched)}_reference': round(_latency_ms(reference, batched, repeats), 3),
+    }
+
+
+def held_out_inputs(image_dir, size, max_images):
+    """
+    Preprocessed [N, 3, size, size] tensor from an image directory, or
+    random inputs when no directory is given
+    """
+    import preprocessing
+    paths = []
+    if image_dir:
+        for root, _, files in os.walk(image_dir):
+            for name in sorted(files):
+                if name.lower().endswith(('.png', '.jpg', '.jpeg')):
+                    paths.append(os.path.join(root, name))
+        paths = paths[:max_images]
+    if not paths:
+        print("No held-out images given, using random inputs (accuracy deltas are only indicative)")
+        generator = torch.Generator().manual_seed(0)
+        return torch.randn(min(max_images, 16), 3, size, size, generator=generator)
+    return torch.from_numpy(preprocessing.preprocess_batch(paths, size=size))
+
+
+def convert(model_name, backends, image_dir=None, max_images=64, tolerance=0.01):
+    """
+    Build the requested optimized artifacts for model_name and return the
+    accuracy/latency report
+    """
+    import models
+    from registry import load_checkpoint
+
+    checkpoint_path = models.get_model_path(model_name)
+    size = models.MODEL_INPUT_SIZES[model_name]
+    reference = models.build_model(model_name)
+    load_checkpoint(reference, checkpoint_path, use_mmap=False)
+    reference.eval()
+
+    inputs = held_out_inputs(image_dir, size, max_images)
+    calibration = [inputs[i:i + 8] for i in range(0, min(len(inputs), 32), 8)]
+    report = {'model': model_name, 'checkpoint': checkpoint_path, 'tolerance': tolerance, 'backends': {}}
+
+    for backend in backends:
+        if backend == 'eager':
+            continue
+        print(f"Converting {model_name} to {backend}...")
+        started = time.perf_counter()
+        path = artifact_path(checkpoint_path, backend)
+        try:
+            if backend == 'onnx':
+                models.export_onnx(model_name, path)
+            else:
+                # Convert a fresh copy so the reference stays untouched
+                candidate = models.build_model(model_name)
+                load_checkpoint(candidate, checkpoint_path, use_mmap=False)
+                optimized = optimize_model(candidate.eval(), backend, inputs[:1], calibration)
+                torch.jit.save(optimized, path)
+        except Exception as e:
+            print(f"  failed: {str(e)}")
+            report['backends'][backend] = {'error': str(e)}
+            continue
+        convert_seconds = time.perf_counter() - started
+
+        result = compare(reference, load_artifact(path), inputs)
+        result['artifact'] = path
+        result['convert_seconds'] = round(convert_seconds, 3)
+        result['within_tolerance'] = result['max_abs_prob_diff'] <= tolerance
+        report['backends'][backend] = result
+        print(f"  top-1 agreement {result['top1_agreement']:.4f}, "
+              f"max prob diff {result['max_abs_prob_diff']:.5f}, "
+              f"batch1 {result['latency_ms_batch1']:.1f} ms "
+              f"(eager {result['latency_ms_batch1_reference']:.1f} ms)")
+
+    # Fastest backend that stays within tolerance, by single-image latency
+    eligible = [
+        (result['latency_ms_batch1'], backend)
+        for backend, result in report['backends'].items()
+        if result.get('within_tolerance')
+    ]
+    report['recommended'] = min(eligible)[1] if eligible else 'eager'
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build optimized CPU inference artifacts')
+    parser.add_argument('--model', nargs='+', default=['resnet50', 'inceptionv3'])
+    parser.add_argument('--backend', nargs='+', default=[b for b in BACKENDS if b != 'eager'],
+                        choices=BACKENDS)
+    parser.add_argument('--images', help='directory of held-out images for the accuracy report')
+    parser.add_argument('--max-images', type=int, default=64)
+    parser.add_argument('--tolerance', type=float, default=0.01,
+                        help='max allowed absolute probability difference vs eager fp32')
+    parser.add_argument('--report', default=os.path.join('results', 'optimization_report.json'))
+    args = parser.parse_args()
+
+    reports = [
+        convert(model_name, args.backend, args.images, args.max_images, args.tolerance)
+        for model_name in args.model
+    ]
+    os.makedirs(os.path.dirname(args.report) or '.', exist_ok=True)
+    with open(args.report, 'w') as f:
+        json.dump(reports, f, indent=2)
+    for report in reports:
+        print(f"{report['model']}: recommended backend {report['recommended']}")
+    print(f"Report written to {args.report}")
+
+
+if __name__ == '__main__':
+    main()
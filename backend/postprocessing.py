@@ -0,0 +1,77 @@
+import numpy as np
+from lesion_types import LESION_TYPES
+
+# Label arrays in model output order, built once instead of per request
+LESION_CODES = list(LESION_TYPES.keys())
+LESION_NAMES = list(LESION_TYPES.values())
+NUM_CLASSES = len(LESION_CODES)
+
+
+def softmax_percent(logits):
+    """
+    Row-wise softmax of a [batch, classes] array, in percent
+    """
+    logits = np.asarray(logits, dtype=np.float32)
+    shifted = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp / exp.sum(axis=1, keepdims=True) * 100
+
+
+def parse_top_k(value):
+    """
+    Validate a top_k request parameter (an integer, or its string from a
+    query or form field); None means all classes and larger values are
+    capped at the number of classes
+    """
+    if value is None:
+        return None
+    # int() would truncate 2.5 and accept true
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError('top_k must be a positive integer')
+    top_k = int(value)
+    if top_k < 1:
+        raise ValueError('top_k must be a positive integer')
+    return min(top_k, NUM_CLASSES)
+
+
+def format_batch(probabilities, top_k=None):
+    """
+    Turn a [batch, classes] array of probabilities (in percent, LESION_TYPES
+    order) into one API response per row.
+
+    Rounding and ranking run as single array operations over the whole
+    batch; only the top_k entries per row are turned into dicts.
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    if probabilities.ndim == 1:
+        probabilities = probabilities[np.newaxis, :]
+    k = NUM_CLASSES if top_k is None else min(top_k, NUM_CLASSES)
+
+    rounded = np.round(probabilities, 2)
+    # Stable sort keeps LESION_TYPES order between equal probabilities
+    order = np.argsort(-rounded, axis=1, kind='stable')[:, :k]
+    top_values = np.take_along_axis(rounded, order, axis=1).tolist()
+
+    results = []
+    for indices, values in zip(order.tolist(), top_values):
+        predictions = {
+            LESION_CODES[i]: {'name': LESION_NAMES[i], 'probability': value}
+            for i, value in zip(indices, values)
+        }
+        top = indices[0]
+        results.append({
+            'predictions': predictions,
+            'top_prediction': {
+                'code': LESION_CODES[top],
+                'name': LESION_NAMES[top],
+                'probability': values[0]
+            }
+        })
+    return results
+
+
+def format_predictions(probabilities, top_k=None):
+    """
+    format_batch for a single image's probability vector
+    """
+    return format_batch(np.asarray(probabilities)[np.newaxis, :], top_k)[0]
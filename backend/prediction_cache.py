@@ -0,0 +1,208 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+# Bump when the layout of cached values changes
+CACHE_FORMAT = 2
+
+
+def make_cache_key(image_hash, model_id, checkpoint_hash, preprocess_version):
+    """
+    Cache key for one image/model combination. A new checkpoint or a
+    change to the preprocessing invalidates every entry for that model.
+    """
+    return f"v{CACHE_FORMAT}:{image_hash}:{model_id}:{checkpoint_hash}:{preprocess_version}"
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class PredictionCache:
+    """
+    Two-tier cache of prediction results. Values must be JSON serializable
+    and are shared between callers, so treat them as read-only.
+
+    The memory tier is an LRU of at most max_entries results. The optional
+    disk tier is a SQLite file shared by all workers that survives
+    restarts and is trimmed back to disk_max_bytes, least recently used
+    entries first.
+    """
+
+    def __init__(self, max_entries=1024, disk_path=None, disk_max_bytes=512 * 1024 * 1024):
+        self.max_entries = max(0, int(max_entries))
+        self.disk_path = disk_path
+        self.disk_max_bytes = disk_max_bytes
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self._disk_bytes = 0
+
+        self._counts = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0,
+            'errors': 0,
+        }
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 or self.disk_path is not None
+
+    def get(self, key):
+        """
+        Return the cached value for key, or None
+        """
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None:
+                self._memory.move_to_end(key)
+                self._counts['memory_hits'] += 1
+                return result
+
+        result = self._disk_get(key)
+        with self._lock:
+            if result is None:
+                self._counts['misses'] += 1
+                return None
+            self._counts['disk_hits'] += 1
+            self._memory_put(key, result)
+        return result
+
+    def put(self, key, result):
+        with self._lock:
+            self._memory_put(key, result)
+        self._disk_put(key, result)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            db = self._connection()
+            if db is not None:
+                with db:
+                    db.execute('DELETE FROM predictions')
+                self._disk_bytes = 0
+
+    def _memory_put(self, key, result):
+        if self.max_entries == 0:
+            return
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._counts['memory_evictions'] += 1
+
+    def _connection(self):
+        # SQLite connections must not be shared across fork, so each worker
+        # process opens its own
+        if self.disk_path is None:
+            return None
+        if self._db is None or self._db_pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.disk_path)), exist_ok=True)
+            db = sqlite3.connect(self.disk_path, timeout=5, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS predictions ('
+                ' key TEXT PRIMARY KEY, value TEXT NOT NULL,'
+                ' size INTEGER NOT NULL, last_access REAL NOT NULL)'
+            )
+            db.execute('CREATE INDEX IF NOT EXISTS predictions_last_access ON predictions (last_access)')
+            self._disk_bytes = db.execute('SELECT COALESCE(SUM(size), 0) FROM predictions').fetchone()[0]
+            self._db = db
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _disk_get(self, key):
+        if self.disk_path is None:
+            return None
+        try:
+            with self._lock:
+                db = self._connection()
+                row = db.execute('SELECT value FROM predictions WHERE key = ?', (key,)).fetchone()
+                if row is None:
+                    return None
+                with db:
+                    db.execute('UPDATE predictions SET last_access = ? WHERE key = ?', (time.time(), key))
+            return json.loads(row[0])
+        except sqlite3.Error as e:
+            logger.warning("Prediction cache read failed: %s", e)
+            self._counts['errors'] += 1
+            return None
+
+    def _disk_put(self, key, result):
+        if self.disk_path is None:
+            return
+        value = json.dumps(result)
+        try:
+            with self._lock:
+                db = self._connection()
+                with db:
+                    db.execute(
+                        'INSERT OR REPLACE INTO predictions (key, value, size, last_access) VALUES (?, ?, ?, ?)',
+                        (key, value, len(value), time.time())
+                    )
+                self._disk_bytes += len(value)
+                if self._disk_bytes > self.disk_max_bytes:
+                    self._evict_disk(db)
+        except sqlite3.Error as e:
+            logger.warning("Prediction cache write failed: %s", e)
+            self._counts['errors'] += 1
+
+    def _evict_disk(self, db):
+        # The running total is approximate (other workers write too), so
+        # recount before evicting
+        total = db.execute('SELECT COALESCE(SUM(size), 0) FROM predictions').fetchone()[0]
+        evicted = 0
+        # Drop least recently used entries until we are back under budget
+        while total > self.disk_max_bytes:
+            rows = db.execute(
+                'SELECT key, size FROM predictions ORDER BY last_access LIMIT 256'
+            ).fetchall()
+            if not rows:
+                break
+            with db:
+                for key, size in rows:
+                    if total <= self.disk_max_bytes:
+                        break
+                    db.execute('DELETE FROM predictions WHERE key = ?', (key,))
+                    total -= size
+                    evicted += 1
+        self._disk_bytes = total
+        self._counts['disk_evictions'] += evicted
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+            memory_entries = len(self._memory)
+            disk_entries = disk_bytes = None
+            db = self._connection()
+            if db is not None:
+                disk_entries, disk_bytes = db.execute(
+                    'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM predictions'
+                ).fetchone()
+        hits = counts['memory_hits'] + counts['disk_hits']
+        lookups = hits + counts['misses']
+        return {
+            **counts,
+            'hits': hits,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'memory_entries': memory_entries,
+            'memory_max_entries': self.max_entries,
+            'disk_path': self.disk_path,
+            'disk_entries': disk_entries,
+            'disk_bytes': disk_bytes,
+            'disk_max_bytes': self.disk_max_bytes if self.disk_path else None,
+        }
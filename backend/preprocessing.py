@@ -0,0 +1,227 @@
+"""
+Image decoding and preprocessing for model input.
+
+Equivalent to the torchvision pipeline Resize((size, size)) -> ToTensor()
+-> Normalize(IMAGENET_MEAN, IMAGENET_STD), but faster:
+
+- JPEGs are decoded with PIL's draft mode, which lets libjpeg scale the
+  DCT down by 1/2, 1/4 or 1/8 so a 12 MP photo is never decoded at full
+  resolution.
+- ToTensor and Normalize are fused into a single lookup-table pass that
+  writes float32 CHW values straight into a preallocated batch buffer.
+
+Run `python preprocessing.py` to benchmark against the torchvision
+pipeline and check the outputs agree.
+"""
+import contextlib
+import hashlib
+import io
+import os
+import time
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+
+# Bump whenever the preprocessing output changes so cached predictions
+# computed with the old pipeline are not served any more
+PREPROCESS_VERSION = '3'
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+# Let libjpeg decode at reduced size (SKINVISION_JPEG_DRAFT=0 to disable)
+USE_JPEG_DRAFT = os.environ.get('SKINVISION_JPEG_DRAFT', '1') != '0'
+
+
+def _normalization_lut():
+    # (v / 255 - mean) / std for every uint8 value v and channel, computed
+    # with the same float32 operations as ToTensor + Normalize
+    values = np.arange(256, dtype=np.float32) / np.float32(255)
+    mean = np.asarray(IMAGENET_MEAN, dtype=np.float32)[:, np.newaxis]
+    std = np.asarray(IMAGENET_STD, dtype=np.float32)[:, np.newaxis]
+    return (values[np.newaxis, :] - mean) / std
+
+
+NORMALIZATION_LUT = _normalization_lut()  # [3, 256] float32
+
+
+def preprocess_fingerprint():
+    """
+    Short identifier of everything that affects the preprocessed output,
+    used to invalidate stored tensors when the configuration changes
+    """
+    config = f"{PREPROCESS_VERSION}|{USE_JPEG_DRAFT}|{IMAGENET_MEAN}|{IMAGENET_STD}"
+    return hashlib.sha256(config.encode()).hexdigest()[:12]
+
+
+@contextlib.contextmanager
+def _image_data_errors():
+    # PIL reports broken or truncated data with assorted errors, from the
+    # header parser or the decoder; report them like an unrecognized file
+    try:
+        yield
+    except (UnidentifiedImageError, FileNotFoundError):
+        raise
+    except (OSError, SyntaxError, ValueError) as e:
+        raise UnidentifiedImageError(f"cannot decode image: {e}") from e
+
+
+def decode_image(source, size, draft=USE_JPEG_DRAFT):
+    """
+    Open an image (path or file-like object) as a size x size RGB image.
+    Raises UnidentifiedImageError for data that does not decode.
+    """
+    with _image_data_errors():
+        img = Image.open(source)
+        if draft and img.format == 'JPEG':
+            # Picks the largest DCT reduction that keeps both sides >= size
+            img.draft('RGB', (size, size))
+        img = img.convert('RGB')
+    if img.size != (size, size):
+        img = img.resize((size, size), Image.BILINEAR)
+    return img
+
+
+def decode_image_sizes(source, sizes, draft=USE_JPEG_DRAFT):
+    """
+    Open an image once for several model input sizes and return a dict of
+    size -> size x size RGB image. Sizes that libjpeg decodes at the same
+    draft scale share one decode, so every image is identical to what
+    decode_image returns for that size.
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            data = f.read()
+    else:
+        data = source.read()
+
+    decoded = {}  # decoded (drafted) resolution -> RGB image
+    images = {}
+    for size in sorted(set(sizes), reverse=True):
+        with _image_data_errors():
+            # Opening only parses the header, so probing each size is cheap
+            img = Image.open(io.BytesIO(data))
+            if draft and img.format == 'JPEG':
+                img.draft('RGB', (size, size))
+            if img.size not in decoded:
+                decoded[img.size] = img.convert('RGB')
+        rgb = decoded[img.size]
+        images[size] = rgb if rgb.size == (size, size) else rgb.resize((size, size), Image.BILINEAR)
+    return images
+
+
+def normalize_into(img, out):
+    """
+    Write the normalized CHW float32 version of an RGB image into out
+    """
+    pixels = np.asarray(img, dtype=np.uint8)
+    for channel in range(3):
+        np.take(NORMALIZATION_LUT[channel], pixels[:, :, channel], out=out[channel])
+    return out
+
+
+def preprocess_batch(sources, size=224, out=None, draft=USE_JPEG_DRAFT):
+    """
+    Decode and normalize several images into one [N, 3, size, size]
+    float32 array. Pass out to reuse a preallocated buffer.
+    """
+    if out is None:
+        out = np.empty((len(sources), 3, size, size), dtype=np.float32)
+    for index, source in enumerate(sources):
+        normalize_into(decode_image(source, size, draft=draft), out[index])
+    return out
+
+
+def preprocess_image(source, size=224, draft=USE_JPEG_DRAFT):
+    """
+    Decode and normalize one image into a [1, 3, size, size] float32 array
+    """
+    return preprocess_batch([source], size=size, draft=draft)
+
+
+def preprocess_sizes(source, sizes, draft=USE_JPEG_DRAFT):
+    """
+    Decode one image once and normalize it for several input sizes. Returns
+    a dict of size -> [1, 3, size, size] float32 array.
+    """
+    arrays = {}
+    for size, img in decode_image_sizes(source, sizes, draft=draft).items():
+        arrays[size] = normalize_into(img, np.empty((1, 3, size, size), dtype=np.float32)[0])[np.newaxis]
+    return arrays
+
+
+# Max abs difference from the reference pipeline (in normalized units,
+# 1/255 of a pixel step is ~0.017) accepted by the benchmark. Full decoding
+# is exact; draft decoding resamples in the DCT and differs by a few levels.
+FULL_DECODE_TOLERANCE = 1e-5
+DRAFT_TOLERANCE = 0.25
+
+
+def reference_transform(size=224):
+    """
+    The original torchvision pipeline, kept for comparison
+    """
+    from torchvision import transforms
+    return transforms.Compose([
+        transforms.Resize((size, size)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=list(IMAGENET_MEAN), std=list(IMAGENET_STD)),
+    ])
+
+
+def benchmark(resolutions=((640, 480), (2048, 1536), (4032, 3024), (4608, 3456)), size=224, repeats=5):
+    """
+    Time the reference and fast pipelines on synthetic JPEGs and report how
+    far apart their outputs are
+    """
+    import io
+
+    transform = reference_transform(size)
+    rng = np.random.default_rng(0)
+    report = []
+    for width, height in resolutions:
+        # Smooth synthetic image so JPEG compression behaves like a photo
+        base = rng.integers(0, 256, size=(height // 32 + 1, width // 32 + 1, 3), dtype=np.uint8)
+        img = Image.fromarray(base).resize((width, height), Image.BICUBIC)
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=90)
+        data = buffer.getvalue()
+
+        def run_reference():
+            return transform(Image.open(io.BytesIO(data)).convert('RGB')).numpy()
+
+        out = np.empty((1, 3, size, size), dtype=np.float32)
+
+        def run_fast(draft):
+            return preprocess_batch([io.BytesIO(data)], size=size, out=out, draft=draft)[0].copy()
+
+        timings = {}
+        for name, fn in (('reference', run_reference),
+                         ('fast_full_decode', lambda: run_fast(False)),
+                         ('fast_draft', lambda: run_fast(True))):
+            fn()
+            started = time.perf_counter()
+            for _ in range(repeats):
+                result = fn()
+            timings[name] = ((time.perf_counter() - started) / repeats * 1000, result)
+
+        reference = timings['reference'][1]
+        tolerances = {'fast_full_decode': FULL_DECODE_TOLERANCE, 'fast_draft': DRAFT_TOLERANCE}
+        row = {'resolution': f"{width}x{height}"}
+        for name, (ms, result) in timings.items():
+            row[f"{name}_ms"] = round(ms, 2)
+            if name != 'reference':
+                diff = np.abs(result - reference)
+                row[f"{name}_max_abs_diff"] = float(diff.max())
+                row[f"{name}_mean_abs_diff"] = float(diff.mean())
+                row[f"{name}_within_tolerance"] = bool(diff.max() <= tolerances[name])
+        report.append(row)
+    return report
+
+
+if __name__ == '__main__':
+    import json
+    import sys
+    results = benchmark()
+    print(json.dumps(results, indent=2))
+    ok = all(value for row in results for key, value in row.items() if key.endswith('_within_tolerance'))
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,417 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import numpy as np
+from circuit_breaker import CircuitBreaker, ModelUnavailable
+from metrics import model_loads_total
+from artifacts import artifact_path, load_artifact
+
+logger = logging.getLogger(__name__)
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """
+    SHA-256 of a file's contents, read in chunks
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_checkpoint(model, checkpoint_path, use_mmap=True):
+    """
+    Load checkpoint weights into model.
+
+    With use_mmap the checkpoint is memory-mapped and its tensors are
+    assigned to the model directly instead of being copied, so workers
+    forked from the same parent (or mapping the same file) share the
+    weight pages. Falls back to a regular load on torch versions or
+    checkpoint formats that do not support it.
+    """
+    import torch
+
+    checkpoint = None
+    mmapped = False
+    if use_mmap:
+        try:
+            checkpoint = torch.load(checkpoint_path, map_location=torch.device('cpu'), mmap=True)
+            mmapped = True
+        except Exception:
+            # torch < 2.1 has no mmap argument and legacy (non-zip)
+            # checkpoints cannot be mapped
+            checkpoint = None
+    if checkpoint is None:
+        checkpoint = torch.load(checkpoint_path, map_location=torch.device('cpu'))
+
+    # Check if the checkpoint contains model_state_dict or is a direct state dict
+    if 'model_state_dict' in checkpoint:
+        state_dict = checkpoint['model_state_dict']
+    else:
+        state_dict = checkpoint
+
+    if mmapped:
+        try:
+            model.load_state_dict(state_dict, assign=True)
+        except TypeError:
+            model.load_state_dict(state_dict)
+    else:
+        model.load_state_dict(state_dict)
+    return mmapped
+
+
+class LoadedModel:
+    """
+    A model held by the registry, plus where it came from
+    """
+
+    def __init__(self, model, architecture, backend, checkpoint_path, checkpoint_hash, mmapped, load_seconds,
+                 checkpoint_stat=None):
+        self.model = model
+        self.architecture = architecture
+        self.backend = backend
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_hash = checkpoint_hash
+        # Reported with every prediction; identifies the weights that served it
+        self.version = checkpoint_hash[:12]
+        self.checkpoint_stat = checkpoint_stat
+        self.mmapped = mmapped
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+        self.warm = False
+        # Set once a newer version replaced this one
+        self.retired = False
+
+
+def stat_key(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+class ModelRegistry:
+    """
+    Loads, warms and caches the serving models.
+
+    Models that share an architecture and an identical checkpoint (e.g.
+    skinnet, which reuses the resnet50 weights) resolve to the same
+    loaded instance.
+
+    A model can be replaced while serving (reload, or watch for changed
+    checkpoint files): the new weights are loaded and warmed next to the
+    old ones and swapped in atomically. Requests that already hold the old
+    entry finish on it; once no model uses it, it is marked retired and
+    passed to on_retire so per-entry resources can be released.
+
+    Every model has a circuit breaker (see circuit_breaker.py): after a
+    failed load, get_entry raises ModelUnavailable for a backoff window
+    instead of attempting the load again on every request.
+    """
+
+    def __init__(self, model_names, build_model, get_checkpoint_path, get_architecture,
+                 get_input_size=lambda model_name: 224, get_backend=lambda model_name: 'eager',
+                 get_intra_op_threads=lambda model_name: 0, use_mmap=True, on_retire=None,
+                 breaker_options=None):
+        self.model_names = list(model_names)
+        self.build_model = build_model
+        self.get_checkpoint_path = get_checkpoint_path
+        self.get_architecture = get_architecture
+        self.get_input_size = get_input_size
+        self.get_backend = get_backend
+        self.get_intra_op_threads = get_intra_op_threads
+        self.use_mmap = use_mmap
+        self.on_retire = on_retire
+
+        self._entries = {}       # model name -> LoadedModel
+        self._by_checkpoint = {}  # (architecture, backend, checkpoint hash) -> LoadedModel
+        self._errors = {}        # model name -> last load error
+        self._reload_errors = {}  # model name -> last failed reload (old version kept serving)
+        self._checkpoint_overrides = {}  # model name -> checkpoint chosen by reload()
+        self._lock = threading.Lock()
+        self._load_locks = {name: threading.Lock() for name in self.model_names}
+        self._warmup_thread = None
+        self._watch_interval = None
+        self._watch_pid = None
+        self.breakers = {
+            name: CircuitBreaker(name, **(breaker_options or {})) for name in self.model_names
+        }
+
+    def get(self, model_name):
+        """
+        Return the loaded model for model_name, loading it on first use
+        """
+        return self.get_entry(model_name).model
+
+    def get_entry(self, model_name):
+        """
+        Return the serving entry for model_name, loading it on first use.
+        Raises ModelUnavailable while the model's breaker is open.
+        """
+        breaker = self.breakers.get(model_name)
+        if breaker is not None:
+            breaker.check()
+        entry = self._entries.get(model_name)
+        if entry is None:
+            entry = self.load(model_name)
+        return entry
+
+    def load(self, model_name):
+        """
+        Load model_name, reusing an already loaded identical checkpoint
+        """
+        if model_name not in self._load_locks:
+            raise ValueError(f"Unknown model: {model_name}")
+
+        with self._load_locks[model_name]:
+            entry = self._entries.get(model_name)
+            if entry is not None:
+                return entry
+
+            # Callers queued on the lock behind a failed load give up at once
+            breaker = self.breakers[model_name]
+            breaker.check()
+            try:
+                entry = self._load_entry(model_name)
+            except Exception as e:
+                with self._lock:
+                    self._errors[model_name] = str(e)
+                breaker.record_failure(e)
+                raise ModelUnavailable(model_name, breaker.retry_after(), str(e)) from e
+
+            with self._lock:
+                self._entries[model_name] = entry
+                self._errors.pop(model_name, None)
+            breaker.record_success()
+            return entry
+
+    def checkpoint_path(self, model_name):
+        """
+        File the model is (or would be) loaded from
+        """
+        checkpoint_path = self._checkpoint_overrides.get(model_name) or self.get_checkpoint_path(model_name)
+        backend = self.get_backend(model_name)
+        if backend != 'eager':
+            # Optimized variants are prebuilt by optimize.py
+            checkpoint_path = artifact_path(checkpoint_path, backend)
+        return checkpoint_path
+
+    def _load_entry(self, model_name):
+        architecture = self.get_architecture(model_name)
+        backend = self.get_backend(model_name)
+        checkpoint_path = self.checkpoint_path(model_name)
+        checkpoint_stat = stat_key(checkpoint_path)
+        checkpoint_hash = hash_file(checkpoint_path)
+        key = (architecture, backend, checkpoint_hash)
+
+        with self._lock:
+            entry = self._by_checkpoint.get(key)
+
+        if entry is None:
+            logger.info("Loading %s model (%s) from %s", model_name, backend, checkpoint_path)
+            started = time.perf_counter()
+            if backend == 'eager':
+                model = self.build_model(model_name)
+                mmapped = load_checkpoint(model, checkpoint_path, use_mmap=self.use_mmap)
+                model.eval()  # Set to evaluation mode
+            else:
+                model = load_artifact(checkpoint_path, self.get_intra_op_threads(model_name))
+                mmapped = False
+            entry = LoadedModel(
+                model, architecture, backend, checkpoint_path, checkpoint_hash,
+                mmapped, time.perf_counter() - started, checkpoint_stat
+            )
+            model_loads_total.inc(model=model_name, backend=backend)
+            with self._lock:
+                entry = self._by_checkpoint.setdefault(key, entry)
+        else:
+            logger.info("Reusing %s weights for %s", checkpoint_path, model_name)
+        return entry
+
+    def reload(self, model_name, checkpoint_path=None, warm_up=True):
+        """
+        Load model_name's checkpoint again (or checkpoint_path instead),
+        warm it and swap it in without interrupting serving. Returns the
+        serving entry; an unchanged checkpoint keeps the current one. On
+        failure the current version keeps serving and the error is raised.
+        """
+        if model_name not in self._load_locks:
+            raise ValueError(f"Unknown model: {model_name}")
+
+        with self._load_locks[model_name]:
+            previous_override = self._checkpoint_overrides.get(model_name)
+            if checkpoint_path:
+                self._checkpoint_overrides[model_name] = checkpoint_path
+            try:
+                entry = self._load_entry(model_name)
+                if warm_up:
+                    self.warm_up(entry, model_name)
+            except Exception as e:
+                if checkpoint_path:
+                    self._checkpoint_overrides[model_name] = previous_override
+                with self._lock:
+                    self._reload_errors[model_name] = str(e)
+                logger.error("Reload of %s failed, keeping the current version: %s", model_name, e)
+                raise
+
+            with self._lock:
+                previous = self._entries.get(model_name)
+                self._entries[model_name] = entry
+                self._errors.pop(model_name, None)
+                self._reload_errors.pop(model_name, None)
+                retired = self._retire_unused()
+            self.breakers[model_name].record_success()
+            if previous is not entry:
+                logger.info(
+                    "Swapped %s from version %s to %s", model_name,
+                    previous.version if previous else None, entry.version
+                )
+        for old in retired:
+            old.retired = True
+            if self.on_retire is not None:
+                self.on_retire(old)
+        return entry
+
+    def _retire_unused(self):
+        # Entries no model serves any more; called with self._lock held
+        serving = {id(entry) for entry in self._entries.values()}
+        retired = [entry for entry in self._by_checkpoint.values() if id(entry) not in serving]
+        for entry in retired:
+            key = (entry.architecture, entry.backend, entry.checkpoint_hash)
+            self._by_checkpoint.pop(key, None)
+        return retired
+
+    def reload_changed(self):
+        """
+        Reload every loaded model whose checkpoint file changed on disk
+        (e.g. was atomically replaced by a deployment); returns their names
+        """
+        changed = []
+        for model_name in self.model_names:
+            entry = self._entries.get(model_name)
+            if entry is None:
+                continue
+            try:
+                if stat_key(self.checkpoint_path(model_name)) == entry.checkpoint_stat:
+                    continue
+            except OSError:
+                # Mid-replacement or removed; keep serving the loaded version
+                continue
+            try:
+                if self.reload(model_name) is not entry:
+                    changed.append(model_name)
+                else:
+                    # Same content under a new file; nothing to swap
+                    entry.checkpoint_stat = stat_key(entry.checkpoint_path)
+            except Exception:
+                # Logged by reload(); the loaded version keeps serving
+                pass
+        return changed
+
+    def watch(self, interval):
+        """
+        Poll checkpoint files every interval seconds and hot-swap changed
+        models. The watcher thread is restarted in forked worker processes.
+        """
+        self._watch_interval = interval
+        if self._watch_pid is None and hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._start_watcher)
+        self._start_watcher()
+
+    def _start_watcher(self):
+        if not self._watch_interval or self._watch_pid == os.getpid():
+            return
+        self._watch_pid = os.getpid()
+        threading.Thread(target=self._watch_forever, name='model-watcher', daemon=True).start()
+
+    def _watch_forever(self):
+        while True:
+            time.sleep(self._watch_interval)
+            try:
+                self.reload_changed()
+            except Exception as e:
+                logger.warning("Model watcher failed: %s", e)
+
+    def warm_up(self, entry, model_name):
+        """
+        Run one dummy forward pass so the first real request does not pay
+        for lazy allocations and kernel selection
+        """
+        if entry.warm:
+            return
+        size = self.get_input_size(model_name)
+        if entry.backend == 'onnx':
+            # ONNX Runtime takes NumPy input; torch is not needed at all
+            entry.model(np.zeros((1, 3, size, size), dtype=np.float32))
+        else:
+            import torch
+
+            with torch.no_grad():
+                entry.model(torch.zeros(1, 3, size, size))
+        entry.warm = True
+
+    def load_all(self, warm_up=True):
+        """
+        Load (and warm) every configured model. Failures are recorded in
+        status() rather than raised so one bad checkpoint does not stop
+        the others from loading.
+        """
+        for model_name in self.model_names:
+            try:
+                entry = self.load(model_name)
+                if warm_up:
+                    self.warm_up(entry, model_name)
+            except Exception as e:
+                logger.error("Failed to load %s: %s", model_name, e)
+
+    def load_all_in_background(self, warm_up=True):
+        """
+        Start load_all on a daemon thread and return immediately
+        """
+        self._warmup_thread = threading.Thread(
+            target=self.load_all, kwargs={'warm_up': warm_up},
+            name='model-warmup', daemon=True
+        )
+        self._warmup_thread.start()
+        return self._warmup_thread
+
+    def is_ready(self):
+        """
+        True once every configured model is loaded and warmed up
+        """
+        return all(
+            model_name in self._entries and self._entries[model_name].warm
+            for model_name in self.model_names
+        )
+
+    def status(self):
+        models = {}
+        for model_name in self.model_names:
+            entry = self._entries.get(model_name)
+            if entry is None:
+                models[model_name] = {
+                    'loaded': False,
+                    'warm': False,
+                    'error': self._errors.get(model_name),
+                }
+            else:
+                models[model_name] = {
+                    'loaded': True,
+                    'warm': entry.warm,
+                    'version': entry.version,
+                    'architecture': entry.architecture,
+                    'backend': entry.backend,
+                    'checkpoint': entry.checkpoint_path,
+                    'checkpoint_hash': entry.checkpoint_hash,
+                    'mmapped': entry.mmapped,
+                    'load_seconds': round(entry.load_seconds, 3),
+                    'loaded_at': round(entry.loaded_at, 3),
+                    'reload_error': self._reload_errors.get(model_name),
+                }
+            models[model_name]['breaker'] = self.breakers[model_name].status()
+        return {
+            'ready': self.is_ready(),
+            'loading': self._warmup_thread is not None and self._warmup_thread.is_alive(),
+            'models': models,
+        }
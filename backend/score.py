@@ -0,0 +1,424 @@
+"""
+Offline bulk scoring of image archives, e.g. to rescore everything when a
+new checkpoint lands:
+
+  python score.py /data/archive --model resnet50 inceptionv3 --output results/scores.parquet
+  python score.py --manifest images.txt --checkpoint resnet50=models/resnet50_v2.pth --output scores.csv
+
+Images are listed from a directory (recursively) or a manifest (one path
+per line, or a CSV with a 'path' column), decoded and preprocessed by a
+pool of worker processes that stays --prefetch chunks ahead of inference,
+and scored in batches with one forward pass per model and chunk (models
+sharing a checkpoint, like skinnet and resnet50, run once). Decode
+workers use a core each while the main process runs torch on every core.
+
+Output has one row per image and model: the image path and SHA-256, the
+model version, top-k codes and probabilities, and the probability of all
+classes (prob_<code> columns, in percent). Unreadable images get a row
+with status 'error'. Parquet output needs pyarrow.
+
+Progress is checkpointed every --checkpoint-every images: finished rows go
+to part files next to the output (<output>.parts/) and an interrupted run
+resumes from the last checkpoint when the same command is run again. The
+parts are merged into --output at the end.
+
+With SKINVISION_SIMILAR_DIR set and --index-embeddings, every image's
+embedding is also added to the similar-case index (see vector_index.py).
+"""
+import argparse
+import csv
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import time
+from collections import deque
+
+import numpy as np
+from PIL import UnidentifiedImageError
+
+import preprocessing
+from model_config import SERVING_MODELS
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+FORMATS = ('csv', 'parquet')
+
+
+def list_images(directory):
+    """
+    Image files below directory, as sorted paths relative to it
+    """
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.relpath(os.path.join(root, name), directory))
+    return sorted(paths)
+
+
+def read_manifest(manifest):
+    """
+    Image paths listed in a manifest: one per line ('#' starts a comment),
+    or the 'path' column of a .csv manifest
+    """
+    with open(manifest, newline='') as f:
+        if manifest.lower().endswith('.csv'):
+            return [row['path'] for row in csv.DictReader(f) if row.get('path')]
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+def init_decode_worker():
+    # Ctrl-C is handled by the main process, which stops the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def decode_chunk(task):
+    """
+    Decode and preprocess a chunk of images in a worker process. Returns
+    (start, {size: [n, 3, size, size] array}, hashes, errors); images that
+    fail to decode leave zeros in the arrays and an error message.
+    """
+    start, paths, sizes = task
+    arrays = {size: np.zeros((len(paths), 3, size, size), dtype=np.float32) for size in sizes}
+    hashes, errors = [], []
+    for index, path in enumerate(paths):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            for size, array in preprocessing.preprocess_sizes(io.BytesIO(data), sizes).items():
+                arrays[size][index] = array[0]
+            hashes.append(hashlib.sha256(data).hexdigest())
+            errors.append(None)
+        except UnidentifiedImageError:
+            hashes.append(None)
+            errors.append('Could not decode image')
+        except Exception as e:
+            hashes.append(None)
+            errors.append(f"{type(e).__name__}: {e}")
+    return start, arrays, hashes, errors
+
+
+def prefetch_chunks(pool, tasks, prefetch):
+    """
+    Run decode_chunk over tasks on the pool, keeping at most prefetch
+    chunks queued or waiting, and yield the results in order
+    """
+    tasks = iter(tasks)
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(decode_chunk, (task,)))
+        if len(pending) >= prefetch:
+            break
+    while pending:
+        result = pending.popleft().get()
+        task = next(tasks, None)
+        if task is not None:
+            pending.append(pool.apply_async(decode_chunk, (task,)))
+        yield result
+
+
+def result_columns(top_k):
+    """
+    Output columns in order
+    """
+    from postprocessing import LESION_CODES
+
+    columns = ['path', 'image_sha256', 'model', 'model_version', 'status', 'error']
+    for rank in range(1, top_k + 1):
+        columns += [f"top_{rank}_code", f"top_{rank}_probability"]
+    return columns + [f"prob_{code}" for code in LESION_CODES]
+
+
+def result_row(path, image_hash, model_name, version, probabilities, top_k):
+    from postprocessing import LESION_CODES
+
+    row = {'path': path, 'image_sha256': image_hash, 'model': model_name, 'model_version': version,
+           'status': 'ok', 'error': None}
+    for rank, index in enumerate(np.argsort(-probabilities, kind='stable')[:top_k], start=1):
+        row[f"top_{rank}_code"] = LESION_CODES[index]
+        row[f"top_{rank}_probability"] = round(float(probabilities[index]), 6)
+    for code, probability in zip(LESION_CODES, probabilities):
+        row[f"prob_{code}"] = round(float(probability), 6)
+    return row
+
+
+def write_part(path, rows, columns, output_format):
+    """
+    Write rows to a part file atomically
+    """
+    temporary = f"{path}.tmp"
+    if output_format == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pylist(rows, schema=parquet_schema(columns))
+        pq.write_table(table, temporary)
+    else:
+        with open(temporary, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+    os.replace(temporary, path)
+
+
+def parquet_schema(columns):
+    import pyarrow as pa
+
+    return pa.schema([
+        (name, pa.float32() if name.endswith('probability') or name.startswith('prob_') else pa.string())
+        for name in columns
+    ])
+
+
+def merge_parts(part_paths, output, columns, output_format):
+    """
+    Concatenate the part files into the final output file
+    """
+    temporary = f"{output}.tmp"
+    if output_format == 'parquet':
+        import pyarrow.parquet as pq
+        with pq.ParquetWriter(temporary, parquet_schema(columns)) as writer:
+            for part in part_paths:
+                writer.write_table(pq.read_table(part))
+    else:
+        with open(temporary, 'w', newline='') as out:
+            out.write(','.join(columns) + '\r\n')
+            for part in part_paths:
+                with open(part, newline='') as f:
+                    f.readline()  # header
+                    shutil.copyfileobj(f, out)
+    os.replace(temporary, output)
+
+
+class Progress:
+    """
+    Resumable progress of a scoring run: the part files written so far and
+    the number of images they cover, saved atomically after every part
+    """
+
+    def __init__(self, output, fingerprint, output_format, restart=False):
+        self.parts_dir = f"{output}.parts"
+        self.path = os.path.join(self.parts_dir, 'progress.json')
+        self.output_format = output_format
+        self.fingerprint = fingerprint
+        self.done = 0
+        self.parts = []
+
+        saved = None
+        if os.path.exists(self.path) and not restart:
+            with open(self.path) as f:
+                saved = json.load(f)
+            if saved['fingerprint'] != fingerprint:
+                raise SystemExit(
+                    f"{self.parts_dir} belongs to a different run (other images, models, checkpoints "
+                    f"or options); pass --restart to discard it"
+                )
+        if saved is None:
+            shutil.rmtree(self.parts_dir, ignore_errors=True)
+        else:
+            self.done = saved['done']
+            self.parts = saved['parts']
+        os.makedirs(self.parts_dir, exist_ok=True)
+        # Parts written after the last checkpoint of an interrupted run
+        for name in os.listdir(self.parts_dir):
+            if name != 'progress.json' and name not in self.parts:
+                os.remove(os.path.join(self.parts_dir, name))
+
+    def add_part(self, rows, columns, done):
+        name = f"part-{len(self.parts):06d}.{self.output_format}"
+        write_part(os.path.join(self.parts_dir, name), rows, columns, self.output_format)
+        self.parts.append(name)
+        self.done = done
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump({'fingerprint': self.fingerprint, 'done': done, 'parts': self.parts}, f)
+        os.replace(temporary, self.path)
+
+    def part_paths(self):
+        return [os.path.join(self.parts_dir, name) for name in self.parts]
+
+
+def score(paths, root, model_names, output, output_format='csv', top_k=5, batch_size=32,
+          decode_workers=None, prefetch=4, checkpoint_every=1024, checkpoints=None,
+          index_embeddings=False, restart=False):
+    """
+    Score every image in paths (relative to root, unless absolute) with
+    every model and write the results to output. Returns a summary dict.
+    """
+    import models
+
+    started = time.perf_counter()
+    # Group models by loaded instance so shared checkpoints run once
+    groups = {}
+    for model_name in model_names:
+        try:
+            if checkpoints and model_name in checkpoints:
+                models.registry.reload(model_name, checkpoints[model_name], warm_up=False)
+            entry = models.registry.get_entry(model_name)
+        except Exception as e:
+            raise SystemExit(f"Could not load {model_name}: {e}")
+        groups.setdefault(id(entry), (entry, []))[1].append(model_name)
+    versions = {model_name: entry.version for entry, members in groups.values() for model_name in members}
+    sizes = sorted({models.MODEL_INPUT_SIZES[model_name] for model_name in model_names})
+
+    fingerprint = hashlib.sha256(json.dumps(
+        [paths, sorted(versions.items()), top_k, output_format, os.path.abspath(root or '.')]
+    ).encode()).hexdigest()
+    progress = Progress(output, fingerprint, output_format, restart)
+    if progress.done:
+        print(f"Resuming after {progress.done} of {len(paths)} images")
+
+    columns = result_columns(top_k)
+    rows = []
+    failed = 0
+    done = progress.done
+    scored = 0
+    chunks = (
+        (start, [path if os.path.isabs(path) or not root else os.path.join(root, path)
+                 for path in paths[start:start + batch_size]], sizes)
+        for start in range(progress.done, len(paths), batch_size)
+    )
+    decode_workers = decode_workers or max(1, min(len(paths) // batch_size + 1, (os.cpu_count() or 2) // 4 or 1))
+    context = multiprocessing.get_context('spawn')
+    pool = context.Pool(decode_workers, initializer=init_decode_worker)
+    try:
+        for start, arrays, hashes, errors in prefetch_chunks(pool, chunks, prefetch):
+            ok = [index for index, error in enumerate(errors) if error is None]
+            for index, error in enumerate(errors):
+                if error is not None:
+                    failed += 1
+                    for model_name in model_names:
+                        rows.append(dict(
+                            {column: None for column in columns},
+                            path=paths[start + index], model=model_name, status='error', error=error
+                        ))
+            if ok:
+                for entry, members in groups.values():
+                    batch = arrays[models.MODEL_INPUT_SIZES[members[0]]][ok]
+                    probabilities, embeddings = models.forward_batch(members[0], [batch], entry)
+                    for position, index in enumerate(ok):
+                        for model_name in members:
+                            rows.append(result_row(
+                                paths[start + index], hashes[index], model_name, versions[model_name],
+                                probabilities[position], top_k
+                            ))
+                    if index_embeddings and embeddings is not None:
+                        top = [int(np.argmax(p)) for p in probabilities]
+                        models.similar_index(entry).add_many([
+                            (hashes[index], embeddings[position], os.path.basename(paths[start + index]),
+                             members[0], models.LESION_CODES[top[position]],
+                             round(float(probabilities[position][top[position]]), 2))
+                            for position, index in enumerate(ok)
+                        ])
+            scored += len(errors)
+            done = start + len(errors)
+            if len(rows) >= checkpoint_every * len(model_names) or done == len(paths):
+                progress.add_part(rows, columns, done)
+                rows = []
+                elapsed = time.perf_counter() - started
+                print(f"{done}/{len(paths)} images, {scored / elapsed:.1f} images/sec", flush=True)
+    except KeyboardInterrupt:
+        pool.terminate()
+        pool.join()
+        raise SystemExit(f"Interrupted after {progress.done} images; run the same command again to resume")
+    except BaseException:
+        pool.terminate()
+        pool.join()
+        raise
+    pool.close()
+    pool.join()
+
+    if rows:
+        progress.add_part(rows, columns, done)
+    merge_parts(progress.part_paths(), output, columns, output_format)
+    shutil.rmtree(progress.parts_dir)
+    elapsed = time.perf_counter() - started
+    return {
+        'images': len(paths),
+        'scored': scored,
+        'failed': failed,
+        'models': versions,
+        'output': output,
+        'seconds': round(elapsed, 3),
+        'images_per_second': round(scored / elapsed, 3) if elapsed else None,
+    }
+
+
+def parse_checkpoints(values):
+    """
+    MODEL=PATH pairs from --checkpoint
+    """
+    checkpoints = {}
+    for value in values or []:
+        model_name, _, path = value.partition('=')
+        if not path:
+            raise SystemExit(f"--checkpoint expects MODEL=PATH, got {value}")
+        checkpoints[model_name] = path
+    return checkpoints
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score a directory or manifest of images offline')
+    parser.add_argument('directory', nargs='?', help='directory scanned recursively for images')
+    parser.add_argument('--manifest', help='file listing image paths (one per line, or a CSV with a path column)')
+    parser.add_argument('--model', nargs='+', default=['resnet50'], choices=SERVING_MODELS)
+    parser.add_argument('--checkpoint', action='append', metavar='MODEL=PATH',
+                        help='score MODEL with this checkpoint instead of the serving one')
+    parser.add_argument('--output', default=os.path.join('results', 'scores.csv'))
+    parser.add_argument('--format', choices=FORMATS, help='output format (default: from the --output extension)')
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=32, help='images per forward pass')
+    parser.add_argument('--decode-workers', type=int, help='decode processes (default: a quarter of the cores)')
+    parser.add_argument('--threads', type=int, default=0, help='torch threads (default: all cores)')
+    parser.add_argument('--prefetch', type=int, default=4, help='decoded chunks kept ahead of inference')
+    parser.add_argument('--checkpoint-every', type=int, default=1024, help='images between progress checkpoints')
+    parser.add_argument('--index-embeddings', action='store_true',
+                        help='add the embeddings to the similar-case index (needs SKINVISION_SIMILAR_DIR)')
+    parser.add_argument('--restart', action='store_true', help='ignore the progress of an earlier run')
+    args = parser.parse_args()
+
+    if bool(args.directory) == bool(args.manifest):
+        parser.error('give either a directory or --manifest')
+    output_format = args.format or ('parquet' if args.output.endswith('.parquet') else 'csv')
+    if output_format == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error('Parquet output needs pyarrow (pip install pyarrow)')
+
+    if args.directory:
+        root, paths = args.directory, list_images(args.directory)
+    else:
+        root, paths = os.path.dirname(os.path.abspath(args.manifest)), read_manifest(args.manifest)
+    if not paths:
+        parser.error('no images found')
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+
+    # Read when models.py is imported; by default torch uses every core
+    if args.threads:
+        os.environ['SKINVISION_INTRA_OP_THREADS'] = str(args.threads)
+    os.environ.setdefault('SKINVISION_EAGER_LOAD', 'off')
+
+    summary = score(
+        paths, root, list(dict.fromkeys(args.model)), args.output,
+        output_format=output_format,
+        top_k=args.top_k,
+        batch_size=args.batch_size,
+        decode_workers=args.decode_workers,
+        prefetch=args.prefetch,
+        checkpoint_every=args.checkpoint_every,
+        checkpoints=parse_checkpoints(args.checkpoint),
+        index_embeddings=args.index_embeddings,
+        restart=args.restart,
+    )
+    print(json.dumps(summary, indent=2))
+    return 1 if summary['failed'] == summary['images'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""
+Production launcher for the ASGI serving mode (asgi.py):
+
+  python serve.py --workers 4 --inference-workers 2 --inference-queue 16
+
+Each worker process has its own event loop, loaded models and inference
+executor, so --workers times --inference-workers bounds the concurrent
+forward passes on the host. Options default to the environment:
+
+  SKINVISION_HOST               bind address (default 0.0.0.0)
+  SKINVISION_PORT               port (default 5000)
+  SKINVISION_WORKERS            worker processes (default 1)
+  SKINVISION_INFERENCE_WORKERS  inference threads per worker (default 2)
+  SKINVISION_INFERENCE_QUEUE    waiting requests per worker before 429 (default 16)
+
+With SKINVISION_THREAD_POLICY=auto the worker count and torch threads per
+worker come from the startup calibration in cpu_policy.py. Core pinning
+needs stable worker slots and is only available with gunicorn.conf.py.
+"""
+import argparse
+import os
+
+import cpu_policy
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the SkinVision API with uvicorn')
+    parser.add_argument('--host', default=os.environ.get('SKINVISION_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('SKINVISION_PORT', '5000')))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('SKINVISION_WORKERS', '1')),
+                        help='worker processes')
+    parser.add_argument('--inference-workers', type=int,
+                        default=int(os.environ.get('SKINVISION_INFERENCE_WORKERS', '2')),
+                        help='concurrent inference calls per worker')
+    parser.add_argument('--inference-queue', type=int,
+                        default=int(os.environ.get('SKINVISION_INFERENCE_QUEUE', '16')),
+                        help='requests waiting for inference per worker before answering 429')
+    parser.add_argument('--keep-alive', type=int, default=5, help='idle keep-alive timeout in seconds')
+    args = parser.parse_args()
+
+    if os.environ.get('SKINVISION_THREAD_POLICY', 'manual') == 'auto':
+        args.workers = cpu_policy.apply_plan(cpu_policy.plan())
+
+    # Read by asgi.py when each worker process imports it
+    os.environ['SKINVISION_INFERENCE_WORKERS'] = str(args.inference_workers)
+    os.environ['SKINVISION_INFERENCE_QUEUE'] = str(args.inference_queue)
+
+    import uvicorn
+    uvicorn.run(
+        'asgi:app',
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_keep_alive=args.keep_alive,
+        # Requests are logged by the app's own summaries (structured_logging.py)
+        access_log=False,
+        log_config=None,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+Startup-time report: what importing the backend costs, per module.
+
+Imports the app in a fresh interpreter (with SKINVISION_EAGER_LOAD=off and
+python -X importtime), then the deferred inference code the way the first
+request that runs a model does, and prints for each phase its wall time
+and the packages that took longest (import self time summed over each
+top-level package).
+
+  python startup_report.py
+  python startup_report.py --top 20 --json startup.json
+
+A running server reports the same two phases in /api/ready ('startup').
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Imports the app, then models.py as the app's LazyModule does on first use
+# (with an import statement, which is what -X importtime reports), marking
+# on stderr where each phase ends (one write per marker, so log records from
+# the logging thread cannot split it)
+CHILD = """
+import sys, time
+start = time.perf_counter()
+import app
+sys.stderr.write(f"phase app {time.perf_counter() - start}\\n")
+sys.stderr.flush()
+start = time.perf_counter()
+import models
+sys.stderr.write(f"phase models {time.perf_counter() - start}\\n")
+sys.stderr.flush()
+"""
+
+PHASES = {
+    'app': 'HTTP layer (import app)',
+    'models': 'Inference code (first model request)',
+}
+
+
+def run_child():
+    """
+    Run CHILD and return its stderr lines
+    """
+    env = dict(os.environ, SKINVISION_EAGER_LOAD='off', SKINVISION_LOG_LEVEL='WARNING')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"Import failed:\n{result.stderr[-2000:]}")
+    return result.stderr.splitlines()
+
+
+def parse_importtime(lines):
+    """
+    Split -X importtime output into phases. Returns a list of
+    (phase, wall seconds, [(module, self us, cumulative us, depth)]).
+    """
+    phases, imports = [], []
+    for line in lines:
+        if line.startswith('phase '):
+            _, phase, seconds = line.split()
+            phases.append((phase, float(seconds), imports))
+            imports = []
+            continue
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        module = name.lstrip()
+        depth = (len(name) - len(module) - 1) // 2
+        imports.append((module, int(fields[0]), int(fields[1]), depth))
+    return phases
+
+
+def summarize(phases, top):
+    """
+    Per phase: wall time, module count, the costliest top-level packages
+    (by summed self time) and the slowest imports made by the phase's own
+    module (by cumulative time)
+    """
+    report = []
+    for phase, seconds, imports in phases:
+        packages = defaultdict(lambda: [0, 0])
+        for module, self_us, _, _ in imports:
+            package = packages[module.split('.')[0]]
+            package[0] += self_us
+            package[1] += 1
+        direct = [(module, cumulative) for module, _, cumulative, depth in imports if depth == 1]
+        report.append({
+            'phase': phase,
+            'description': PHASES.get(phase, phase),
+            'wall_seconds': round(seconds, 3),
+            'modules': len(imports),
+            'packages': [
+                {'package': package, 'self_ms': round(self_us / 1000, 1), 'modules': count}
+                for package, (self_us, count) in sorted(packages.items(), key=lambda item: -item[1][0])[:top]
+            ],
+            'direct_imports': [
+                {'module': module, 'cumulative_ms': round(cumulative / 1000, 1)}
+                for module, cumulative in sorted(direct, key=lambda item: -item[1])[:top]
+            ],
+        })
+    return report
+
+
+def print_report(report):
+    for phase in report:
+        print(f"{phase['description']}: {phase['wall_seconds']:.2f}s, {phase['modules']} modules imported")
+        print(f"  {'package':<28}{'self ms':>10}{'modules':>9}")
+        for package in phase['packages']:
+            print(f"  {package['package']:<28}{package['self_ms']:>10.1f}{package['modules']:>9}")
+        print(f"  {'direct import':<28}{'total ms':>10}")
+        for module in phase['direct_imports']:
+            print(f"  {module['module']:<28}{module['cumulative_ms']:>10.1f}")
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report the import cost of the backend per module')
+    parser.add_argument('--top', type=int, default=10, help='packages and imports listed per phase')
+    parser.add_argument('--json', help='also write the report to this JSON file')
+    args = parser.parse_args()
+
+    report = summarize(parse_importtime(run_child()), args.top)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""
+Asynchronous, structured logging for the API.
+
+Request threads only put log records on a bounded in-memory queue; a
+listener thread formats and writes them, so a slow stdout or log
+pipeline never blocks a request. When the queue is full records are
+dropped (and counted) instead of waiting. Messages use %-style
+arguments and are only formatted by the listener.
+
+Each request produces one compact summary record (request id, route,
+status, duration, model, top-1 and per-stage timings) rather than
+dumps of headers, bodies and results. Summaries are sampled per route:
+
+  SKINVISION_LOG_FORMAT       json (default) or text
+  SKINVISION_LOG_LEVEL        INFO by default
+  SKINVISION_LOG_SAMPLE_RATE  fraction of request summaries logged (default 1)
+  SKINVISION_LOG_SAMPLING     per-route overrides, e.g. "/api/analyze=0.1,/api/ready=0"
+  SKINVISION_LOG_QUEUE_SIZE   max records waiting to be written (default 10000)
+
+Failed requests (status >= 400) are always logged unless their route's
+rate is 0.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line; structured fields passed as
+    extra={'fields': {...}} are merged into the object
+    """
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """
+    Plain text lines with structured fields appended as key=value pairs
+    """
+
+    def __init__(self):
+        super(TextFormatter, self).__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        line = super(TextFormatter, self).format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Wait for room: records may be dropped, the stop request may not
+        self.queue.put(self._sentinel)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that never blocks the caller and defers formatting to
+    the listener thread. Starts its listener lazily in every process, so
+    it keeps working in workers forked after configuration.
+    """
+
+    def __init__(self, log_queue, handlers):
+        super(NonBlockingQueueHandler, self).__init__(log_queue)
+        self.handlers = handlers
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                # A queue inherited across fork may hold a lock owned by a
+                # thread that no longer exists, so each process gets a new one
+                if self._pid is not None:
+                    self.queue = queue.Queue(maxsize=self.queue.maxsize)
+                self._listener = _QueueListener(
+                    self.queue, *self.handlers, respect_handler_level=True
+                )
+                self._listener.start()
+                self._pid = os.getpid()
+
+    def prepare(self, record):
+        # Leave msg % args to the listener. Tracebacks are rendered here
+        # (errors are rare) so no frames are kept alive on the queue.
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._pid = None
+
+
+def _parse_sampling(value):
+    rates = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            route, rate = item.rsplit('=', 1)
+            rates[route.strip()] = float(rate)
+    return rates
+
+
+class RequestSampler:
+    """
+    Decides whether a request summary is logged, per route
+    """
+
+    def __init__(self, default_rate=1.0, route_rates=None):
+        self.default_rate = default_rate
+        self.route_rates = route_rates or {}
+
+    def should_log(self, route, status):
+        rate = self.route_rates.get(route, self.default_rate)
+        # A rate of 0 silences a route (e.g. readiness probes) completely;
+        # otherwise failed requests are always kept
+        if rate <= 0.0:
+            return False
+        if status >= 400:
+            return True
+        return rate >= 1.0 or random.random() < rate
+
+
+queue_handler = None
+sampler = RequestSampler(
+    default_rate=float(os.environ.get('SKINVISION_LOG_SAMPLE_RATE', '1')),
+    route_rates=_parse_sampling(os.environ.get('SKINVISION_LOG_SAMPLING')),
+)
+
+
+def configure_logging(level=None, fmt=None, queue_size=None, stream=None):
+    """
+    Route all logging through a non-blocking queue and return the handler.
+    Safe to call more than once; later calls replace the earlier setup.
+    """
+    global queue_handler
+    level = level or os.environ.get('SKINVISION_LOG_LEVEL', 'INFO')
+    fmt = fmt or os.environ.get('SKINVISION_LOG_FORMAT', 'json')
+    queue_size = queue_size or int(os.environ.get('SKINVISION_LOG_QUEUE_SIZE', '10000'))
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+
+    root = logging.getLogger()
+    if queue_handler is not None:
+        root.removeHandler(queue_handler)
+        queue_handler.stop()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size), [output])
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    # Werkzeug's per-request access lines duplicate the request summary
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    return queue_handler
+
+
+def log_request(logger, request_id, route, method, status, duration, stages=None, **fields):
+    """
+    Emit the summary record for one request if the route's sample rate
+    selects it. stages maps stage name -> seconds.
+    """
+    if not sampler.should_log(route, status):
+        return
+    summary = {
+        'request_id': request_id,
+        'route': route,
+        'method': method,
+        'status': status,
+        'duration_ms': round(duration * 1000, 3),
+    }
+    if stages:
+        summary['stages_ms'] = {stage: round(seconds * 1000, 3) for stage, seconds in stages.items()}
+    summary.update((key, value) for key, value in fields.items() if value is not None)
+    level = logging.WARNING if status >= 500 else logging.INFO
+    logger.log(level, 'request %s %s %s', method, route, status, extra={'fields': summary})
+
+
+def dropped_records():
+    """
+    Records dropped because the log queue was full
+    """
+    return queue_handler.dropped if queue_handler is not None else 0
+
+
+def flush(timeout=2.0):
+    """
+    Wait (up to timeout seconds) until queued records have been written
+    """
+    if queue_handler is None:
+        return
+    deadline = time.monotonic() + timeout
+    while not queue_handler.queue.empty() and time.monotonic() < deadline:
+        time.sleep(0.01)
@@ -0,0 +1,127 @@
+"""
+Preprocessed tensors stored next to uploads.
+
+/api/upload decodes each image once per model input size and saves the
+normalized [1, 3, size, size] float32 arrays as .npy files beside the
+upload, together with a small JSON sidecar holding the image hash. Later
+analyses memory-map those arrays instead of decoding the image again.
+
+Artifacts are tied to the preprocessing fingerprint and to the size and
+mtime of the upload, so they are ignored and removed once the
+preprocessing configuration changes or the upload is overwritten.
+"""
+import glob
+import hashlib
+import io
+import json
+import os
+import numpy as np
+import preprocessing
+
+
+def tensor_path(upload_path, size, fingerprint=None):
+    fingerprint = fingerprint or preprocessing.preprocess_fingerprint()
+    return f"{upload_path}.{size}.{fingerprint}.npy"
+
+
+def meta_path(upload_path):
+    return f"{upload_path}.prep.json"
+
+
+def _source_stat(upload_path):
+    stat = os.stat(upload_path)
+    return {'source_size': stat.st_size, 'source_mtime_ns': stat.st_mtime_ns}
+
+
+def _atomic_save(path, array):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(array, dtype=np.float32))
+    os.replace(tmp_path, path)
+
+
+def preprocessed_bytes(upload_path):
+    """
+    Disk space taken by the stored tensors and the sidecar of an upload
+    """
+    total = 0
+    for path in glob.glob(glob.escape(upload_path) + '.*.npy') + [meta_path(upload_path)]:
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            pass
+    return total
+
+
+def remove_preprocessed(upload_path):
+    """
+    Delete every stored tensor and the sidecar for an upload
+    """
+    for path in glob.glob(glob.escape(upload_path) + '.*.npy') + [meta_path(upload_path)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def store_preprocessed(upload_path, sizes):
+    """
+    Decode upload_path for every size and persist the model-ready tensors.
+    Returns the SHA-256 of the image bytes.
+    """
+    with open(upload_path, 'rb') as f:
+        image_bytes = f.read()
+
+    # Drop artifacts from an older preprocessing configuration first
+    remove_preprocessed(upload_path)
+
+    fingerprint = preprocessing.preprocess_fingerprint()
+    arrays = preprocessing.preprocess_sizes(io.BytesIO(image_bytes), sizes)
+    for size, array in sorted(arrays.items()):
+        _atomic_save(tensor_path(upload_path, size, fingerprint), array)
+
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    meta = {
+        'fingerprint': fingerprint,
+        'sha256': image_hash,
+        'sizes': sorted(set(sizes)),
+        **_source_stat(upload_path),
+    }
+    tmp_path = f"{meta_path(upload_path)}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path(upload_path))
+    return image_hash
+
+
+def load_preprocessed(upload_path, size):
+    """
+    Return (array, image_sha256) for a stored tensor of upload_path at
+    size, or None if there is no up-to-date artifact. The array is
+    memory-mapped copy-on-write, so nothing is read until it is used.
+    """
+    try:
+        with open(meta_path(upload_path)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    try:
+        current = _source_stat(upload_path)
+    except OSError:
+        return None
+    if (meta.get('fingerprint') != preprocessing.preprocess_fingerprint()
+            or meta.get('source_size') != current['source_size']
+            or meta.get('source_mtime_ns') != current['source_mtime_ns']):
+        # Stale: preprocessing changed or the upload was replaced
+        remove_preprocessed(upload_path)
+        return None
+
+    path = tensor_path(upload_path, size, meta['fingerprint'])
+    if not os.path.exists(path):
+        return None
+    array = np.load(path, mmap_mode='c')
+    if array.shape != (1, 3, size, size):
+        return None
+    return array, meta['sha256']
+
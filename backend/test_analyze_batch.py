@@ -0,0 +1,104 @@
+"""
+Tests for /api/analyze/batch: request validation, and that results go
+through the prediction cache like single analyses. The forward pass is
+replaced, so no checkpoints are needed.
+"""
+import io
+import json
+import os
+import types
+
+os.environ.setdefault('SKINVISION_EAGER_LOAD', 'off')
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import app as backend
+from postprocessing import LESION_CODES
+from prediction_cache import PredictionCache
+
+
+@pytest.fixture
+def client():
+    return backend.app.test_client()
+
+
+def image_bytes(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def read_records(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines() if line]
+
+
+@pytest.mark.parametrize('body, error', [
+    ({'filenames': 'abc.jpg', 'model': 'resnet50'}, 'filenames must be a list of strings'),
+    ({'filenames': ['a.jpg', 3], 'model': 'resnet50'}, 'filenames must be a list of strings'),
+    ({'filenames': ['a.jpg'], 'models': {'resnet50': 1}}, 'models must be a model id or a list of model ids'),
+    (['a.jpg'], 'Request body must be a JSON object'),
+    ('a.jpg', 'Request body must be a JSON object'),
+])
+def test_invalid_json_body_is_rejected(client, body, error):
+    response = client.post('/api/analyze/batch', json=body)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': error}
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    """
+    Serve resnet50 from a fake forward pass that records its batch sizes
+    """
+    models = backend.models.load()
+    calls = []
+
+    def run_model_batch(model_name, input_tensors, entry=None):
+        calls.append(len(input_tensors))
+        return [np.full(len(LESION_CODES), 100.0 / len(LESION_CODES)) for _ in input_tensors]
+
+    entry = types.SimpleNamespace(version='v1', checkpoint_hash='checkpoint-v1')
+    monkeypatch.setattr(models, 'prediction_cache', PredictionCache(max_entries=16))
+    monkeypatch.setattr(models, 'run_model_batch', run_model_batch)
+    monkeypatch.setattr(models.registry, 'get_entry', lambda model_name: entry)
+    return calls
+
+
+def analyze(client, *images):
+    data = {
+        'files': [(io.BytesIO(content), f"image{index}.png") for index, content in enumerate(images)],
+        'model': 'resnet50',
+    }
+    response = client.post('/api/analyze/batch', data=data, content_type='multipart/form-data')
+    assert response.status_code == 200
+    records = read_records(response)
+    assert records[-1]['done'] is True
+    return records[:-1]
+
+
+def test_batch_uses_prediction_cache(client, fake_model):
+    red, blue = image_bytes('red'), image_bytes('blue')
+
+    first = analyze(client, red)
+    assert fake_model == [1]
+
+    # red is cached now: only blue is run
+    second = analyze(client, red, blue)
+    assert fake_model == [1, 1]
+    assert [record['success'] for record in second] == [True, True]
+    assert second[0]['results'] == first[0]['results']
+    assert second[0]['results']['model_version'] == 'v1'
+
+    analyze(client, blue, red)
+    assert fake_model == [1, 1]
+
+
+def test_single_analysis_reuses_batch_results(client, fake_model):
+    models = backend.models.load()
+    red = image_bytes('red')
+    analyze(client, red)
+    assert models.prediction_cache.stats()['memory_entries'] == 1
+    models.predict_with_model(red, 'resnet50')
+    assert fake_model == [1]
@@ -0,0 +1,142 @@
+"""
+Tests for /api/analyze with the image in the request (raw image/jpeg or
+image/png body, or multipart): nothing reaches the upload store unless
+persist is asked for, and bodies that are not images are rejected. The
+forward pass is replaced, so no checkpoints are needed.
+"""
+import io
+import os
+import types
+from concurrent.futures import Future
+
+os.environ.setdefault('SKINVISION_EAGER_LOAD', 'off')
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import app as backend
+from circuit_breaker import CLOSED, CircuitBreaker
+from postprocessing import LESION_CODES
+from prediction_cache import PredictionCache
+from upload_store import UploadStore
+
+
+def jpeg_bytes(color='navy'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (48, 40), color).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def served(monkeypatch, tmp_path):
+    """
+    resnet50 served by a fake forward pass and an empty upload store in a
+    temporary directory
+    """
+    models = backend.models.load()
+    runs = []
+
+    def submit_inference(model_name, entry, input_tensor):
+        runs.append(np.asarray(input_tensor).shape)
+        future = Future()
+        future.set_result((np.full(len(LESION_CODES), 100.0 / len(LESION_CODES)), None))
+        return future
+
+    entry = types.SimpleNamespace(version='v1', checkpoint_hash='checkpoint-v1', backend='eager')
+    monkeypatch.setitem(models.registry._entries, 'resnet50', entry)
+    monkeypatch.setitem(models.registry.breakers, 'resnet50', CircuitBreaker('resnet50'))
+    monkeypatch.setattr(models, 'submit_inference', submit_inference)
+    monkeypatch.setattr(models, 'prediction_cache', PredictionCache(max_entries=16))
+    store = UploadStore(str(tmp_path / 'uploads'))
+    monkeypatch.setattr(backend, 'upload_store', store)
+    monkeypatch.setitem(backend.app.config, 'PREPROCESS_ON_UPLOAD', False)
+    return types.SimpleNamespace(
+        client=backend.app.test_client(), models=models, runs=runs, store=store, root=tmp_path / 'uploads'
+    )
+
+
+def stored_images(root):
+    return sorted(
+        name for _, _, files in os.walk(root) for name in files if name.rsplit('.', 1)[-1] in ('jpg', 'png')
+    )
+
+
+def test_raw_jpeg_is_analyzed_without_writing_files(served, monkeypatch):
+    monkeypatch.setattr(served.store, 'save', lambda *args: pytest.fail('upload store written'))
+    response = served.client.post(
+        '/api/analyze?model=resnet50&top_k=3', data=jpeg_bytes(), content_type='image/jpeg'
+    )
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['success'] is True
+    assert 'filename' not in body
+    assert len(body['results']['predictions']) == 3
+    assert body['results']['model_version'] == 'v1'
+    assert served.runs == [(1, 3, 224, 224)]
+    assert stored_images(served.root) == []
+
+
+def test_raw_png_is_analyzed(served):
+    buffer = io.BytesIO()
+    Image.new('RGB', (20, 30), 'red').save(buffer, format='PNG')
+    response = served.client.post('/api/analyze?model=resnet50', data=buffer.getvalue(), content_type='image/png')
+    assert response.status_code == 200
+    assert len(response.get_json()['results']['predictions']) == len(LESION_CODES)
+
+
+def test_multipart_image_is_analyzed_without_writing_files(served):
+    response = served.client.post('/api/analyze', data={
+        'file': (io.BytesIO(jpeg_bytes()), 'lesion.jpg'), 'model': 'resnet50', 'top_k': '2'
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert len(response.get_json()['results']['predictions']) == 2
+    assert stored_images(served.root) == []
+
+
+def test_persist_saves_in_background(served):
+    image = jpeg_bytes('green')
+    response = served.client.post('/api/analyze?model=resnet50&persist=1', data=image, content_type='image/jpeg')
+    assert response.status_code == 200
+    filename = response.get_json()['filename']
+    # Wait for the background save
+    backend.persist_executor.submit(lambda: None).result(10)
+    path = served.store.resolve(filename)
+    with open(path, 'rb') as f:
+        assert f.read() == image
+
+
+@pytest.mark.parametrize('body', [
+    b'this is not an image',
+    b'\xff\xd8\xff\xe0 truncated jpeg header',
+    b'GIF89a\x01\x00\x01\x00',
+])
+@pytest.mark.parametrize('query', ['model=resnet50', 'model=resnet50&tta=1'])
+def test_non_image_body_is_rejected(served, body, query):
+    response = served.client.post(f"/api/analyze?{query}", data=body, content_type='image/jpeg')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Could not decode image'}
+    assert served.runs == []
+    # Bad input is not the model's fault
+    assert served.models.registry.breakers['resnet50'].state == CLOSED
+    assert stored_images(served.root) == []
+
+
+@pytest.mark.parametrize('query, content_type, body, error', [
+    ('model=resnet50', 'image/jpeg', b'', 'Empty image'),
+    ('', 'image/jpeg', None, 'Missing model selection'),
+    ('model=resnet50&top_k=0', 'image/jpeg', None, 'top_k must be a positive integer'),
+    ('model=resnet50&tta=sideways', 'image/jpeg', None, None),
+    ('model=resnet50', 'application/octet-stream', None, 'Invalid JSON body'),
+    ('model=resnet50', 'text/plain', b'hello', 'Invalid JSON body'),
+    ('model=resnet50', 'application/json', b'[1, 2]', 'Missing filename or model selection'),
+])
+def test_bad_requests_are_rejected(served, query, content_type, body, error):
+    data = jpeg_bytes() if body is None else body
+    response = served.client.post(f"/api/analyze?{query}", data=data, content_type=content_type)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+    if error:
+        assert response.get_json()['error'] == error
+    assert served.runs == []
+    assert stored_images(served.root) == []
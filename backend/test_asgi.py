@@ -0,0 +1,173 @@
+"""
+Tests for the ASGI serving mode: the bounded inference executor, 429 with
+Retry-After when its queue is full, and the body size limit. Requests are
+sent straight to the ASGI callables; no models are loaded.
+"""
+import asyncio
+import json
+import os
+import threading
+
+os.environ.setdefault('SKINVISION_EAGER_LOAD', 'off')
+
+import pytest
+
+pytest.importorskip('starlette')
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+
+import asgi
+
+
+async def request(app, method, path, chunks=(b'',), headers=(), query=b''):
+    """
+    Send one request to an ASGI app, its body in the given chunks;
+    returns (status, headers, body)
+    """
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': query, 'root_path': '', 'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        'headers': [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in headers],
+    }
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': index < len(chunks) - 1}
+                for index, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    response_headers = {key.decode('latin-1'): value.decode('latin-1') for key, value in sent[0]['headers']}
+    return sent[0]['status'], response_headers, b''.join(message.get('body', b'') for message in sent[1:])
+
+
+def limited_app(max_content_length):
+    # asgi.app with a small body limit
+    return Starlette(
+        routes=asgi.routes,
+        middleware=[Middleware(asgi.RequestMiddleware, max_content_length=max_content_length)],
+        exception_handlers={asgi.RequestTooLarge: asgi.request_too_large},
+    )
+
+
+class Gate:
+    """
+    A blocking call that records how many run at once and waits until
+    released
+    """
+
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+        self.started = threading.Semaphore(0)
+        self._release = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self, value):
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        self.started.release()
+        self._release.wait(10)
+        with self._lock:
+            self.running -= 1
+        return value
+
+    def release(self):
+        self._release.set()
+
+
+def test_executor_bounds_concurrency_and_rejects_beyond_queue():
+    executor = asgi.InferenceExecutor(workers=2, max_queue=1)
+    gate = Gate()
+
+    async def scenario():
+        tasks = [asyncio.ensure_future(executor.run(gate, index)) for index in range(3)]
+        await asyncio.sleep(0)
+        for _ in range(2):
+            await asyncio.to_thread(gate.started.acquire, True, 10)
+        # Two running, one waiting: the next call is turned away
+        assert executor.stats()['pending'] == 3
+        with pytest.raises(asgi.ServerBusy) as busy:
+            await executor.run(gate, 3)
+        assert busy.value.retry_after >= 1
+        gate.release()
+        return await asyncio.gather(*tasks)
+
+    assert asyncio.run(scenario()) == [0, 1, 2]
+    assert gate.peak == 2
+    stats = executor.stats()
+    assert stats['pending'] == 0
+    assert stats['completed'] == 3
+    assert stats['rejected'] == 1
+    assert stats['avg_service_ms'] > 0
+
+
+def test_retry_after_grows_with_backlog():
+    executor = asgi.InferenceExecutor(workers=2, max_queue=8)
+    executor._service_time = 3.0
+    executor._pending = 10
+    assert executor.retry_after() == 15
+    executor._pending = 0
+    assert executor.retry_after() == 1
+
+
+def test_analyze_gets_429_with_retry_after_when_queue_is_full(monkeypatch):
+    executor = asgi.InferenceExecutor(workers=1, max_queue=0)
+    monkeypatch.setattr(asgi, 'inference', executor)
+    gate = Gate()
+
+    async def scenario():
+        busy = asyncio.ensure_future(executor.run(gate, None))
+        await asyncio.to_thread(gate.started.acquire, True, 10)
+        try:
+            return await request(
+                limited_app(1024), 'POST', '/api/analyze', chunks=[b'\xff\xd8 not really a jpeg'],
+                headers=[('Content-Type', 'image/jpeg')], query=b'model=resnet50',
+            )
+        finally:
+            gate.release()
+            await busy
+
+    status, headers, body = asyncio.run(scenario())
+    assert status == 429
+    assert int(headers['retry-after']) >= 1
+    assert json.loads(body)['error'] == 'Server busy, retry later'
+    assert 'x-request-id' in headers
+    assert executor.stats()['rejected'] == 1
+
+
+def test_declared_oversized_body_gets_413():
+    status, headers, body = asyncio.run(request(
+        limited_app(64), 'POST', '/api/analyze', chunks=[b'x' * 65],
+        headers=[('Content-Type', 'image/jpeg'), ('Content-Length', '65'), ('X-Request-ID', 'abc')],
+        query=b'model=resnet50',
+    ))
+    assert status == 413
+    assert json.loads(body) == {'error': 'Request too large'}
+    assert headers['x-request-id'] == 'abc'
+
+
+def test_streamed_oversized_body_gets_413():
+    # No Content-Length: the limit is enforced while the body is received
+    status, _, body = asyncio.run(request(
+        limited_app(64), 'POST', '/api/analyze', chunks=[b'x' * 40, b'x' * 40],
+        headers=[('Content-Type', 'image/jpeg')], query=b'model=resnet50',
+    ))
+    assert status == 413
+    assert json.loads(body) == {'error': 'Request too large'}
+
+
+def test_body_within_limit_reaches_the_endpoint():
+    status, headers, body = asyncio.run(request(
+        limited_app(64), 'POST', '/api/analyze', chunks=[b'{"model": "resnet50"}'],
+        headers=[('Content-Type', 'application/json')],
+    ))
+    assert status == 400
+    assert json.loads(body) == {'error': 'Missing filename or model selection'}
+    assert len(headers['x-request-id']) == 16
@@ -0,0 +1,99 @@
+"""
+Tests for the micro-batcher: when batches are flushed, how failures reach
+the callers and what stats() reports
+"""
+import time
+
+import pytest
+
+from batching import MicroBatcher
+
+
+def doubled(items):
+    return [item * 2 for item in items]
+
+
+def test_flushes_as_soon_as_batch_is_full():
+    batches = []
+
+    def run_batch(items):
+        batches.append(list(items))
+        return doubled(items)
+
+    # The deadline is far away, so only a full batch can trigger the flush
+    batcher = MicroBatcher('full', run_batch, max_batch_size=4, max_wait_ms=10000)
+    started = time.perf_counter()
+    futures = [batcher.submit(item) for item in range(4)]
+    assert [future.result(timeout=5) for future in futures] == [0, 2, 4, 6]
+    assert time.perf_counter() - started < 5
+    assert batches == [[0, 1, 2, 3]]
+    batcher.close()
+
+
+def test_flushes_partial_batch_at_deadline():
+    batches = []
+
+    def run_batch(items):
+        batches.append(list(items))
+        return doubled(items)
+
+    batcher = MicroBatcher('deadline', run_batch, max_batch_size=8, max_wait_ms=100)
+    started = time.perf_counter()
+    futures = [batcher.submit(item) for item in (1, 2)]
+    assert [future.result(timeout=5) for future in futures] == [2, 4]
+    assert time.perf_counter() - started >= 0.1
+    assert batches == [[1, 2]]
+    batcher.close()
+
+
+def test_failure_reaches_every_caller_in_the_batch():
+    error = ValueError('forward failed')
+
+    def run_batch(items):
+        raise error
+
+    batcher = MicroBatcher('failing', run_batch, max_batch_size=3, max_wait_ms=10000)
+    futures = [batcher.submit(item) for item in range(3)]
+    for future in futures:
+        with pytest.raises(ValueError) as raised:
+            future.result(timeout=5)
+        assert raised.value is error
+    assert batcher.stats()['errors'] == 1
+    batcher.close()
+
+
+def test_wrong_result_count_fails_the_batch():
+    batcher = MicroBatcher('short', lambda items: items[:1], max_batch_size=2, max_wait_ms=10000)
+    futures = [batcher.submit(item) for item in range(2)]
+    for future in futures:
+        with pytest.raises(RuntimeError, match='returned 1 results for 2 items'):
+            future.result(timeout=5)
+    batcher.close()
+
+
+def test_stats_report_batch_sizes():
+    batcher = MicroBatcher('stats', doubled, max_batch_size=3, max_wait_ms=10000)
+    first = [batcher.submit(item) for item in range(3)]
+    [future.result(timeout=5) for future in first]
+    second = [batcher.submit(item) for item in range(3)]
+    [future.result(timeout=5) for future in second]
+    # close() drains a partial batch without waiting for its deadline
+    last = batcher.submit(9)
+    batcher.close()
+    assert last.result(timeout=5) == 18
+
+    stats = batcher.stats()
+    assert stats['requests'] == 7
+    assert stats['batches'] == 3
+    assert stats['errors'] == 0
+    assert stats['avg_batch_size'] == round(7 / 3, 3)
+    assert stats['queue_depth'] == 0
+    assert stats['max_batch_size'] == 3
+    assert stats['latency_ms']['p50'] <= stats['latency_ms']['p99']
+
+
+def test_submit_after_close_is_refused():
+    batcher = MicroBatcher('closed', doubled)
+    batcher.close()
+    with pytest.raises(RuntimeError, match='closed'):
+        batcher.submit(1)
@@ -0,0 +1,71 @@
+"""
+pytest-benchmark harness over the workloads of benchmark.py:
+
+  pip install pytest pytest-benchmark
+  pytest test_benchmark.py --benchmark-json=results/pytest_benchmark.json
+
+Save a run with --benchmark-autosave and fail later runs that regress with
+--benchmark-compare --benchmark-compare-fail=median:20%. Uses random
+weights when the LFS checkpoints are absent.
+"""
+import io
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+import benchmark as suite
+import models
+import torch
+
+RESOLUTIONS = ['640x480', '2048x1536', '4032x3024']
+BATCH_SIZES = [1, 4, 8]
+
+
+@pytest.fixture(scope='session')
+def checkpoints(tmp_path_factory):
+    return suite.prepare_checkpoints(models.SERVING_MODELS, str(tmp_path_factory.mktemp('checkpoints')))
+
+
+@pytest.fixture(scope='session')
+def images():
+    return {resolution: suite.synthetic_jpeg(*suite.parse_resolution(resolution)) for resolution in RESOLUTIONS}
+
+
+@pytest.fixture(scope='session')
+def client(checkpoints):
+    return suite.InProcessClient()
+
+
+@pytest.fixture(scope='session')
+def uploaded(client, images):
+    uploaded = suite.upload_images(client, images)
+    yield uploaded
+    for filename in uploaded.values():
+        client.remove(filename)
+
+
+@pytest.mark.parametrize('size', [224, 299])
+@pytest.mark.parametrize('resolution', RESOLUTIONS)
+def test_preprocess_image(benchmark, images, resolution, size):
+    data = images[resolution]
+    result = benchmark(lambda: models.preprocess_image(io.BytesIO(data), size))
+    assert tuple(result.shape) == (1, 3, size, size)
+
+
+@pytest.mark.parametrize('batch_size', BATCH_SIZES)
+@pytest.mark.parametrize('model_name', ['resnet50', 'inceptionv3'])
+def test_forward(benchmark, checkpoints, model_name, batch_size):
+    size = models.MODEL_INPUT_SIZES[model_name]
+    inputs = list(torch.randn(batch_size, 1, 3, size, size))
+    models.registry.warm_up(models.registry.get_entry(model_name), model_name)
+    benchmark.extra_info['images_per_call'] = batch_size
+    result = benchmark(models.run_model_batch, model_name, inputs)
+    assert len(result) == batch_size
+
+
+@pytest.mark.parametrize('model_name', models.SERVING_MODELS)
+@pytest.mark.parametrize('resolution', RESOLUTIONS)
+def test_analyze_round_trip(benchmark, client, uploaded, resolution, model_name):
+    response = benchmark(client.analyze, uploaded[resolution], model_name)
+    assert response['success']
@@ -0,0 +1,194 @@
+"""
+Tests for the per-model circuit breaker: its state transitions on a fake
+clock, and what predictions look like while a model's breaker is open
+"""
+import io
+import pickle
+import time
+import types
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, ModelUnavailable
+from jobs import JOB_FAILED, JOB_SUCCEEDED, JobManager
+from postprocessing import LESION_CODES
+from prediction_cache import PredictionCache
+
+
+class Clock:
+    """
+    Stands in for time.monotonic(); only moves when advanced
+    """
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def test_breaker_opens_half_opens_and_closes():
+    clock = Clock()
+    breaker = CircuitBreaker('resnet50', failure_threshold=2, backoff=10, clock=clock)
+    assert breaker.state == CLOSED
+
+    breaker.record_failure(RuntimeError('boom'))
+    assert breaker.state == CLOSED
+    breaker.check()
+
+    breaker.record_failure(RuntimeError('boom again'))
+    assert breaker.state == OPEN
+    assert breaker.retry_after() == 10
+    with pytest.raises(ModelUnavailable) as raised:
+        breaker.check()
+    assert raised.value.retry_after == 10
+    assert raised.value.reason == 'boom again'
+
+    clock.advance(9.5)
+    assert breaker.state == OPEN
+    clock.advance(0.5)
+    assert breaker.state == HALF_OPEN
+    breaker.check()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.status()['failures'] == 0
+    assert breaker.retry_after() == 0
+
+
+def test_failed_half_open_retry_doubles_the_backoff():
+    clock = Clock()
+    breaker = CircuitBreaker('resnet50', backoff=10, max_backoff=25, clock=clock)
+    breaker.record_failure(RuntimeError('load failed'))
+    assert breaker.retry_after() == 10
+
+    clock.advance(10)
+    assert breaker.state == HALF_OPEN
+    breaker.record_failure(RuntimeError('load failed'))
+    assert breaker.state == OPEN
+    assert breaker.retry_after() == 20
+
+    clock.advance(20)
+    breaker.record_failure(RuntimeError('load failed'))
+    # Capped at max_backoff
+    assert breaker.retry_after() == 25
+
+
+@pytest.fixture
+def served(monkeypatch):
+    """
+    resnet50 served by a fake forward pass that fails while state['fail']
+    is set, guarded by a breaker on a fake clock
+    """
+    models = pytest.importorskip('models')
+    clock = Clock()
+    state = {'fail': False, 'runs': 0}
+
+    def submit_inference(model_name, entry, input_tensor):
+        state['runs'] += 1
+        future = Future()
+        if state['fail']:
+            future.set_exception(RuntimeError('forward failed'))
+        else:
+            future.set_result((np.full(len(LESION_CODES), 100.0 / len(LESION_CODES)), None))
+        return future
+
+    entry = types.SimpleNamespace(version='v1', checkpoint_hash='checkpoint-v1', backend='eager')
+    breaker = CircuitBreaker('resnet50', backoff=30, clock=clock)
+    monkeypatch.setitem(models.registry._entries, 'resnet50', entry)
+    monkeypatch.setitem(models.registry.breakers, 'resnet50', breaker)
+    monkeypatch.setattr(models, 'submit_inference', submit_inference)
+    monkeypatch.setattr(models, 'prediction_cache', PredictionCache(max_entries=0))
+    monkeypatch.setattr(models, 'DEGRADED_MODE', 'simulate')
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 32), 'purple').save(buffer, format='PNG')
+    return types.SimpleNamespace(
+        models=models, clock=clock, state=state, breaker=breaker, image=buffer.getvalue()
+    )
+
+
+def test_open_breaker_serves_degraded_predictions(served):
+    models = served.models
+    served.state['fail'] = True
+    result = models.predict_with_model(served.image, 'resnet50')
+    assert result['degraded'] is True and result['simulated'] is True
+    assert result['model_version'] is None
+    assert served.breaker.state == OPEN
+
+    # Refused without running the model while open
+    result = models.predict_with_model(served.image, 'resnet50', top_k=3)
+    assert served.state['runs'] == 1
+    assert result['degraded'] is True
+    assert 'Model resnet50 is unavailable' in result['degraded_reason']
+    assert len(result['predictions']) == 3
+
+    # Half-open: the next request tries the model and closes the breaker
+    served.clock.advance(30)
+    served.state['fail'] = False
+    result = models.predict_with_model(served.image, 'resnet50')
+    assert served.state['runs'] == 2
+    assert 'degraded' not in result
+    assert result['model_version'] == 'v1'
+    assert served.breaker.state == CLOSED
+
+
+def test_open_breaker_fails_fast_in_unavailable_mode(served, monkeypatch):
+    monkeypatch.setattr(served.models, 'DEGRADED_MODE', 'unavailable')
+    served.breaker.record_failure(RuntimeError('load failed'))
+    served.clock.advance(12)
+    with pytest.raises(ModelUnavailable) as raised:
+        served.models.predict_with_model(served.image, 'resnet50')
+    assert raised.value.retry_after == 18
+    assert served.state['runs'] == 0
+
+
+def test_model_unavailable_survives_pickling():
+    error = pickle.loads(pickle.dumps(ModelUnavailable('resnet50', 3.0, 'boom')))
+    assert (error.model_name, error.retry_after, error.reason) == ('resnet50', 3.0, 'boom')
+    assert str(error) == 'Model resnet50 is unavailable: boom'
+    assert str(ModelUnavailable('resnet50', 0)) == 'Model resnet50 is unavailable'
+
+
+def job_with_open_breaker(payload):
+    # Runs in a job worker process: open the breaker there, then analyze
+    if payload['kind'] == 'echo':
+        return payload
+    import models
+
+    models.DEGRADED_MODE = 'unavailable'
+    models.registry.breakers['resnet50'].record_failure(RuntimeError('load failed'))
+    if payload['kind'] == 'raise':
+        models.registry.get_entry('resnet50')
+    return models.run_analysis_job(payload)
+
+
+def wait_for(manager, job_id, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job['status'] in (JOB_SUCCEEDED, JOB_FAILED):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_process_job_hitting_an_open_breaker_fails_alone(tmp_path):
+    image = tmp_path / 'lesion.png'
+    Image.new('RGB', (32, 32), 'purple').save(image)
+    manager = JobManager(job_with_open_breaker, workers=1, use_processes=True)
+    for kind in ('analyze', 'raise'):
+        job = wait_for(manager, manager.submit({'kind': kind, 'filepath': str(image), 'model': 'resnet50'})['id'])
+        assert job['status'] == JOB_FAILED
+        assert job['error'].startswith('Model resnet50 is unavailable: load failed')
+
+    # The pool survived: the next job runs in the same worker
+    job = wait_for(manager, manager.submit({'kind': 'echo'})['id'])
+    assert job['status'] == JOB_SUCCEEDED
+    assert job['result'] == {'kind': 'echo'}
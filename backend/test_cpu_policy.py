@@ -0,0 +1,126 @@
+"""
+Tests for the worker thread and core affinity policy
+"""
+import json
+import os
+
+import cpu_policy
+
+
+def test_worker_core_sets_split_cores_into_disjoint_blocks():
+    cores = list(range(10))
+    assert cpu_policy.worker_core_sets(4, cores) == [[0, 1, 2], [3, 4, 5], [6, 7], [8, 9]]
+    assert cpu_policy.worker_core_sets(1, cores) == [cores]
+    # Never more blocks than cores, never an empty block
+    assert cpu_policy.worker_core_sets(3, [4, 5]) == [[4], [5]]
+    assert cpu_policy.worker_core_sets(0, [4, 5]) == [[4, 5]]
+
+
+def test_parse_core_sets():
+    assert cpu_policy.parse_core_sets('0-3;4-7') == [[0, 1, 2, 3], [4, 5, 6, 7]]
+    assert cpu_policy.parse_core_sets('0,1; 2 ,3;') == [[0, 1], [2, 3]]
+
+
+def test_core_set_for_follows_affinity_setting(monkeypatch):
+    monkeypatch.setattr(cpu_policy, 'available_cores', lambda: [0, 1, 2, 3])
+    monkeypatch.setenv('SKINVISION_CPU_AFFINITY', 'off')
+    assert cpu_policy.core_set_for(1, 2) is None
+    monkeypatch.setenv('SKINVISION_CPU_AFFINITY', 'auto')
+    assert cpu_policy.core_set_for(1, 2) == [2, 3]
+    monkeypatch.setenv('SKINVISION_CPU_AFFINITY', '0;1-3')
+    assert cpu_policy.core_set_for(1, 4) == [1, 2, 3]
+    assert cpu_policy.core_set_for(2, 4) == [0]
+
+
+def test_configure_worker_pins_and_sizes_threads(monkeypatch):
+    pinned, threads = [], []
+    monkeypatch.setattr(cpu_policy, '_policy', {})
+    monkeypatch.setattr(cpu_policy, 'available_cores', lambda: [0, 1, 2, 3])
+    monkeypatch.setattr(cpu_policy, 'pin_to_cores', pinned.append)
+    monkeypatch.setattr(cpu_policy, 'apply_thread_settings', threads.append)
+    monkeypatch.setenv('SKINVISION_CPU_AFFINITY', 'auto')
+    monkeypatch.delenv('SKINVISION_INTRA_OP_THREADS', raising=False)
+
+    policy = cpu_policy.configure_worker(1, 2)
+    assert pinned == [[2, 3]]
+    assert threads == [2]
+    assert policy['worker_slot'] == 1 and policy['workers'] == 2
+
+    # An explicit thread count wins over one thread per pinned core
+    monkeypatch.setenv('SKINVISION_INTRA_OP_THREADS', '1')
+    cpu_policy.configure_worker(0, 2)
+    assert pinned[-1] == [0, 1]
+    assert threads[-1] == 1
+
+    # Without pinning the thread count is left to the environment
+    monkeypatch.setenv('SKINVISION_CPU_AFFINITY', 'off')
+    monkeypatch.delenv('SKINVISION_INTRA_OP_THREADS')
+    cpu_policy.configure_worker(0, 2)
+    assert len(pinned) == 2
+    assert threads[-1] == 0
+
+
+def test_apply_plan_exports_thread_settings(monkeypatch):
+    monkeypatch.delenv('SKINVISION_INTRA_OP_THREADS', raising=False)
+    monkeypatch.setenv('SKINVISION_CPU_AFFINITY', 'off')
+    assert cpu_policy.apply_plan({'workers': 3, 'threads': 2}) == 3
+    assert os.environ['SKINVISION_INTRA_OP_THREADS'] == '2'
+    assert os.environ['SKINVISION_CPU_AFFINITY'] == 'auto'
+
+    # Explicit core sets are kept
+    monkeypatch.setenv('SKINVISION_CPU_AFFINITY', '0-1;2-3')
+    cpu_policy.apply_plan({'workers': 2, 'threads': 2})
+    assert os.environ['SKINVISION_CPU_AFFINITY'] == '0-1;2-3'
+
+
+def _plan_with(monkeypatch, tmp_path, saved, calibrated=True):
+    path = tmp_path / 'thread_policy.json'
+    if saved is not None:
+        path.write_text(json.dumps(saved))
+    calls = []
+
+    def calibrate(model_name, cores):
+        calls.append((model_name, cores))
+        return {'workers': 2, 'threads': 1, 'model': model_name, 'cores': cores, 'candidates': [],
+                'calibrated': calibrated}
+
+    monkeypatch.setattr(cpu_policy, 'CALIBRATION_FILE', str(path))
+    monkeypatch.setattr(cpu_policy, 'available_cores', lambda: [0, 1])
+    monkeypatch.setattr(cpu_policy, 'calibrate', calibrate)
+    monkeypatch.delenv('SKINVISION_CALIBRATION_MODEL', raising=False)
+    return path, calls
+
+
+def test_plan_reuses_matching_calibration(monkeypatch, tmp_path):
+    saved = {'workers': 1, 'threads': 2, 'model': 'resnet50', 'cores': [0, 1], 'candidates': []}
+    _, calls = _plan_with(monkeypatch, tmp_path, saved)
+    assert cpu_policy.plan() == saved
+    assert calls == []
+
+
+def test_plan_recalibrates_when_cores_or_model_change(monkeypatch, tmp_path):
+    saved = {'workers': 1, 'threads': 4, 'model': 'resnet50', 'cores': [0, 1, 2, 3], 'candidates': []}
+    path, calls = _plan_with(monkeypatch, tmp_path, saved)
+    assert cpu_policy.plan()['workers'] == 2
+    assert calls == [('resnet50', [0, 1])]
+    assert json.loads(path.read_text())['cores'] == [0, 1]
+
+    monkeypatch.setenv('SKINVISION_CALIBRATION_MODEL', 'efficientnet_b0')
+    cpu_policy.plan()
+    assert calls[-1] == ('efficientnet_b0', [0, 1])
+
+
+def test_plan_does_not_save_failed_calibration(monkeypatch, tmp_path):
+    path, calls = _plan_with(monkeypatch, tmp_path, None, calibrated=False)
+    assert cpu_policy.plan()['calibrated'] is False
+    assert not path.exists()
+    cpu_policy.plan()
+    assert len(calls) == 2
+
+
+def test_calibrate_falls_back_when_workers_fail():
+    # The worker dies on the unknown model before reaching the barrier;
+    # calibrate must notice instead of waiting for its result forever
+    result = cpu_policy.calibrate('no-such-model', cores=[0], timeout=60)
+    assert result == cpu_policy.default_plan([0], 'no-such-model')
+    assert result['workers'] == 1 and result['threads'] == 1
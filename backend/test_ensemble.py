@@ -0,0 +1,168 @@
+"""
+Tests for ensemble analysis: weight normalization, model list
+validation, averaging and a member whose circuit breaker is open. The
+forward pass is replaced, so no checkpoints are needed.
+"""
+import io
+import os
+import types
+from concurrent.futures import Future
+
+os.environ.setdefault('SKINVISION_EAGER_LOAD', 'off')
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import app as backend
+from circuit_breaker import CircuitBreaker, ModelUnavailable
+from postprocessing import LESION_CODES
+from prediction_cache import PredictionCache
+
+
+def test_weights_default_to_equal():
+    assert backend.models.load().ensemble_weights(['resnet50', 'inceptionv3']) == {
+        'resnet50': 0.5, 'inceptionv3': 0.5
+    }
+
+
+def test_weights_are_normalized():
+    ensemble_weights = backend.models.load().ensemble_weights
+    assert ensemble_weights(['resnet50', 'inceptionv3'], [1, 3]) == {'resnet50': 0.25, 'inceptionv3': 0.75}
+    # Models missing from a dict keep weight 1
+    assert ensemble_weights(['resnet50', 'inceptionv3', 'skinnet'], {'inceptionv3': 2}) == {
+        'resnet50': 0.25, 'inceptionv3': 0.5, 'skinnet': 0.25
+    }
+    assert ensemble_weights(['resnet50', 'inceptionv3'], {'resnet50': 0}) == {'resnet50': 0.0, 'inceptionv3': 1.0}
+
+
+@pytest.mark.parametrize('weights', [
+    {'vgg16': 1},
+    [1, 2, 3],
+    [1, -1],
+    [0, 0],
+    ['heavy', 1],
+])
+def test_bad_weights_are_rejected(weights):
+    with pytest.raises(ValueError):
+        backend.models.load().ensemble_weights(['resnet50', 'inceptionv3'], weights)
+
+
+@pytest.fixture
+def ensemble(monkeypatch):
+    """
+    resnet50 and skinnet share one fake loaded checkpoint, inceptionv3 has
+    its own; each predicts a different class
+    """
+    models = backend.models.load()
+    shared = types.SimpleNamespace(version='res-v1', checkpoint_hash='res', backend='eager')
+    inception = types.SimpleNamespace(version='inc-v1', checkpoint_hash='inc', backend='eager')
+    outputs = {'res': 0, 'inc': 1}
+    runs = []
+
+    def submit_inference(model_name, entry, input_tensor):
+        runs.append(model_name)
+        probabilities = np.zeros(len(LESION_CODES))
+        probabilities[outputs[entry.checkpoint_hash]] = 100.0
+        future = Future()
+        future.set_result((probabilities, None))
+        return future
+
+    for model_name, entry in (('resnet50', shared), ('skinnet', shared), ('inceptionv3', inception)):
+        monkeypatch.setitem(models.registry._entries, model_name, entry)
+        monkeypatch.setitem(models.registry.breakers, model_name, CircuitBreaker(model_name, backoff=30))
+    monkeypatch.setattr(models, 'submit_inference', submit_inference)
+    monkeypatch.setattr(models, 'prediction_cache', PredictionCache(max_entries=0))
+    monkeypatch.setattr(models, 'DEGRADED_MODE', 'simulate')
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 32), 'teal').save(buffer, format='PNG')
+    return types.SimpleNamespace(models=models, runs=runs, image=buffer.getvalue())
+
+
+def test_ensemble_averages_with_weights(ensemble):
+    result = ensemble.models.predict_ensemble(ensemble.image, ['resnet50', 'inceptionv3'], {'inceptionv3': 3})
+    assert len(result['predictions']) == len(LESION_CODES)
+    assert result['predictions'][LESION_CODES[0]]['probability'] == 25.0
+    assert result['predictions'][LESION_CODES[1]]['probability'] == 75.0
+    assert result['top_prediction']['code'] == LESION_CODES[1]
+    assert list(result['models']) == ['resnet50', 'inceptionv3']
+    assert result['models']['resnet50']['weight'] == 0.25
+    assert result['models']['resnet50']['top_prediction']['code'] == LESION_CODES[0]
+    assert result['models']['inceptionv3']['model_version'] == 'inc-v1'
+    assert 'degraded' not in result
+
+
+def test_ensemble_top_k_and_shared_checkpoint(ensemble):
+    result = ensemble.models.predict_ensemble(ensemble.image, ['resnet50', 'skinnet', 'inceptionv3'], top_k=2)
+    assert len(result['predictions']) == 2
+    assert all(len(member['predictions']) == 2 for member in result['models'].values())
+    # skinnet reuses the resnet50 weights, so they run once
+    assert sorted(ensemble.runs) == ['inceptionv3', 'resnet50']
+    assert result['models']['skinnet']['model_version'] == 'res-v1'
+    assert result['predictions'][LESION_CODES[0]]['probability'] == pytest.approx(66.67)
+
+
+@pytest.mark.parametrize('model_names', [
+    [],
+    ['resnet50', 'vgg16'],
+    ['resnet50', 'resnet50'],
+    ['resnet50', 'inceptionv3', 'resnet50'],
+])
+def test_bad_model_lists_are_rejected(ensemble, model_names):
+    with pytest.raises(ValueError):
+        ensemble.models.predict_ensemble(ensemble.image, model_names)
+    assert ensemble.runs == []
+
+
+def test_member_with_open_breaker_is_degraded(ensemble):
+    breaker = ensemble.models.registry.breakers['inceptionv3']
+    breaker.record_failure(RuntimeError('load failed'))
+    result = ensemble.models.predict_ensemble(ensemble.image, ['resnet50', 'inceptionv3'])
+    assert result['degraded'] is True
+    assert ensemble.runs == ['resnet50']
+    assert result['models']['inceptionv3']['simulated'] is True
+    assert result['models']['inceptionv3']['model_version'] is None
+    assert result['models']['resnet50']['simulated'] is False
+    assert result['models']['resnet50']['model_version'] == 'res-v1'
+    assert len(result['predictions']) == len(LESION_CODES)
+    assert sum(p['probability'] for p in result['predictions'].values()) == pytest.approx(100, abs=0.5)
+
+
+def test_member_with_open_breaker_fails_in_unavailable_mode(ensemble, monkeypatch):
+    monkeypatch.setattr(ensemble.models, 'DEGRADED_MODE', 'unavailable')
+    ensemble.models.registry.breakers['inceptionv3'].record_failure(RuntimeError('load failed'))
+    with pytest.raises(ModelUnavailable) as raised:
+        ensemble.models.predict_ensemble(ensemble.image, ['resnet50', 'inceptionv3'])
+    assert raised.value.model_name == 'inceptionv3'
+
+
+@pytest.fixture
+def client():
+    return backend.app.test_client()
+
+
+def test_api_ensemble_from_image_body(ensemble, client):
+    response = client.post(
+        '/api/analyze?models=resnet50,inceptionv3&weights={"resnet50":3}&top_k=3',
+        data=ensemble.image, content_type='image/png'
+    )
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert len(results['predictions']) == 3
+    assert results['top_prediction']['code'] == LESION_CODES[0]
+    assert results['models']['resnet50']['weight'] == 0.75
+
+
+@pytest.mark.parametrize('query', [
+    'models=resnet50,resnet50',
+    'models=resnet50,vgg16',
+    'models=resnet50,inceptionv3&weights={"vgg16":1}',
+    'models=resnet50,inceptionv3&weights=[1]',
+    'models=resnet50,inceptionv3&weights=heavy',
+    'models=resnet50,inceptionv3&tta=1',
+])
+def test_api_rejects_bad_ensembles(ensemble, client, query):
+    response = client.post(f"/api/analyze?{query}", data=ensemble.image, content_type='image/png')
+    assert response.status_code == 400
+    assert ensemble.runs == []
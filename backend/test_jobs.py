@@ -0,0 +1,172 @@
+"""
+Tests for async jobs: which callback URLs are accepted, and recovery of
+the worker pool after a worker process dies
+"""
+import http.server
+import json
+import os
+import socket
+import threading
+import time
+import types
+
+import pytest
+
+import jobs
+from jobs import JOB_FAILED, JOB_SUCCEEDED, JobManager
+
+
+def echo_or_crash(payload):
+    # Runs in a worker process; 'crash' kills it like a segfault would
+    if payload == 'crash':
+        os._exit(1)
+    return payload
+
+
+def wait_for(manager, job_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job['status'] in (JOB_SUCCEEDED, JOB_FAILED):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+@pytest.fixture
+def resolve(monkeypatch):
+    """
+    Fake DNS: maps host names to the addresses getaddrinfo returns
+    """
+    addresses = {}
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        if host not in addresses:
+            raise socket.gaierror(f"unknown host {host}")
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (address, port)) for address in addresses[host]]
+
+    monkeypatch.setattr(jobs.socket, 'getaddrinfo', getaddrinfo)
+    return addresses
+
+
+@pytest.mark.parametrize('url', [
+    'http://127.0.0.1:5000/hook',
+    'http://169.254.169.254/latest/meta-data/',
+    'http://10.0.0.5/hook',
+    'http://192.168.1.10/hook',
+    'http://[::1]/hook',
+    'http://[::ffff:127.0.0.1]/hook',
+    'http://0.0.0.0/hook',
+    'http://internal.example/hook',
+    'http://unknown.example/hook',
+    'ftp://hooks.example/hook',
+])
+def test_callbacks_to_non_public_hosts_are_rejected_without_allowlist(resolve, url):
+    resolve['internal.example'] = ['10.1.2.3']
+    manager = JobManager(echo_or_crash, use_processes=False)
+    with pytest.raises(ValueError):
+        manager.validate_callback_url(url)
+
+
+def test_callbacks_to_public_hosts_are_accepted_without_allowlist(resolve):
+    resolve['hooks.example'] = ['93.184.216.34']
+    resolve['mixed.example'] = ['93.184.216.34', '127.0.0.1']
+    manager = JobManager(echo_or_crash, use_processes=False)
+    assert manager.validate_callback_url('https://hooks.example/done')
+    with pytest.raises(ValueError, match='not a public address'):
+        manager.validate_callback_url('https://mixed.example/done')
+
+
+def test_allowlist_restricts_callback_hosts(resolve):
+    manager = JobManager(echo_or_crash, use_processes=False, allowed_callback_hosts=['hooks.internal'])
+    assert manager.validate_callback_url('http://hooks.internal/done')
+    with pytest.raises(ValueError, match='not allowed'):
+        manager.validate_callback_url('http://93.184.216.34/done')
+
+
+@pytest.fixture
+def callback_server(monkeypatch):
+    """
+    Local HTTP server standing in for every callback address: records the
+    address each callback connects to and the requests it receives
+    """
+    received, connected = [], []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            received.append({'path': self.path, 'host': self.headers['Host'], 'body': json.loads(body)})
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def connect(address, timeout=None, *args, **kwargs):
+        # Not socket.create_connection: getaddrinfo is faked in these tests
+        connected.append(address)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(server.server_address)
+        return sock
+
+    monkeypatch.setattr(jobs.socket, 'create_connection', connect)
+    yield types.SimpleNamespace(received=received, connected=connected)
+    server.shutdown()
+    server.server_close()
+
+
+def test_callback_host_is_checked_again_before_sending(resolve, callback_server):
+    resolve['hooks.example'] = ['93.184.216.34']
+    manager = JobManager(echo_or_crash, use_processes=False)
+    job = wait_for(manager, manager.submit('hello', callback_url='http://hooks.example/done?token=1')['id'])
+    manager._callbacks.shutdown(wait=True)
+    assert callback_server.connected == [('93.184.216.34', 80)]
+    assert callback_server.received[0]['path'] == '/done?token=1'
+    assert callback_server.received[0]['host'] == 'hooks.example'
+    assert callback_server.received[0]['body']['results'] == 'hello'
+
+    # The name points inside the network by the time the job finishes
+    resolve['hooks.example'] = ['127.0.0.1']
+    manager._send_callback(job)
+    assert len(callback_server.connected) == 1
+    assert manager.stats()['callbacks_failed'] == 1
+
+
+def test_callback_connects_to_the_checked_address(monkeypatch, callback_server):
+    # DNS rebinding: the name resolves to a public address for the check
+    # and to an internal one for any later lookup
+    answers = {'hooks.example': ['93.184.216.34', '93.184.216.34', '10.0.0.5']}
+    lookups = []
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        lookups.append(host)
+        address = answers[host].pop(0)
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (address, port))]
+
+    monkeypatch.setattr(jobs.socket, 'getaddrinfo', getaddrinfo)
+    manager = JobManager(echo_or_crash, use_processes=False)
+    wait_for(manager, manager.submit('hello', callback_url='http://hooks.example:8080/done')['id'])
+    manager._callbacks.shutdown(wait=True)
+    # One lookup when the job is submitted, one right before sending
+    assert lookups == ['hooks.example', 'hooks.example']
+    assert callback_server.connected == [('93.184.216.34', 8080)]
+    assert callback_server.received[0]['host'] == 'hooks.example:8080'
+    assert manager.stats()['callbacks_failed'] == 0
+
+
+def test_dead_worker_fails_its_job_and_the_pool_is_replaced():
+    manager = JobManager(echo_or_crash, workers=1, use_processes=True)
+    job = wait_for(manager, manager.submit('crash')['id'])
+    assert job['status'] == JOB_FAILED
+    assert 'worker process died' in job['error']
+
+    # Later jobs run on a new pool
+    for payload in ('first', 'second'):
+        job = wait_for(manager, manager.submit(payload)['id'])
+        assert job['status'] == JOB_SUCCEEDED
+        assert job['result'] == payload
+    assert manager.stats()[JOB_FAILED] == 1
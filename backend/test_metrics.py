@@ -0,0 +1,147 @@
+"""
+Tests for the metrics: histogram and counter rendering, stage spans and
+the per-request stage trace, and /metrics after an analysis. The forward
+pass is replaced, so no checkpoints are needed.
+"""
+import io
+import os
+import re
+import threading
+import types
+from concurrent.futures import Future
+
+os.environ.setdefault('SKINVISION_EAGER_LOAD', 'off')
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import app as backend
+import metrics
+from postprocessing import LESION_CODES
+from prediction_cache import PredictionCache
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram('test_latency_seconds', 'Test latency', ['route'], buckets=(0.1, 1.0))
+    metrics._metrics.remove(histogram)
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, route='/a')
+    lines = histogram.render()
+    assert lines[:2] == ['# HELP test_latency_seconds Test latency', '# TYPE test_latency_seconds histogram']
+    assert 'test_latency_seconds_bucket{route="/a",le="0.1"} 2' in lines
+    assert 'test_latency_seconds_bucket{route="/a",le="1.0"} 3' in lines
+    assert 'test_latency_seconds_bucket{route="/a",le="+Inf"} 4' in lines
+    assert 'test_latency_seconds_sum{route="/a"} 3.65' in lines
+    assert 'test_latency_seconds_count{route="/a"} 4' in lines
+
+
+def test_counter_escapes_label_values():
+    counter = metrics.Counter('test_total', 'Test counter', ['path'])
+    metrics._metrics.remove(counter)
+    counter.inc(path='a"b\\c')
+    counter.inc(2, path='a"b\\c')
+    assert counter.value(path='a"b\\c') == 3
+    assert counter.render()[-1] == 'test_total{path="a\\"b\\\\c"} 3'
+
+
+def stage_count(text, stage):
+    match = re.search(rf'^skinvision_stage_seconds_count\{{stage="{stage}"\}} (\d+)$', text, re.M)
+    return int(match.group(1)) if match else 0
+
+
+def test_stage_spans_feed_histogram_and_current_trace():
+    before = stage_count(metrics.render(), 'test_stage')
+    stages, token = metrics.start_request_trace()
+    try:
+        with metrics.timed('test_stage'):
+            pass
+        with metrics.timed('test_stage'):
+            pass
+        with pytest.raises(RuntimeError):
+            with metrics.timed('test_failing_stage'):
+                raise RuntimeError('boom')
+    finally:
+        metrics.end_request_trace(token)
+    # Repeated stages add up; a failing stage is still timed
+    assert set(stages) == {'test_stage', 'test_failing_stage'}
+    assert stages['test_stage'] >= 0
+    assert stage_count(metrics.render(), 'test_stage') == before + 2
+
+    # After the request, spans only reach the histogram
+    with metrics.timed('test_stage'):
+        pass
+    assert set(stages) == {'test_stage', 'test_failing_stage'}
+    assert metrics._request_stages.get() is None
+    assert stage_count(metrics.render(), 'test_stage') == before + 3
+
+
+def test_traces_are_per_thread():
+    stages, token = metrics.start_request_trace()
+    other = {}
+
+    def work():
+        other['stages'], other_token = metrics.start_request_trace()
+        with metrics.timed('test_thread_stage'):
+            pass
+        metrics.end_request_trace(other_token)
+
+    thread = threading.Thread(target=work)
+    thread.start()
+    thread.join()
+    metrics.end_request_trace(token)
+    assert 'test_thread_stage' in other['stages']
+    assert stages == {}
+
+
+@pytest.fixture
+def analyzed(monkeypatch):
+    """
+    resnet50 served by a fake forward pass; request summaries captured
+    """
+    models = backend.models.load()
+
+    def submit_inference(model_name, entry, input_tensor):
+        future = Future()
+        future.set_result((np.full(len(LESION_CODES), 100.0 / len(LESION_CODES)), None))
+        return future
+
+    entry = types.SimpleNamespace(version='v1', checkpoint_hash='checkpoint-v1', backend='eager')
+    monkeypatch.setitem(models.registry._entries, 'resnet50', entry)
+    monkeypatch.setattr(models, 'submit_inference', submit_inference)
+    monkeypatch.setattr(models, 'prediction_cache', PredictionCache(max_entries=16))
+    summaries = []
+    monkeypatch.setattr(backend, 'log_request', lambda logger, *args, **fields: summaries.append((args, fields)))
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 30), 'olive').save(buffer, format='JPEG')
+    return types.SimpleNamespace(client=backend.app.test_client(), image=buffer.getvalue(), summaries=summaries)
+
+
+def test_metrics_endpoint_reports_analysis_stages(analyzed):
+    before = metrics.render()
+    response = analyzed.client.post('/api/analyze?model=resnet50', data=analyzed.image, content_type='image/jpeg')
+    assert response.status_code == 200
+
+    text = analyzed.client.get('/metrics').get_data(as_text=True)
+    for stage in ('predict', 'decode', 'inference', 'cache_lookup', 'postprocess', 'serialize'):
+        assert stage_count(text, stage) == stage_count(before, stage) + 1, stage
+        assert f'skinvision_stage_seconds_bucket{{stage="{stage}",le="+Inf"}}' in text
+    assert re.search(r'^skinvision_request_seconds_count\{endpoint="/api/analyze",method="POST"\} \d+$', text, re.M)
+    assert re.search(r'^skinvision_requests_total\{endpoint="/api/analyze",method="POST",status="200"\} \d+$', text, re.M)
+    assert re.search(r'^skinvision_cache_lookups_total\{result="miss"\} \d+$', text, re.M)
+
+
+def test_request_summary_carries_stage_trace(analyzed):
+    response = analyzed.client.post(
+        '/api/analyze?model=resnet50', data=analyzed.image, content_type='image/jpeg',
+        headers={'X-Request-ID': 'trace-me'}
+    )
+    assert response.headers['X-Request-ID'] == 'trace-me'
+    (request_id, route, method, status, duration, stages), fields = analyzed.summaries[0]
+    assert (request_id, route, method, status) == ('trace-me', '/api/analyze', 'POST', 200)
+    assert {'predict', 'decode', 'inference', 'serialize'} <= set(stages)
+    assert sum(stages.values()) > 0
+    assert fields['model'] == 'resnet50'
+    # The trace ends with the request
+    assert metrics._request_stages.get() is None
@@ -0,0 +1,60 @@
+"""
+Tests for the /api/models list, with and without training configs in
+results/ (which is not checked in)
+"""
+import json
+import os
+
+os.environ.setdefault('SKINVISION_EAGER_LOAD', 'off')
+
+import pytest
+
+import app as backend
+import model_config
+
+
+@pytest.fixture
+def results_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_config, 'RESULTS_DIR', str(tmp_path))
+    return tmp_path
+
+
+def test_described_models_are_listed_without_configs(results_dir):
+    listed = model_config.available_models()
+    assert listed == [
+        {
+            'id': 'inceptionv3',
+            'name': 'InceptionV3',
+            'description': 'Google InceptionV3 model trained for skin lesion classification',
+            'input_size': 299,
+        },
+        {
+            'id': 'resnet50',
+            'name': 'ResNet50',
+            'description': 'ResNet50 model trained for skin lesion classification',
+            'input_size': 224,
+        },
+    ]
+    response = backend.app.test_client().get('/api/models')
+    assert response.status_code == 200
+    assert response.get_json() == listed
+
+
+def test_training_configs_add_details_and_models(results_dir):
+    (results_dir / 'resnet50_config.json').write_text(json.dumps(
+        {'image_size': 256, 'num_classes': 40, 'pretrained': True, 'start_epoch': 12}
+    ))
+    (results_dir / 'skinnet_config.json').write_text('{}')
+    (results_dir / 'inceptionv3_config.json').write_text('not json')
+    # Not a served model
+    (results_dir / 'vgg16_config.json').write_text('{}')
+
+    listed = {entry['id']: entry for entry in model_config.available_models()}
+    assert sorted(listed) == ['inceptionv3', 'resnet50', 'skinnet']
+    assert listed['resnet50']['input_size'] == 256
+    assert listed['resnet50']['num_classes'] == 40
+    assert listed['resnet50']['pretrained'] is True
+    assert listed['resnet50']['epochs_trained'] == 12
+    assert listed['inceptionv3']['input_size'] == 299
+    assert 'num_classes' not in listed['inceptionv3']
+    assert listed['skinnet']['name'] == 'skinnet'
@@ -115,6 +115,56 @@ def test_models_py():
         import traceback
         traceback.print_exc()
 
+def test_onnx_parity():
+    """Test that ONNX Runtime and torch give the same logits"""
+    print("\n=== Testing ONNX Parity ===")
+
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        print("onnxruntime not installed, skipping ONNX parity test")
+        return
+
+    import tempfile
+    import numpy as np
+    from models import MODEL_INPUT_SIZES, build_model, export_onnx
+    from onnx_runtime import OnnxModel
+    from registry import load_checkpoint
+
+    for model_name in ['resnet50', 'inceptionv3']:
+        print(f"\nTesting {model_name}...")
+
+        # Use the real checkpoint when it has been pulled, random weights otherwise
+        checkpoint_path = os.path.join('models', f'{model_name}_model.pth')
+        if not os.path.exists(checkpoint_path) or os.path.getsize(checkpoint_path) < 1000000:
+            checkpoint_path = False
+
+        model = build_model(model_name)
+        if checkpoint_path:
+            load_checkpoint(model, checkpoint_path, use_mmap=False)
+        model.eval()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            onnx_path = os.path.join(tmp, f'{model_name}.onnx')
+            export_onnx(model_name, onnx_path, model=model)
+            onnx_model = OnnxModel(onnx_path)
+
+            size = MODEL_INPUT_SIZES[model_name]
+            # Different batch sizes exercise the dynamic batch dimension
+            for batch_size in (1, 3):
+                inputs = torch.randn(batch_size, 3, size, size, generator=torch.Generator().manual_seed(batch_size))
+                with torch.no_grad():
+                    expected = model(inputs).numpy()
+                actual = onnx_model(inputs.numpy())
+                # Relative to the logit scale: randomly initialized weights
+                # can produce very large logits
+                scale = max(1.0, float(np.abs(expected).max()))
+                max_diff = float(np.abs(expected - actual).max()) / scale
+                print(f"Batch {batch_size}: max relative logit difference {max_diff:.2e}")
+                assert actual.shape == expected.shape
+                assert max_diff < 1e-4, f"{model_name} ONNX logits differ by {max_diff}"
+        print(f"✅ {model_name} ONNX output matches torch")
+
 if __name__ == "__main__":
     print("🔍 SkinVision AI Model Testing")
     print("=" * 50)
@@ -122,6 +172,7 @@ if __name__ == "__main__":
     test_model_loading()
     test_image_processing()
     test_models_py()
+    test_onnx_parity()
     
     print("\n" + "=" * 50)
     print("Testing complete!")
@@ -0,0 +1,47 @@
+"""
+The ONNX Runtime serving path must not import torch: that is what keeps
+ONNX workers small and quick to start
+"""
+import os
+import subprocess
+import sys
+import types
+
+import numpy as np
+
+import models
+
+
+def test_onnx_serving_path_does_not_import_torch():
+    script = """
+import io, sys
+import numpy as np
+from PIL import Image
+import models, tta
+
+buffer = io.BytesIO()
+Image.new('RGB', (64, 48), 'red').save(buffer, format='PNG')
+tensor, image_hash = models.load_input(io.BytesIO(buffer.getvalue()), 'resnet50')
+views = tta.build_views({224: tensor}, tta.PRESETS['rotations'], 224)
+assert isinstance(tensor, np.ndarray) and views.shape == (6, 3, 224, 224)
+print(sorted(name for name in ('torch', 'torchvision') if name in sys.modules))
+"""
+    env = dict(os.environ, SKINVISION_BACKEND='onnx', SKINVISION_EAGER_LOAD='off', SKINVISION_LOG_LEVEL='ERROR')
+    result = subprocess.run(
+        [sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env, capture_output=True, text=True, timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == '[]'
+
+
+def test_forward_batch_accepts_arrays_and_tensors(monkeypatch):
+    # Torch backends still take the tensors passed by benchmark.py and others
+    torch = models.cpu_policy.import_torch()
+
+    entry = types.SimpleNamespace(backend='eager', model=torch.nn.Flatten())
+    array = np.zeros((1, 3, 2, 2), dtype=np.float32)
+    monkeypatch.setattr(models, 'SIMILAR_DIR', None)
+    probabilities, embeddings = models.forward_batch('resnet50', [array, torch.ones(1, 3, 2, 2)], entry)
+    assert len(probabilities) == 2 and embeddings is None
+    assert np.allclose(probabilities[0], 100.0 / 12)
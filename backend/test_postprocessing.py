@@ -0,0 +1,107 @@
+"""
+Tests for top_k validation and the vectorized ranking of predictions
+"""
+import os
+
+os.environ.setdefault('SKINVISION_EAGER_LOAD', 'off')
+
+import numpy as np
+import pytest
+
+import app as backend
+from postprocessing import LESION_CODES, LESION_NAMES, NUM_CLASSES, format_batch, format_predictions, parse_top_k
+
+
+@pytest.mark.parametrize('value, expected', [
+    (None, None),
+    (1, 1),
+    ('5', 5),
+    (3.0, 3),
+    (NUM_CLASSES, NUM_CLASSES),
+    # More than there are classes returns them all
+    (NUM_CLASSES + 1, NUM_CLASSES),
+    ('1000', NUM_CLASSES),
+])
+def test_parse_top_k(value, expected):
+    assert parse_top_k(value) == expected
+
+
+@pytest.mark.parametrize('value', [0, -1, '0', '-3', 2.5, '2.5', 'five', '', True, [3], {'k': 3}])
+def test_parse_top_k_rejects(value):
+    with pytest.raises((TypeError, ValueError)):
+        parse_top_k(value)
+
+
+def reference(probabilities, top_k=None):
+    # One row at a time with Python sorting, as the API did before vectorizing
+    rounded = [round(float(p), 2) for p in probabilities]
+    order = sorted(range(NUM_CLASSES), key=lambda i: -rounded[i])[:top_k or NUM_CLASSES]
+    return [(LESION_CODES[i], rounded[i]) for i in order]
+
+
+def ranked(result):
+    return [(code, entry['probability']) for code, entry in result['predictions'].items()]
+
+
+def test_matches_reference_ranking():
+    rng = np.random.default_rng(3)
+    batch = rng.dirichlet(np.ones(NUM_CLASSES), size=8) * 100
+    for top_k in (None, 1, 5, NUM_CLASSES):
+        for row, result in zip(batch, format_batch(batch, top_k)):
+            assert ranked(result) == reference(row, top_k)
+            assert result['top_prediction']['code'] == reference(row, 1)[0][0]
+
+
+def test_ties_keep_class_order():
+    probabilities = np.zeros(NUM_CLASSES)
+    probabilities[[7, 2, 11]] = 30.0
+    # Equal once rounded to two decimals
+    probabilities[5] = 29.996
+    result = format_predictions(probabilities, top_k=5)
+    assert [code for code, _ in ranked(result)] == [LESION_CODES[i] for i in (2, 5, 7, 11, 0)]
+    assert result['top_prediction'] == {'code': LESION_CODES[2], 'name': LESION_NAMES[2], 'probability': 30.0}
+
+
+def test_uniform_row_keeps_class_order():
+    result = format_predictions(np.full(NUM_CLASSES, 100.0 / NUM_CLASSES))
+    assert list(result['predictions']) == LESION_CODES
+    assert result['top_prediction']['code'] == LESION_CODES[0]
+
+
+def test_rows_are_ranked_independently():
+    batch = np.zeros((3, NUM_CLASSES))
+    batch[0, 4] = batch[1, 9] = batch[2, NUM_CLASSES - 1] = 100.0
+    results = format_batch(batch, top_k=2)
+    assert [result['top_prediction']['code'] for result in results] == [
+        LESION_CODES[4], LESION_CODES[9], LESION_CODES[NUM_CLASSES - 1]
+    ]
+    assert all(len(result['predictions']) == 2 for result in results)
+    # One row on its own is a batch of one
+    assert format_batch(batch[1], top_k=2) == [results[1]]
+
+
+def test_probabilities_are_rounded_plain_floats():
+    probabilities = np.linspace(1, 2, NUM_CLASSES, dtype=np.float32)
+    result = format_predictions(probabilities, top_k=3)
+    values = [entry['probability'] for entry in result['predictions'].values()]
+    assert values == sorted(values, reverse=True)
+    assert all(type(value) is float and value == round(value, 2) for value in values)
+
+
+@pytest.fixture
+def client():
+    return backend.app.test_client()
+
+
+@pytest.mark.parametrize('top_k', [0, -2, 2.5, 'three', True])
+def test_api_rejects_bad_top_k(client, top_k):
+    response = client.post('/api/analyze', json={'filename': 'missing.jpg', 'model': 'resnet50', 'top_k': top_k})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'top_k must be a positive integer'}
+
+
+@pytest.mark.parametrize('top_k', ['0', '-1', '1.5', 'x'])
+def test_api_rejects_bad_top_k_in_query(client, top_k):
+    response = client.post(f"/api/analyze?model=resnet50&top_k={top_k}", data=b'\xff\xd8', content_type='image/jpeg')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'top_k must be a positive integer'}
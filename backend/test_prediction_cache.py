@@ -0,0 +1,131 @@
+"""
+Tests for the prediction cache: memory LRU order, the SQLite tier shared
+across instances, and invalidation when a model is hot-swapped
+"""
+import io
+import types
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import prediction_cache
+from postprocessing import LESION_CODES
+from prediction_cache import PredictionCache, make_cache_key
+
+
+class Clock:
+    """
+    Stands in for time.time() so disk access times are distinct
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        self.now += 1.0
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(prediction_cache.time, 'time', clock)
+    return clock
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = PredictionCache(max_entries=2)
+    cache.put('a', [1])
+    cache.put('b', [2])
+    # Reading a makes b the least recently used entry
+    assert cache.get('a') == [1]
+    cache.put('c', [3])
+
+    assert cache.get('b') is None
+    assert cache.get('a') == [1]
+    assert cache.get('c') == [3]
+    stats = cache.stats()
+    assert stats['memory_evictions'] == 1
+    assert stats['memory_entries'] == 2
+    assert stats['memory_hits'] == 3
+    assert stats['misses'] == 1
+
+
+def test_disabled_memory_tier_stores_nothing():
+    cache = PredictionCache(max_entries=0)
+    assert not cache.enabled
+    cache.put('a', [1])
+    assert cache.get('a') is None
+
+
+def test_disk_tier_survives_new_instances(tmp_path, clock):
+    path = str(tmp_path / 'predictions.sqlite3')
+    first = PredictionCache(max_entries=4, disk_path=path)
+    first.put('a', [0.25, 0.75])
+
+    second = PredictionCache(max_entries=4, disk_path=path)
+    assert second.get('a') == [0.25, 0.75]
+    assert second.stats()['disk_hits'] == 1
+    # Promoted to the memory tier of the new instance
+    assert second.get('a') == [0.25, 0.75]
+    assert second.stats()['memory_hits'] == 1
+    assert second.stats()['disk_entries'] == 1
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path, clock):
+    path = str(tmp_path / 'predictions.sqlite3')
+    value = [0.5] * 10
+    size = len(prediction_cache.json.dumps(value))
+    # Memory tier off so every read goes to disk
+    cache = PredictionCache(max_entries=0, disk_path=path, disk_max_bytes=2 * size)
+    cache.put('a', value)
+    cache.put('b', value)
+    assert cache.get('a') == value
+    cache.put('c', value)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == value
+    assert cache.get('c') == value
+    assert cache.stats()['disk_evictions'] == 1
+
+
+def test_cache_key_depends_on_checkpoint_and_preprocessing():
+    key = make_cache_key('image', 'resnet50', 'checkpoint-v1', 'p1')
+    assert key == make_cache_key('image', 'resnet50', 'checkpoint-v1', 'p1')
+    assert key != make_cache_key('image', 'resnet50', 'checkpoint-v2', 'p1')
+    assert key != make_cache_key('image', 'resnet50', 'checkpoint-v1', 'p2')
+    assert key != make_cache_key('image', 'skinnet', 'checkpoint-v1', 'p1')
+
+
+def test_hot_swapped_model_misses_the_old_entries(monkeypatch):
+    models = pytest.importorskip('models')
+    entries = {
+        'v1': types.SimpleNamespace(version='v1', checkpoint_hash='checkpoint-v1', architecture='test'),
+        'v2': types.SimpleNamespace(version='v2', checkpoint_hash='checkpoint-v2', architecture='test'),
+    }
+    serving = {'entry': entries['v1']}
+    runs = []
+
+    def submit_inference(model_name, entry, input_tensor):
+        runs.append(entry.version)
+        future = Future()
+        future.set_result((np.full(len(LESION_CODES), 100.0 / len(LESION_CODES)), None))
+        return future
+
+    monkeypatch.setattr(models, 'prediction_cache', PredictionCache(max_entries=16))
+    monkeypatch.setattr(models, 'submit_inference', submit_inference)
+    monkeypatch.setattr(models.registry, 'get_entry', lambda model_name: serving['entry'])
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 32), 'green').save(buffer, format='PNG')
+    image = buffer.getvalue()
+
+    assert models.predict_with_model(image, 'resnet50')['model_version'] == 'v1'
+    assert models.predict_with_model(image, 'resnet50')['model_version'] == 'v1'
+    assert runs == ['v1']
+
+    serving['entry'] = entries['v2']
+    assert models.predict_with_model(image, 'resnet50')['model_version'] == 'v2'
+    assert runs == ['v1', 'v2']
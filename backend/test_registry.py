@@ -0,0 +1,210 @@
+"""
+Tests for hot-swapping models: ModelRegistry.reload and the checkpoint
+watcher, retiring the old version's batchers, and the admin reload
+endpoint. Uses a one-layer model with checkpoints written by the tests.
+"""
+import os
+import threading
+import time
+import types
+
+os.environ.setdefault('SKINVISION_EAGER_LOAD', 'off')
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+import app as backend
+from registry import ModelRegistry
+
+
+def build_model(model_name):
+    return torch.nn.Conv2d(3, 1, 1)
+
+
+def save_checkpoint(path, weight):
+    model = build_model('tiny')
+    torch.nn.init.constant_(model.weight, weight)
+    torch.nn.init.zeros_(model.bias)
+    torch.save(model.state_dict(), str(path) + '.tmp')
+    # Replaced atomically, as a deployment would
+    os.replace(str(path) + '.tmp', path)
+
+
+def output_of(entry):
+    with torch.no_grad():
+        return entry.model(torch.ones(1, 3, 4, 4)).flatten()[0].item()
+
+
+@pytest.fixture
+def registry(tmp_path):
+    checkpoint = tmp_path / 'tiny.pth'
+    save_checkpoint(checkpoint, 1.0)
+    retired = []
+    registry = ModelRegistry(
+        ['tiny'], build_model,
+        get_checkpoint_path=lambda model_name: str(checkpoint),
+        get_architecture=lambda model_name: 'conv',
+        get_input_size=lambda model_name: 4,
+        on_retire=retired.append,
+    )
+    return types.SimpleNamespace(registry=registry, checkpoint=checkpoint, retired=retired)
+
+
+def test_reload_swaps_version_while_in_flight_request_finishes_on_old(registry):
+    old = registry.registry.get_entry('tiny')
+    assert output_of(old) == pytest.approx(3.0)
+
+    # A request that picked up the old version before the swap
+    picked_up, swapped, results = threading.Event(), threading.Event(), []
+
+    def in_flight():
+        entry = registry.registry.get_entry('tiny')
+        picked_up.set()
+        swapped.wait(10)
+        results.append((entry.version, output_of(entry)))
+
+    thread = threading.Thread(target=in_flight)
+    thread.start()
+    picked_up.wait(10)
+    save_checkpoint(registry.checkpoint, 2.0)
+    new = registry.registry.reload('tiny')
+    swapped.set()
+    thread.join(10)
+
+    assert results == [(old.version, pytest.approx(3.0))]
+    assert new.version != old.version and new.warm
+    assert registry.registry.get_entry('tiny') is new
+    assert output_of(registry.registry.get_entry('tiny')) == pytest.approx(6.0)
+    assert old.retired and registry.retired == [old]
+    assert registry.registry.status()['models']['tiny']['version'] == new.version
+
+
+def test_reload_of_unchanged_checkpoint_keeps_entry(registry):
+    entry = registry.registry.get_entry('tiny')
+    assert registry.registry.reload('tiny') is entry
+    assert not entry.retired and registry.retired == []
+
+
+def test_failed_reload_keeps_old_version_serving(registry):
+    old = registry.registry.get_entry('tiny')
+    broken = registry.checkpoint.with_suffix('.new')
+    broken.write_bytes(b'not a checkpoint')
+    os.replace(broken, registry.checkpoint)
+    with pytest.raises(Exception):
+        registry.registry.reload('tiny')
+
+    assert registry.registry.get_entry('tiny') is old
+    assert output_of(old) == pytest.approx(3.0)
+    assert not old.retired and registry.retired == []
+    status = registry.registry.status()['models']['tiny']
+    assert status['version'] == old.version
+    assert status['reload_error']
+
+
+def test_failed_reload_of_other_checkpoint_keeps_configured_one(registry, tmp_path):
+    old = registry.registry.get_entry('tiny')
+    with pytest.raises(Exception):
+        registry.registry.reload('tiny', str(tmp_path / 'missing.pth'))
+    assert registry.registry.checkpoint_path('tiny') == str(registry.checkpoint)
+    assert registry.registry.get_entry('tiny') is old
+
+
+def test_watcher_swaps_replaced_checkpoint(registry):
+    old = registry.registry.get_entry('tiny')
+    registry.registry.watch(0.05)
+    # A new file with the same content is not a new version
+    save_checkpoint(registry.checkpoint, 1.0)
+    time.sleep(0.3)
+    assert registry.registry.get_entry('tiny') is old
+
+    save_checkpoint(registry.checkpoint, 2.0)
+    deadline = time.time() + 10
+    while registry.registry.get_entry('tiny') is old and time.time() < deadline:
+        time.sleep(0.05)
+    assert output_of(registry.registry.get_entry('tiny')) == pytest.approx(6.0)
+    assert registry.retired == [old]
+    # Stop polling the temporary directory
+    registry.registry._watch_interval = 3600
+
+
+def test_models_registry_retires_batchers(monkeypatch):
+    models = backend.models.load()
+    retired = []
+    monkeypatch.setattr(models, 'retire_batchers', retired.append)
+    old = types.SimpleNamespace(version='old', retired=True)
+    models.registry.on_retire(old)
+    assert retired == [old]
+
+
+def test_retired_version_batchers_are_closed(monkeypatch):
+    models = backend.models.load()
+    monkeypatch.setattr(models, 'batchers', {})
+    monkeypatch.setattr(
+        models, 'run_batch_items',
+        lambda model_name, tensors, entry: [(entry.version, None) for _ in tensors]
+    )
+    old = types.SimpleNamespace(version='old', retired=False)
+    new = types.SimpleNamespace(version='new', retired=False)
+    batcher = models.get_batcher('resnet50', old)
+    assert models.submit_inference('resnet50', old, None).result(10) == ('old', None)
+
+    old.retired = True
+    models.retire_batchers(old)
+    assert 'resnet50' not in models.batchers
+    assert batcher._closed
+    # Requests still holding the old version finish on it, unbatched
+    assert models.submit_inference('resnet50', old, None).result(10) == ('old', None)
+    assert models.submit_inference('resnet50', new, None).result(10) == ('new', None)
+    assert models.batchers['resnet50'][0] is new
+    models.retire_batchers(new)
+
+
+@pytest.fixture
+def client():
+    return backend.app.test_client()
+
+
+def test_admin_reload_requires_token(client, monkeypatch):
+    reloads = []
+    monkeypatch.setattr(
+        backend, 'reload_model',
+        lambda model_name, checkpoint=None: (reloads.append((model_name, checkpoint)) or {'success': True}, 200)
+    )
+    monkeypatch.setitem(backend.app.config, 'ADMIN_TOKEN', None)
+    assert client.post('/api/admin/models/resnet50/reload').status_code == 403
+
+    monkeypatch.setitem(backend.app.config, 'ADMIN_TOKEN', 'secret')
+    assert client.post('/api/admin/models/resnet50/reload').status_code == 401
+    response = client.post('/api/admin/models/resnet50/reload', headers={'Authorization': 'Bearer wrong'})
+    assert response.status_code == 401
+    assert response.get_json() == {'error': 'Unauthorized'}
+    assert reloads == []
+
+    response = client.post(
+        '/api/admin/models/resnet50/reload', headers={'Authorization': 'Bearer secret'},
+        json={'checkpoint': 'resnet50_v2.pth'}
+    )
+    assert response.status_code == 200
+    assert reloads == [('resnet50', 'resnet50_v2.pth')]
+
+
+def test_admin_reload_reports_failure_and_bad_checkpoints(client, monkeypatch):
+    models = backend.models.load()
+    monkeypatch.setitem(backend.app.config, 'ADMIN_TOKEN', 'secret')
+    headers = {'Authorization': 'Bearer secret'}
+
+    def fail(model_name, checkpoint_path=None):
+        raise RuntimeError('corrupt checkpoint')
+
+    monkeypatch.setattr(models.registry, 'reload', fail)
+    response = client.post('/api/admin/models/resnet50/reload', headers=headers)
+    assert response.status_code == 500
+    assert 'previous version keeps serving' in response.get_json()['error']
+
+    assert client.post('/api/admin/models/nope/reload', headers=headers).status_code == 404
+    for checkpoint in ('../resnet50.pth', 'resnet50.onnx'):
+        response = client.post('/api/admin/models/resnet50/reload', headers=headers, json={'checkpoint': checkpoint})
+        assert response.status_code == 400
+    response = client.post('/api/admin/models/resnet50/reload', headers=headers, json={'checkpoint': 'missing.pth'})
+    assert response.status_code == 404
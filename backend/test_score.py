@@ -0,0 +1,97 @@
+"""
+Tests for offline bulk scoring: a run interrupted part-way resumes from
+its last checkpoint and the output lists every image exactly once
+"""
+import csv
+import os
+import types
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import score
+from postprocessing import LESION_CODES
+
+
+@pytest.fixture
+def archive(tmp_path):
+    root = tmp_path / 'archive'
+    for index in range(9):
+        folder = root / f"batch{index % 2}"
+        folder.mkdir(parents=True, exist_ok=True)
+        Image.new('RGB', (40, 30), (index * 25, 0, 0)).save(folder / f"image{index}.png")
+    (root / 'broken.jpg').write_bytes(b'not an image')
+    return str(root)
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    """
+    Serve resnet50 from a forward pass that can be told to fail like a
+    Ctrl-C on a given call
+    """
+    models = pytest.importorskip('models')
+    state = {'calls': 0, 'images': 0, 'interrupt_on': None}
+
+    def forward_batch(model_name, input_tensors, entry=None):
+        state['calls'] += 1
+        if state['calls'] == state['interrupt_on']:
+            raise KeyboardInterrupt
+        (batch,) = input_tensors
+        state['images'] += len(batch)
+        probabilities = np.full((len(batch), len(LESION_CODES)), 100.0 / len(LESION_CODES))
+        return list(probabilities), None
+
+    entry = types.SimpleNamespace(version='v1', checkpoint_hash='checkpoint-v1')
+    monkeypatch.setattr(models, 'forward_batch', forward_batch)
+    monkeypatch.setattr(models.registry, 'get_entry', lambda model_name: entry)
+    return state
+
+
+def run(archive, output):
+    return score.score(
+        score.list_images(archive), archive, ['resnet50'], output,
+        batch_size=2, decode_workers=1, prefetch=2, checkpoint_every=3,
+    )
+
+
+def test_interrupted_run_resumes_without_duplicates(archive, fake_model, tmp_path):
+    output = str(tmp_path / 'scores.csv')
+    paths = score.list_images(archive)
+    assert len(paths) == 10
+
+    # Chunks of 2 images; a checkpoint after every 4 images, so the chunk
+    # scored before the interruption is lost and has to be scored again
+    fake_model['interrupt_on'] = 4
+    with pytest.raises(SystemExit, match='Interrupted after 4 images'):
+        run(archive, output)
+    assert not os.path.exists(output)
+    assert os.path.exists(f"{output}.parts/progress.json")
+
+    fake_model['calls'] = fake_model['images'] = 0
+    fake_model['interrupt_on'] = None
+    summary = run(archive, output)
+    # Only the images after the checkpoint are scored again
+    assert summary['scored'] == 6
+    assert fake_model['images'] == 5
+    assert not os.path.exists(f"{output}.parts")
+
+    with open(output, newline='') as f:
+        rows = list(csv.DictReader(f))
+    # Every image exactly once
+    assert len(rows) == len(paths)
+    assert sorted(row['path'] for row in rows) == sorted(paths)
+    assert {row['path']: row['status'] for row in rows}['broken.jpg'] == 'error'
+    assert all(row['model_version'] == 'v1' for row in rows if row['status'] == 'ok')
+
+
+def test_changed_inputs_do_not_resume_old_progress(archive, fake_model, tmp_path):
+    output = str(tmp_path / 'scores.csv')
+    fake_model['interrupt_on'] = 3
+    with pytest.raises(SystemExit, match='Interrupted'):
+        run(archive, output)
+
+    Image.new('RGB', (40, 30), 'white').save(os.path.join(archive, 'late.png'))
+    with pytest.raises(SystemExit, match='belongs to a different run'):
+        run(archive, output)
@@ -0,0 +1,177 @@
+"""
+Tests for request log sampling and the non-blocking queue handler
+"""
+import io
+import json
+import logging
+import queue
+import threading
+import time
+
+import pytest
+
+import structured_logging
+from structured_logging import NonBlockingQueueHandler, RequestSampler, JsonFormatter
+
+
+def test_parse_sampling():
+    assert structured_logging._parse_sampling('/api/analyze=0.1, /api/ready=0') == {
+        '/api/analyze': 0.1, '/api/ready': 0.0
+    }
+    assert structured_logging._parse_sampling(None) == {}
+
+
+def test_sampler_rates(monkeypatch):
+    sampler = RequestSampler(default_rate=0.25, route_rates={'/api/ready': 0.0, '/api/upload': 1.0})
+    draws = iter([0.1, 0.3, 0.2, 0.9])
+    monkeypatch.setattr(structured_logging.random, 'random', lambda: next(draws))
+    assert [sampler.should_log('/api/analyze', 200) for _ in range(4)] == [True, False, True, False]
+
+    # Failures are always kept unless the route is silenced
+    assert sampler.should_log('/api/analyze', 500)
+    assert sampler.should_log('/api/analyze', 404)
+    assert not sampler.should_log('/api/ready', 503)
+    assert sampler.should_log('/api/upload', 200)
+
+
+def test_sampler_keeps_about_the_rate():
+    structured_logging.random.seed(7)
+    sampler = RequestSampler(default_rate=0.1)
+    kept = sum(sampler.should_log('/api/analyze', 200) for _ in range(10000))
+    assert 800 < kept < 1200
+
+
+class Capture(logging.Handler):
+    def __init__(self):
+        super(Capture, self).__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def test_log_request_summary(monkeypatch):
+    monkeypatch.setattr(structured_logging, 'sampler', RequestSampler(route_rates={'/api/ready': 0}))
+    logger = logging.getLogger('test_structured_logging.summary')
+    capture = Capture()
+    logger.addHandler(capture)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    try:
+        structured_logging.log_request(
+            logger, 'abc', '/api/analyze', 'POST', 200, 0.0123, {'decode': 0.002, 'forward': 0.0081},
+            model='resnet50', top1=None
+        )
+        structured_logging.log_request(logger, 'def', '/api/analyze', 'POST', 503, 1.5)
+        structured_logging.log_request(logger, 'ghi', '/api/ready', 'GET', 200, 0.001)
+    finally:
+        logger.removeHandler(capture)
+
+    assert len(capture.records) == 2
+    summary = capture.records[0]
+    assert summary.levelno == logging.INFO
+    assert summary.getMessage() == 'request POST /api/analyze 200'
+    assert summary.fields == {
+        'request_id': 'abc', 'route': '/api/analyze', 'method': 'POST', 'status': 200,
+        'duration_ms': 12.3, 'stages_ms': {'decode': 2.0, 'forward': 8.1}, 'model': 'resnet50',
+    }
+    assert capture.records[1].levelno == logging.WARNING
+    assert 'stages_ms' not in capture.records[1].fields
+
+
+class Blocking(logging.Handler):
+    # Writes slower than records arrive: holds every record until released
+    def __init__(self):
+        super(Blocking, self).__init__()
+        self.unblock = threading.Event()
+        self.lines = []
+
+    def emit(self, record):
+        self.unblock.wait(10)
+        self.lines.append(self.format(record))
+
+
+def test_queue_handler_drops_instead_of_blocking():
+    output = Blocking()
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=2), [output])
+    logger = logging.getLogger('test_structured_logging.queue')
+    logger.addHandler(handler)
+    logger.propagate = False
+    try:
+        started = time.perf_counter()
+        for index in range(20):
+            logger.warning('record %d', index)
+        assert time.perf_counter() - started < 1.0
+        assert handler.dropped >= 17
+    finally:
+        output.unblock.set()
+        # Stops even though the queue is still full
+        handler.stop()
+        logger.removeHandler(handler)
+    assert len(output.lines) == 20 - handler.dropped
+    assert output.lines[0] == 'record 0'
+
+
+def test_queue_handler_formats_on_listener():
+    class Lazy:
+        # Formatting it on the request thread would show up here
+        formatted_on = []
+
+        def __str__(self):
+            self.formatted_on.append(threading.current_thread().name)
+            return 'lazy'
+
+    stream = io.StringIO()
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter())
+    handler = NonBlockingQueueHandler(queue.Queue(), [output])
+    logger = logging.getLogger('test_structured_logging.format')
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    try:
+        logger.info('value %s', Lazy(), extra={'fields': {'request_id': 'abc'}})
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            logger.exception('failed')
+    finally:
+        handler.stop()
+        logger.removeHandler(handler)
+
+    first, second = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert first['msg'] == 'value lazy' and first['request_id'] == 'abc'
+    assert Lazy.formatted_on and threading.main_thread().name not in Lazy.formatted_on
+    assert second['msg'] == 'failed'
+    assert 'ValueError: boom' in second['exc']
+
+
+def test_queue_handler_restarts_listener_in_new_process():
+    output = Capture()
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=5), [output])
+    handler.handle(logging.makeLogRecord({'msg': 'parent', 'levelno': logging.INFO}))
+    parent_queue = handler.queue
+    # What a forked worker sees: a handler set up by another process
+    handler._pid = -1
+    handler.handle(logging.makeLogRecord({'msg': 'child', 'levelno': logging.INFO}))
+    handler.stop()
+    assert handler.queue is not parent_queue and handler.queue.maxsize == 5
+    assert 'child' in [record.msg for record in output.records]
+
+
+@pytest.fixture
+def restore_logging():
+    yield
+    structured_logging.configure_logging()
+
+
+def test_configure_logging_routes_through_queue(restore_logging):
+    stream = io.StringIO()
+    handler = structured_logging.configure_logging(level='INFO', fmt='text', stream=stream)
+    assert logging.getLogger().handlers == [handler]
+    logging.getLogger('test_structured_logging.root').info('hello %s', 'world', extra={'fields': {'k': 1}})
+    logging.getLogger('werkzeug').info('access line')
+    structured_logging.flush()
+    handler.stop()
+    assert stream.getvalue().count('\n') == 1
+    assert stream.getvalue().rstrip().endswith('INFO test_structured_logging.root: hello world k=1')
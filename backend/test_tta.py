@@ -0,0 +1,106 @@
+"""
+Tests for test-time augmentation: view order, shapes and geometry, the
+per-view averaging, and one batched forward pass per analysis
+"""
+import io
+import types
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import tta
+from postprocessing import LESION_CODES
+from prediction_cache import PredictionCache
+
+
+def numbered(size):
+    # Every element distinct, so any misplaced pixel is noticed
+    return np.arange(3 * size * size, dtype=np.float32).reshape(1, 3, size, size)
+
+
+def test_views_are_stacked_in_request_order():
+    size = 4
+    inputs = {size: numbered(size), tta.crop_size_for(size): numbered(tta.crop_size_for(size))}
+    assert tta.crop_size_for(size) == 5
+    views = ['rot270', 'original', 'crop_br', 'hflip', 'vflip', 'rot90', 'rot180', 'crop_tl', 'crop_center']
+    batch = tta.build_views(inputs, views, size)
+    assert batch.shape == (len(views), 3, size, size)
+    assert batch.dtype == np.float32
+
+    image = inputs[size][0]
+    crops = inputs[5][0]
+    expected = {
+        'original': image,
+        'hflip': image[:, :, ::-1],
+        'vflip': image[:, ::-1, :],
+        # Counter-clockwise, as torch.rot90 over (H, W)
+        'rot90': np.stack([np.rot90(channel, 1) for channel in image]),
+        'rot180': image[:, ::-1, ::-1],
+        'rot270': np.stack([np.rot90(channel, 3) for channel in image]),
+        'crop_tl': crops[:, :4, :4],
+        'crop_br': crops[:, 1:, 1:],
+        'crop_center': crops[:, :4, :4],
+    }
+    for index, view in enumerate(views):
+        assert np.array_equal(batch[index], expected[view]), view
+    # Rotating the top-right pixel counter-clockwise moves it to the top-left
+    assert batch[views.index('rot90'), 0, 0, 0] == image[0, 0, size - 1]
+
+
+def test_input_sizes_follow_the_views():
+    assert tta.input_sizes(tta.PRESETS['rotations'], 224) == {224}
+    assert tta.input_sizes(tta.PRESETS['multicrop'], 224) == {224, 256}
+    assert tta.input_sizes(['crop_tl'], 299) == {tta.crop_size_for(299)}
+
+
+def test_summarize_averages_views_and_reports_agreement():
+    views = ['original', 'hflip', 'vflip', 'rot90']
+    probabilities = np.zeros((4, len(LESION_CODES)))
+    probabilities[:, 0] = [70, 60, 20, 50]
+    probabilities[:, 1] = [30, 40, 80, 50]
+    averaged, summary = tta.summarize(probabilities, views)
+
+    assert averaged.shape == (len(LESION_CODES),)
+    assert averaged[0] == pytest.approx(50) and averaged[1] == pytest.approx(50)
+    assert [entry['view'] for entry in summary['views']] == views
+    assert [entry['top_prediction']['code'] for entry in summary['views']] == [
+        LESION_CODES[0], LESION_CODES[0], LESION_CODES[1], LESION_CODES[0]
+    ]
+    assert [entry['consensus_probability'] for entry in summary['views']] == [70, 60, 20, 50]
+    assert summary['agreement'] == 0.75
+    assert summary['consensus_probability_std'] == round(float(np.std([70, 60, 20, 50])), 2)
+
+
+def test_predict_tta_runs_every_view_in_one_batch(monkeypatch):
+    models = pytest.importorskip('models')
+    batches = []
+
+    def forward_batch(model_name, input_tensors, entry=None):
+        (batch,) = input_tensors
+        batches.append(batch.shape)
+        # The view index decides the top class, so averaging is visible
+        rows = np.full((len(batch), len(LESION_CODES)), 1.0)
+        rows[np.arange(len(batch)), np.arange(len(batch))] += 100.0 - len(LESION_CODES)
+        return list(rows), None
+
+    entry = types.SimpleNamespace(version='v1', checkpoint_hash='checkpoint-v1')
+    monkeypatch.setattr(models, 'forward_batch', forward_batch)
+    monkeypatch.setattr(models, 'prediction_cache', PredictionCache(max_entries=16))
+    monkeypatch.setattr(models.registry, 'get_entry', lambda model_name: entry)
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (80, 60), 'orange').save(buffer, format='PNG')
+    views = tta.PRESETS['full']
+    result = models.predict_tta(buffer.getvalue(), 'inceptionv3', views)
+
+    assert batches == [(len(views), 3, 299, 299)]
+    assert [entry['view'] for entry in result['tta']['views']] == views
+    assert [entry['top_prediction']['code'] for entry in result['tta']['views']] == LESION_CODES[:len(views)]
+    averaged = result['predictions'][LESION_CODES[0]]['probability']
+    assert averaged == pytest.approx((100.0 - len(LESION_CODES) + 1 + len(views) - 1) / len(views), abs=0.01)
+    assert result['model_version'] == 'v1'
+
+    # Cached per view set: no second forward pass
+    models.predict_tta(buffer.getvalue(), 'inceptionv3', views)
+    assert len(batches) == 1
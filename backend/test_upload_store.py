@@ -0,0 +1,111 @@
+"""
+Tests for the upload store: content-addressed dedupe, the age and size
+retention sweeps, and the SQLite index staying in step with the files
+"""
+import glob
+import io
+import os
+
+from PIL import Image
+
+import tensor_store
+from upload_store import UploadStore, upload_id_for
+
+
+def image_bytes(color, size=(64, 48)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def files_of(path):
+    return sorted(glob.glob(glob.escape(path) + '*'))
+
+
+def set_last_access(store, upload_id, when):
+    db = store._connection()
+    with db:
+        db.execute('UPDATE uploads SET last_access = ? WHERE id = ?', (when, upload_id))
+
+
+def make_store(tmp_path, **kwargs):
+    return UploadStore(str(tmp_path / 'uploads'), sweep_interval=0, **kwargs)
+
+
+def test_identical_images_are_stored_once(tmp_path):
+    store = make_store(tmp_path)
+    red = image_bytes('red')
+    upload_id, path, created = store.save(red, 'lesion.PNG')
+    assert upload_id == upload_id_for(red, 'lesion.png')
+    assert created
+    assert path == store.path_for(upload_id)
+    assert path.startswith(os.path.join(store.root, upload_id[:2], upload_id[2:4]))
+
+    again_id, again_path, created = store.save(red, 'lesion.png')
+    assert (again_id, again_path, created) == (upload_id, path, False)
+    assert store.stats()['uploads'] == 1
+    assert store.resolve(upload_id) == path
+    assert store.resolve('f' * 64 + '.png') is None
+
+
+def test_age_sweep_removes_stale_uploads_with_their_tensors(tmp_path):
+    store = make_store(tmp_path, max_age_seconds=100)
+    old_id, old_path, _ = store.save(image_bytes('red'), 'old.png')
+    tensor_store.store_preprocessed(old_path, [32])
+    now = store._connection().execute('SELECT last_access FROM uploads').fetchone()[0]
+    assert len(files_of(old_path)) == 3
+
+    # Not old enough yet
+    assert store.sweep(now=now + 50) == 0
+    new_id, new_path, _ = store.save(image_bytes('blue'), 'new.png')
+    set_last_access(store, new_id, now + 150)
+    assert store.sweep(now=now + 200) == 1
+
+    assert files_of(old_path) == []
+    assert store.resolve(old_id) is None
+    assert store.resolve(new_id) == new_path
+    assert store.stats()['uploads'] == 1
+
+
+def test_size_budget_counts_stored_tensors(tmp_path):
+    colors = ['red', 'green', 'blue']
+    store = make_store(tmp_path)
+    uploads = []
+    for index, color in enumerate(colors):
+        upload_id, path, _ = store.save(image_bytes(color), f"{color}.png")
+        tensor_store.store_preprocessed(path, [224, 299])
+        size = store.refresh_size(upload_id)
+        assert size == sum(os.path.getsize(name) for name in files_of(path))
+        # Tensors dwarf the image itself
+        assert size > 1_600_000 > 20 * os.path.getsize(path)
+        set_last_access(store, upload_id, 1000.0 + index)
+        uploads.append((upload_id, path, size))
+    assert store.stats()['bytes'] == sum(size for _, _, size in uploads)
+
+    # Room for two uploads with their tensors: the least recently used goes
+    store.max_total_bytes = uploads[1][2] + uploads[2][2]
+    assert store.sweep(now=2000.0) == 1
+    assert files_of(uploads[0][1]) == []
+    assert store.resolve(uploads[0][0]) is None
+    assert [store.resolve(upload_id) for upload_id, _, _ in uploads[1:]] == [path for _, path, _ in uploads[1:]]
+    assert store.stats()['bytes'] == store.max_total_bytes
+
+
+def test_index_matches_files_after_removal(tmp_path):
+    store = make_store(tmp_path)
+    kept_id, kept_path, _ = store.save(image_bytes('red'), 'kept.png')
+    gone_id, gone_path, _ = store.save(image_bytes('blue'), 'gone.png')
+    tensor_store.store_preprocessed(gone_path, [32])
+    store.remove(gone_id)
+
+    indexed = store._connection().execute('SELECT id, path FROM uploads').fetchall()
+    assert indexed == [(kept_id, kept_path)]
+    on_disk = sorted(glob.glob(os.path.join(store.root, '*', '*', '*')))
+    assert on_disk == [kept_path]
+    assert store.refresh_size(gone_id) is None
+    assert store.stats() == {
+        'uploads': 1,
+        'bytes': os.path.getsize(kept_path),
+        'max_total_bytes': None,
+        'max_age_seconds': None,
+    }
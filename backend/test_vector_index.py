@@ -0,0 +1,90 @@
+"""
+Tests for the vector index: recall of IVF and IVF-PQ search against the
+exact flat scan, and quantizer versions that readers switch to atomically
+"""
+import os
+
+import numpy as np
+import pytest
+
+from vector_index import VectorIndex
+
+DIM = 64
+
+
+def clustered(count, seed, centers=50, noise=1.5):
+    # Gaussian clusters: the structure IVF lists are meant to exploit
+    rng = np.random.default_rng(seed)
+    means = np.random.default_rng(0).normal(size=(centers, DIM))
+    return (means[rng.integers(0, centers, count)] + noise * rng.normal(size=(count, DIM))).astype(np.float32)
+
+
+def build(root, kind, vectors, **options):
+    index = VectorIndex(str(root), DIM, kind=kind, pq_subspaces=16, train_min=10 ** 9, **options)
+    index.add_many([(f"case{row}", vector, None, None, None, None) for row, vector in enumerate(vectors)])
+    return index
+
+
+def neighbours(index, queries, k=10):
+    return [[result['case_id'] for result in index.search(query, k=k)] for query in queries]
+
+
+def recall(found, expected):
+    return np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(found, expected)])
+
+
+def test_flat_search_is_exact(tmp_path):
+    vectors = clustered(500, seed=1)
+    query = clustered(1, seed=2)[0]
+    index = build(tmp_path, 'flat', vectors)
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    expected = np.argsort(-(normalized @ (query / np.linalg.norm(query))))[:5]
+    results = index.search(query, k=5)
+    assert [result['case_id'] for result in results] == [f"case{row}" for row in expected]
+    assert results[0]['similarity'] >= results[-1]['similarity']
+
+
+@pytest.mark.parametrize('kind, minimum', [('ivf', 0.9), ('ivfpq', 0.85)])
+def test_approximate_search_recall(tmp_path, kind, minimum):
+    vectors = clustered(5000, seed=1)
+    queries = clustered(50, seed=2)
+    exact = neighbours(build(tmp_path / 'flat', 'flat', vectors), queries)
+
+    index = build(tmp_path / kind, kind, vectors, nprobe=8)
+    # Untrained, ivf and ivfpq scan everything exactly
+    assert recall(neighbours(index, queries), exact) == 1.0
+    index.train()
+    assert index.stats()['lists'] == 70
+    assert recall(neighbours(index, queries), exact) >= minimum
+
+    # Probing every list leaves only the PQ approximation
+    index.nprobe = 70
+    assert recall(neighbours(index, queries), exact) >= (1.0 if kind == 'ivf' else minimum)
+
+
+def test_retraining_writes_a_new_version_next_to_the_old(tmp_path):
+    vectors = clustered(600, seed=3)
+    writer = build(tmp_path, 'ivfpq', vectors[:300])
+    first = writer.train()
+    # Another process with the first version loaded
+    reader = VectorIndex(str(tmp_path), DIM, kind='ivfpq', pq_subspaces=16, train_min=10 ** 9)
+    query = vectors[0]
+    assert reader.search(query, k=1)[0]['case_id'] == 'case0'
+    old_files = {path: open(path, 'rb').read() for path in writer._paths(first)}
+
+    writer.add_many([(f"case{row}", vector, None, None, None, None) for row, vector in enumerate(vectors[300:], 300)])
+    second = writer.train(seed=1)
+    assert second != first
+    # Training left the files of the version readers may still use alone;
+    # only the rows added with it in place were appended
+    for path, content in old_files.items():
+        assert open(path, 'rb').read()[:len(content)] == content
+    assert reader.search(vectors[450], k=1)[0]['case_id'] == 'case450'
+    assert reader._quantizer_version == second
+
+    # Two versions back is removed; so is the untrained lists file
+    third = writer.train(seed=2)
+    assert not any(os.path.exists(path) for path in writer._paths(first))
+    assert not os.path.exists(writer._paths(None)[1])
+    assert all(os.path.exists(path) for version in (second, third) for path in writer._paths(version))
+    assert reader.search(vectors[599], k=1)[0]['case_id'] == 'case599'
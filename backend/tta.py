@@ -0,0 +1,164 @@
+"""
+Test-time augmentation (TTA) for single-model analysis.
+
+Every augmented view of an image is built from one read of the file (and
+one decode per JPEG draft scale) as slices, flips and rotations of the
+normalized tensor, so N views cost one preprocessing step and one batched
+forward pass of N rows instead of N separate requests.
+
+Views:
+
+- original: the standard model input
+- hflip, vflip: mirrored horizontally / vertically
+- rot90, rot180, rot270: rotated counter-clockwise
+- crop_center, crop_tl, crop_tr, crop_bl, crop_br: the center and corner
+  crops of the image resized to size / CROP_FRACTION (256 for 224 inputs)
+
+Presets: flips, rotations (the flips plus every rotation; lesions have no
+canonical orientation), multicrop (original plus the five crops) and full.
+
+Views are built with NumPy, so TTA works without torch when the model is
+served by ONNX Runtime.
+"""
+import json
+
+import numpy as np
+
+import preprocessing
+from postprocessing import LESION_CODES, LESION_NAMES
+
+# Crops are size x size windows of the image resized to size / CROP_FRACTION
+CROP_FRACTION = 0.875
+
+GEOMETRIC_VIEWS = ['original', 'hflip', 'vflip', 'rot90', 'rot180', 'rot270']
+CROP_VIEWS = ['crop_center', 'crop_tl', 'crop_tr', 'crop_bl', 'crop_br']
+VIEWS = GEOMETRIC_VIEWS + CROP_VIEWS
+
+PRESETS = {
+    'flips': ['original', 'hflip', 'vflip'],
+    'rotations': GEOMETRIC_VIEWS,
+    'multicrop': ['original'] + CROP_VIEWS,
+    'full': VIEWS,
+}
+DEFAULT_PRESET = 'rotations'
+
+
+def parse_tta(value):
+    """
+    Validate a tta request parameter: false/absent for none, true for the
+    default preset, a preset name, or a list (or comma-separated string)
+    of view names. Returns the list of views, or None.
+    """
+    if value is None or value is False:
+        return None
+    if value is True:
+        return PRESETS[DEFAULT_PRESET]
+    if isinstance(value, str):
+        text = value.strip().lower()
+        if text in ('', '0', 'false', 'no', 'off'):
+            return None
+        if text in ('1', 'true', 'yes', 'on'):
+            return PRESETS[DEFAULT_PRESET]
+        if text in PRESETS:
+            return PRESETS[text]
+        if text.startswith('['):
+            value = json.loads(text)
+        else:
+            value = text.split(',')
+    if not isinstance(value, (list, tuple)):
+        raise ValueError('tta must be a boolean, a preset name or a list of views')
+    views = list(dict.fromkeys(str(view).strip() for view in value if str(view).strip()))
+    unknown = [view for view in views if view not in VIEWS]
+    if unknown or not views:
+        raise ValueError(f"Unknown TTA views: {unknown}; expected names from {VIEWS} or a preset from {sorted(PRESETS)}")
+    return views
+
+
+def crop_size_for(size):
+    return int(round(size / CROP_FRACTION))
+
+
+def input_sizes(views, size):
+    """
+    Preprocessed sizes needed to build views for a size x size model
+    """
+    sizes = set()
+    if any(view in GEOMETRIC_VIEWS for view in views):
+        sizes.add(size)
+    if any(view in CROP_VIEWS for view in views):
+        sizes.add(crop_size_for(size))
+    return sizes
+
+
+def preprocess_inputs(source, views, size):
+    """
+    Decode an image (path or file-like object) once for every size views need.
+    Returns a dict of size -> [1, 3, size, size] float32 array.
+    """
+    return preprocessing.preprocess_sizes(source, input_sizes(views, size))
+
+
+def _crop(image, view, size):
+    full = image.shape[-1]
+    far = full - size
+    offsets = {
+        'crop_center': (far // 2, far // 2),
+        'crop_tl': (0, 0),
+        'crop_tr': (0, far),
+        'crop_bl': (far, 0),
+        'crop_br': (far, far),
+    }
+    top, left = offsets[view]
+    return image[:, :, top:top + size, left:left + size]
+
+
+def build_views(inputs, views, size):
+    """
+    Stack the views of one image into a [len(views), 3, size, size] batch,
+    given the preprocessed inputs from preprocess_inputs
+    """
+    batch = np.empty((len(views), 3, size, size), dtype=np.float32)
+    for index, view in enumerate(views):
+        if view in CROP_VIEWS:
+            batch[index:index + 1] = _crop(np.asarray(inputs[crop_size_for(size)]), view, size)
+            continue
+        image = np.asarray(inputs[size])
+        if view == 'hflip':
+            image = np.flip(image, axis=3)
+        elif view == 'vflip':
+            image = np.flip(image, axis=2)
+        elif view.startswith('rot'):
+            image = np.rot90(image, int(view[3:]) // 90, axes=(2, 3))
+        batch[index:index + 1] = image
+    return batch
+
+
+def summarize(view_probabilities, views):
+    """
+    Average the per-view probabilities (in percent, one row per view) and
+    describe how far the views agree. Returns (averaged probabilities,
+    summary dict for the response).
+    """
+    view_probabilities = np.asarray(view_probabilities, dtype=np.float64)
+    averaged = view_probabilities.mean(axis=0)
+    top = int(np.argmax(averaged))
+    view_tops = view_probabilities.argmax(axis=1)
+    top_probabilities = view_probabilities[:, top]
+    return averaged, {
+        'views': [
+            {
+                'view': view,
+                'top_prediction': {
+                    'code': LESION_CODES[view_top],
+                    'name': LESION_NAMES[view_top],
+                    'probability': round(float(probabilities[view_top]), 2),
+                },
+                # Probability this view gives the averaged top class
+                'consensus_probability': round(float(probabilities[top]), 2),
+            }
+            for view, view_top, probabilities in zip(views, view_tops.tolist(), view_probabilities)
+        ],
+        # Share of views whose own top class is the averaged top class
+        'agreement': round(float(np.mean(view_tops == top)), 4),
+        'consensus_probability_std': round(float(top_probabilities.std()), 2),
+    }
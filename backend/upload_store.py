@@ -0,0 +1,226 @@
+"""
+Content-addressed upload storage.
+
+Uploads are named by the SHA-256 of their bytes and sharded into nested
+directories (uploads/ab/cd/abcd....jpg), so identical images are stored
+once and no directory grows without bound. A SQLite index maps upload ids
+to files for lookups (no directory listings) and records size and last
+access for the retention sweep, which removes uploads older than
+max_age_seconds and then the least recently used ones until the store
+fits in max_total_bytes. The recorded size includes the preprocessed
+tensors stored next to an upload (see tensor_store.py) once refresh_size
+has measured them, and they are deleted together with it.
+
+Upload ids have the form "<sha256>.<ext>" and are what the API returns as
+"filename". Files from the old flat layout (uploads/<name>) still resolve.
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import tensor_store
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{64}\.(jpg|jpeg|png)$')
+EXTENSIONS = ('jpg', 'jpeg', 'png')
+
+# Refresh last_access at most this often per upload, so reads rarely write
+ACCESS_RESOLUTION_SECONDS = 3600
+
+
+def upload_id_for(image_bytes, original_name):
+    """
+    Content-derived upload id ("<sha256>.<ext>") of an image
+    """
+    extension = original_name.rsplit('.', 1)[-1].lower() if '.' in original_name else ''
+    if extension not in EXTENSIONS:
+        extension = 'jpg'
+    return f"{hashlib.sha256(image_bytes).hexdigest()}.{extension}"
+
+
+class UploadStore:
+    """
+    Sharded, deduplicated upload directory with a SQLite index and a
+    background retention sweep
+    """
+
+    def __init__(self, root, max_age_seconds=None, max_total_bytes=None, sweep_interval=3600):
+        self.root = root
+        self.index_path = os.path.join(root, 'index.sqlite3')
+        self.max_age_seconds = max_age_seconds
+        self.max_total_bytes = max_total_bytes
+        self.sweep_interval = sweep_interval
+
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self._sweeper = None
+        self._sweeper_pid = None
+
+    def _connection(self):
+        # SQLite connections must not be shared across fork, so each worker
+        # process opens its own
+        if self._db is None or self._db_pid != os.getpid():
+            os.makedirs(self.root, exist_ok=True)
+            db = sqlite3.connect(self.index_path, timeout=5, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS uploads ('
+                ' id TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL,'
+                ' original_name TEXT, created_at REAL NOT NULL, last_access REAL NOT NULL)'
+            )
+            db.execute('CREATE INDEX IF NOT EXISTS uploads_last_access ON uploads (last_access)')
+            self._db = db
+            self._db_pid = os.getpid()
+        return self._db
+
+    def path_for(self, upload_id):
+        digest = upload_id.split('.', 1)[0]
+        return os.path.join(self.root, digest[:2], digest[2:4], upload_id)
+
+    def save(self, image_bytes, original_name):
+        """
+        Store image_bytes (deduplicated by content) and return
+        (upload_id, path, created). created is False when an identical
+        image was already stored.
+        """
+        upload_id = upload_id_for(image_bytes, original_name)
+        path = self.path_for(upload_id)
+        now = time.time()
+
+        created = not os.path.exists(path)
+        if created:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(image_bytes)
+            os.replace(tmp_path, path)
+
+        with self._lock:
+            db = self._connection()
+            with db:
+                db.execute(
+                    'INSERT INTO uploads (id, path, size, original_name, created_at, last_access)'
+                    ' VALUES (?, ?, ?, ?, ?, ?)'
+                    ' ON CONFLICT(id) DO UPDATE SET last_access = excluded.last_access',
+                    (upload_id, path, len(image_bytes), original_name, now, now)
+                )
+        self._ensure_sweeper()
+        return upload_id, path, created
+
+    def refresh_size(self, upload_id):
+        """
+        Record the disk usage of an upload with its preprocessed tensors;
+        call it after writing them. Returns the size, or None for an
+        unknown upload.
+        """
+        path = self.path_for(upload_id)
+        try:
+            size = os.path.getsize(path) + tensor_store.preprocessed_bytes(path)
+        except OSError:
+            return None
+        with self._lock:
+            db = self._connection()
+            with db:
+                updated = db.execute('UPDATE uploads SET size = ? WHERE id = ?', (size, upload_id)).rowcount
+        return size if updated else None
+
+    def resolve(self, filename):
+        """
+        Path of an upload by id (or legacy flat filename), or None
+        """
+        if UPLOAD_ID_PATTERN.match(filename or ''):
+            with self._lock:
+                db = self._connection()
+                row = db.execute('SELECT path, last_access FROM uploads WHERE id = ?', (filename,)).fetchone()
+                if row is not None and time.time() - row[1] > ACCESS_RESOLUTION_SECONDS:
+                    with db:
+                        db.execute('UPDATE uploads SET last_access = ? WHERE id = ?', (time.time(), filename))
+            if row is not None and os.path.exists(row[0]):
+                return row[0]
+            return None
+
+        # Uploads stored flat in the root before the content-addressed layout
+        name = os.path.basename(filename or '')
+        if name.rsplit('.', 1)[-1].lower() not in EXTENSIONS:
+            return None
+        legacy_path = os.path.join(self.root, name)
+        return legacy_path if os.path.isfile(legacy_path) else None
+
+    def remove(self, upload_id):
+        with self._lock:
+            db = self._connection()
+            row = db.execute('SELECT path FROM uploads WHERE id = ?', (upload_id,)).fetchone()
+            with db:
+                db.execute('DELETE FROM uploads WHERE id = ?', (upload_id,))
+        if row is not None:
+            self._delete_files(row[0])
+
+    def _delete_files(self, path):
+        tensor_store.remove_preprocessed(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def sweep(self, now=None):
+        """
+        Remove uploads past max_age_seconds, then least recently used ones
+        until the store is within max_total_bytes. Returns the number removed.
+        """
+        now = now or time.time()
+        with self._lock:
+            db = self._connection()
+            rows = db.execute('SELECT id, path, size, last_access FROM uploads ORDER BY last_access').fetchall()
+            total = sum(row[2] for row in rows)
+            expired = []
+            for upload_id, path, size, last_access in rows:
+                too_old = self.max_age_seconds and now - last_access > self.max_age_seconds
+                too_big = self.max_total_bytes and total > self.max_total_bytes
+                if not (too_old or too_big):
+                    break
+                expired.append((upload_id, path))
+                total -= size
+            with db:
+                db.executemany('DELETE FROM uploads WHERE id = ?', [(upload_id,) for upload_id, _ in expired])
+
+        for _, path in expired:
+            self._delete_files(path)
+        if expired:
+            logger.info("Upload retention removed %d uploads", len(expired))
+        return len(expired)
+
+    def stats(self):
+        with self._lock:
+            db = self._connection()
+            count, total = db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM uploads').fetchone()
+        return {
+            'uploads': count,
+            'bytes': total,
+            'max_total_bytes': self.max_total_bytes,
+            'max_age_seconds': self.max_age_seconds,
+        }
+
+    def _ensure_sweeper(self):
+        # Threads do not survive fork, so each worker starts its own sweeper
+        # on first use; concurrent sweeps are harmless
+        if not (self.max_age_seconds or self.max_total_bytes) or self.sweep_interval <= 0:
+            return
+        if self._sweeper_pid == os.getpid() and self._sweeper.is_alive():
+            return
+        self._sweeper_pid = os.getpid()
+        self._sweeper = threading.Thread(target=self._sweep_forever, name='upload-retention', daemon=True)
+        self._sweeper.start()
+
+    def _sweep_forever(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning("Upload retention sweep failed: %s", e)
+            time.sleep(self.sweep_interval)
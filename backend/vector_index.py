@@ -0,0 +1,480 @@
+"""
+Memory-mapped nearest-neighbour index of image embeddings.
+
+Vectors are L2-normalized float32 rows appended to a flat file that is
+memory-mapped for search, so the index costs no RAM beyond the pages the
+OS keeps cached and every worker process shares the same files. Case
+metadata lives in a SQLite file next to it; similarity is the cosine.
+
+kind selects the search:
+
+- flat: exact, scans every vector (chunked matrix-vector products)
+- ivf: once train_min vectors are stored, a coarse k-means quantizer
+  splits them into nlist lists and a query only scans the nprobe lists
+  closest to it
+- ivfpq: ivf whose candidates are scored from 1-byte product-quantization
+  codes (pq_subspaces bytes per vector) and only the best rerank of them
+  are re-scored exactly from the vectors
+
+Until the quantizer is trained (and for vectors added while it retrains)
+ivf and ivfpq fall back to scanning those vectors exactly. It is retrained
+in the background whenever the index has doubled since the last training.
+
+Files in root: vectors.f32, index.sqlite3 and, per quantizer version,
+quantizer.<version>.npz, lists.<version>.i32 (coarse list per row) and
+codes.<version>.u8 (PQ codes per row); lists.i32 holds the rows added
+before the first training. Training writes a new version's files next to
+the old ones and then switches the version recorded in index.sqlite3 in
+one transaction, so a reader always pairs a quantizer with the lists and
+codes encoded by it. Files of older versions are removed once two newer
+ones exist.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+KINDS = ('flat', 'ivf', 'ivfpq')
+
+# Rows scored per matrix-vector product in exact scans
+SCAN_CHUNK_ROWS = 65536
+
+
+def normalize(vectors):
+    """
+    L2-normalize float32 rows (a single vector becomes one row)
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def kmeans(data, k, iterations=8, spherical=False, seed=0):
+    """
+    Plain Lloyd k-means on float32 rows. spherical keeps the centroids
+    unit length and assigns by inner product (cosine k-means).
+    """
+    rng = np.random.default_rng(seed)
+    k = min(k, len(data))
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = assign(data, centroids, spherical)
+        counts = np.bincount(assignment, minlength=k)
+        empty = counts == 0
+        # Sum every cluster as one contiguous segment of the sorted rows
+        order = np.argsort(assignment, kind='stable')
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        sums = np.zeros_like(centroids)
+        sums[~empty] = np.add.reduceat(data[order], starts[~empty], axis=0)
+        # Empty clusters restart from random points
+        sums[empty] = data[rng.choice(len(data), int(empty.sum()))]
+        counts[empty] = 1
+        centroids = sums / counts[:, np.newaxis]
+        if spherical:
+            centroids = normalize(centroids)
+    return centroids.astype(np.float32)
+
+
+def assign(data, centroids, spherical=False):
+    """
+    Index of the nearest centroid for every row
+    """
+    scores = data @ centroids.T
+    if not spherical:
+        # argmin |x - c|^2 == argmax x.c - |c|^2 / 2
+        scores -= 0.5 * np.einsum('ij,ij->i', centroids, centroids)
+    return np.argmax(scores, axis=1)
+
+
+class VectorIndex:
+    """
+    Append-only embedding index with exact, IVF or IVF-PQ search
+    """
+
+    def __init__(self, root, dim, kind='ivf', nlist=0, nprobe=8, pq_subspaces=64, rerank=200,
+                 train_min=20000):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown index kind: {kind}")
+        if kind == 'ivfpq' and dim % pq_subspaces:
+            raise ValueError(f"pq_subspaces must divide the dimension {dim}")
+        self.root = root
+        self.dim = dim
+        self.kind = kind
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_subspaces = pq_subspaces if kind == 'ivfpq' else 0
+        self.rerank = rerank
+        self.train_min = train_min
+
+        os.makedirs(root, exist_ok=True)
+        self.db_path = os.path.join(root, 'index.sqlite3')
+        self.vectors_path = os.path.join(root, 'vectors.f32')
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._maps = {}
+        self._quantizer = None
+        self._quantizer_version = None
+        self._training = False
+        self._pid = os.getpid()
+        with self._connect() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS cases ('
+                'row INTEGER PRIMARY KEY, case_id TEXT UNIQUE NOT NULL, filename TEXT, '
+                'model TEXT, top_code TEXT, probability REAL, created_at REAL)'
+            )
+            db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            stored_dim = db.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+            if stored_dim is None:
+                db.execute("INSERT INTO meta VALUES ('dim', ?)", (str(dim),))
+            elif int(stored_dim[0]) != dim:
+                raise ValueError(f"Index at {root} holds {stored_dim[0]}-d vectors, not {dim}-d")
+            # Indexes trained before the quantizer files were versioned
+            version = self._state(db)[1]
+            legacy = os.path.join(root, 'quantizer.npz')
+            if version is not None and os.path.exists(legacy):
+                quantizer_path, lists_path, codes_path = self._paths(version)
+                for old, new in ((os.path.join(root, 'codes.u8'), codes_path),
+                                 (os.path.join(root, 'lists.i32'), lists_path), (legacy, quantizer_path)):
+                    if os.path.exists(old):
+                        os.replace(old, new)
+
+    def _connect(self):
+        # One connection per thread and process; SQLite handles cross-process locking
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._lock = threading.Lock()
+            self._maps = {}
+            self._training = False
+            self._pid = os.getpid()
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return _Transaction(db)
+
+    def _state(self, db):
+        # Committed row count and quantizer version, read together
+        return db.execute(
+            "SELECT (SELECT COALESCE(MAX(row) + 1, 0) FROM cases), "
+            "(SELECT value FROM meta WHERE key = 'quantizer_version')"
+        ).fetchone()
+
+    def _paths(self, version):
+        # (quantizer, lists, codes) files of a quantizer version; None is
+        # the untrained index, which only has lists
+        if version is None:
+            return None, os.path.join(self.root, 'lists.i32'), None
+        return (
+            os.path.join(self.root, f"quantizer.{version}.npz"),
+            os.path.join(self.root, f"lists.{version}.i32"),
+            os.path.join(self.root, f"codes.{version}.u8"),
+        )
+
+    def _map(self, path, dtype, width, rows):
+        # Read-only view of the first rows of a row file, remapped as it grows
+        if rows == 0:
+            return np.empty((0, width), dtype=dtype)
+        key = (path, rows)
+        mapped = self._maps.get(path)
+        if mapped is None or mapped[0] != key:
+            mapped = (key, np.memmap(path, dtype=dtype, mode='r', shape=(rows, width)))
+            self._maps[path] = mapped
+        return mapped[1]
+
+    def _write_rows(self, path, start, array):
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.pwrite(fd, np.ascontiguousarray(array).tobytes(), start * array[0].nbytes)
+        finally:
+            os.close(fd)
+
+    def _load_quantizer(self, version):
+        if version == self._quantizer_version:
+            return self._quantizer
+        quantizer = None
+        if version is not None:
+            with np.load(self._paths(version)[0]) as saved:
+                quantizer = {name: saved[name] for name in saved.files}
+        # Forget the maps of the lists and codes of older versions
+        self._maps = {path: mapped for path, mapped in self._maps.items() if path == self.vectors_path}
+        self._quantizer, self._quantizer_version = quantizer, version
+        return quantizer
+
+    def _encode(self, vectors, quantizer):
+        lists = assign(vectors, quantizer['centroids'], spherical=True).astype(np.int32)
+        codes = None
+        if 'codebooks' in quantizer:
+            codebooks = quantizer['codebooks']
+            parts = vectors.reshape(len(vectors), len(codebooks), -1)
+            codes = np.stack(
+                [assign(parts[:, m], codebooks[m]) for m in range(len(codebooks))], axis=1
+            ).astype(np.uint8)
+        return lists, codes
+
+    def __len__(self):
+        with self._connect() as db:
+            return self._state(db)[0]
+
+    def add(self, case_id, vector, filename=None, model=None, top_code=None, probability=None):
+        """
+        Store the embedding of a case; a case already stored keeps its
+        first embedding. Returns the row of the case.
+        """
+        return self.add_many([(case_id, vector, filename, model, top_code, probability)])[0]
+
+    def add_many(self, cases):
+        """
+        Store several cases, given as (case_id, vector, filename, model,
+        top_code, probability) tuples, in one transaction. Returns their rows.
+        """
+        vectors = normalize([case[1] for case in cases])
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-d embeddings, got {vectors.shape[1]}-d")
+        rows = []
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            first, version = self._state(db)
+            new, seen = [], {}
+            for (case_id, _, filename, model, top_code, probability), vector in zip(cases, vectors):
+                existing = db.execute('SELECT row FROM cases WHERE case_id = ?', (case_id,)).fetchone()
+                if existing is None and case_id not in seen:
+                    seen[case_id] = first + len(new)
+                    new.append((case_id, vector, filename, model, top_code, probability))
+                rows.append(existing[0] if existing is not None else seen[case_id])
+            if not new:
+                return rows
+
+            # Rows are written before they are committed, so readers never
+            # map a row without its vector
+            added = np.stack([case[1] for case in new])
+            self._write_rows(self.vectors_path, first, added)
+            _, lists_path, codes_path = self._paths(version)
+            quantizer = self._load_quantizer(version)
+            if quantizer is not None:
+                lists, codes = self._encode(added, quantizer)
+                self._write_rows(lists_path, first, lists)
+                if codes is not None:
+                    self._write_rows(codes_path, first, codes)
+            elif self.kind != 'flat':
+                self._write_rows(lists_path, first, np.full(len(new), -1, dtype=np.int32))
+            now = time.time()
+            db.executemany('INSERT INTO cases VALUES (?, ?, ?, ?, ?, ?, ?)', [
+                (first + offset, case_id, filename, model, top_code, probability, now)
+                for offset, (case_id, _, filename, model, top_code, probability) in enumerate(new)
+            ])
+        self._maybe_train(first + len(new))
+        return rows
+
+    def get(self, case_id):
+        """
+        The stored embedding of a case, or None
+        """
+        with self._connect() as db:
+            found = db.execute('SELECT row FROM cases WHERE case_id = ?', (case_id,)).fetchone()
+            rows = self._state(db)[0]
+        if found is None:
+            return None
+        return np.array(self._map(self.vectors_path, np.float32, self.dim, rows)[found[0]])
+
+    def search(self, vector, k=10, exclude=None):
+        """
+        The k stored cases most similar to vector (cosine similarity,
+        best first), leaving out the case_id exclude
+        """
+        query = normalize(vector)[0]
+        with self._connect() as db:
+            rows, version = self._state(db)
+        if rows == 0:
+            return []
+        want = k + (1 if exclude else 0)
+        vectors = self._map(self.vectors_path, np.float32, self.dim, rows)
+        quantizer = self._load_quantizer(version) if self.kind != 'flat' else None
+
+        if quantizer is None:
+            candidates = None
+            scores = np.concatenate([
+                vectors[start:start + SCAN_CHUNK_ROWS] @ query for start in range(0, rows, SCAN_CHUNK_ROWS)
+            ])
+        else:
+            _, lists_path, codes_path = self._paths(version)
+            lists = self._map(lists_path, np.int32, 1, rows)[:, 0]
+            probe = np.argsort(-(quantizer['centroids'] @ query))[:self.nprobe]
+            # Rows added while the quantizer retrains are not assigned yet
+            candidates = np.flatnonzero(np.isin(lists, probe) | (lists < 0))
+            if 'codebooks' in quantizer and len(candidates) > max(self.rerank, want):
+                codebooks = quantizer['codebooks']
+                tables = np.einsum('mkd,md->mk', codebooks, query.reshape(len(codebooks), -1))
+                codes = self._map(codes_path, np.uint8, len(codebooks), rows)[candidates]
+                approximate = tables[np.arange(len(codebooks)), codes].sum(axis=1)
+                best = np.argpartition(-approximate, max(self.rerank, want) - 1)[:max(self.rerank, want)]
+                candidates = np.sort(candidates[best])
+            scores = vectors[candidates] @ query
+            if len(scores) == 0:
+                return []
+
+        top = np.argpartition(-scores, min(want, len(scores)) - 1)[:want]
+        top = top[np.argsort(-scores[top])]
+        found_rows = top if candidates is None else candidates[top]
+        return self._describe(found_rows.tolist(), scores[top].tolist(), exclude)[:k]
+
+    def _describe(self, rows, scores, exclude):
+        with self._connect() as db:
+            placeholders = ','.join('?' * len(rows))
+            records = {
+                record[0]: record for record in db.execute(
+                    'SELECT row, case_id, filename, model, top_code, probability, created_at '
+                    f'FROM cases WHERE row IN ({placeholders})', rows
+                )
+            }
+        results = []
+        for row, score in zip(rows, scores):
+            _, case_id, filename, model, top_code, probability, created_at = records[row]
+            if case_id == exclude:
+                continue
+            results.append({
+                'case_id': case_id,
+                'filename': filename,
+                'similarity': round(float(score), 6),
+                'model': model,
+                'top_code': top_code,
+                'probability': probability,
+                'analyzed_at': created_at,
+            })
+        return results
+
+    def _maybe_train(self, rows):
+        if self.kind == 'flat' or rows < self.train_min:
+            return
+        with self._connect() as db:
+            trained = db.execute("SELECT value FROM meta WHERE key = 'trained_rows'").fetchone()
+        if trained is not None and rows < 2 * int(trained[0]):
+            return
+        with self._lock:
+            if self._training:
+                return
+            self._training = True
+        threading.Thread(target=self._train_in_background, name='vector-index-train', daemon=True).start()
+
+    def _train_in_background(self):
+        try:
+            self.train()
+        except Exception as e:
+            logger.error("Training the vector index at %s failed: %s", self.root, e, exc_info=True)
+        finally:
+            self._training = False
+
+    def train(self, sample_size=None, seed=0):
+        """
+        Train the coarse quantizer (and PQ codebooks) on a sample of the
+        stored vectors and assign every row to it, as a new version. The
+        heavy part runs without blocking inserts; only rows added meanwhile
+        are assigned under the write lock, which then switches versions.
+        """
+        started = time.perf_counter()
+        with self._connect() as db:
+            rows = self._state(db)[0]
+        if rows == 0:
+            return None
+        vectors = self._map(self.vectors_path, np.float32, self.dim, rows)
+        nlist = self.nlist or int(min(4096, max(16, np.sqrt(rows))))
+        sample_size = sample_size or min(rows, max(32 * nlist, 256 * 40))
+        rng = np.random.default_rng(seed)
+        sample = np.asarray(vectors[np.sort(rng.choice(rows, sample_size, replace=False))])
+
+        quantizer = {'centroids': kmeans(sample, nlist, spherical=True, seed=seed)}
+        if self.pq_subspaces:
+            parts = sample.reshape(len(sample), self.pq_subspaces, -1)
+            quantizer['codebooks'] = np.stack([
+                kmeans(np.ascontiguousarray(parts[:, m]), 256, seed=seed) for m in range(self.pq_subspaces)
+            ])
+
+        def encode_rows(start, end):
+            for chunk in range(start, end, SCAN_CHUNK_ROWS):
+                lists, codes = self._encode(np.asarray(vectors[chunk:min(end, chunk + SCAN_CHUNK_ROWS)]), quantizer)
+                yield chunk, lists, codes
+
+        # Nothing reads the new version's files before it is committed below
+        version = f"{rows}-{os.getpid()}-{time.time():.6f}"
+        quantizer_path, lists_path, codes_path = self._paths(version)
+
+        def write_encoded(encoded):
+            for chunk, lists, codes in encoded:
+                self._write_rows(lists_path, chunk, lists)
+                if codes is not None:
+                    self._write_rows(codes_path, chunk, codes)
+
+        write_encoded(encode_rows(0, rows))
+        temporary = f"{quantizer_path}.tmp.npz"
+        np.savez(temporary, **quantizer)
+        os.replace(temporary, quantizer_path)
+
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            current_rows = self._state(db)[0]
+            vectors = self._map(self.vectors_path, np.float32, self.dim, current_rows)
+            write_encoded(encode_rows(rows, current_rows))
+            history = db.execute("SELECT value FROM meta WHERE key = 'quantizer_history'").fetchone()
+            # Committed versions, oldest first; None is the untrained index
+            history = json.loads(history[0]) if history else [None]
+            history.append(version)
+            # Readers that saw the previous version may still be opening its
+            # files, so only versions before it are deleted
+            superseded, history = history[:-2], history[-2:]
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('quantizer_version', ?)", (version,))
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('trained_rows', ?)", (str(rows),))
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('quantizer_history', ?)", (json.dumps(history),))
+        for old in superseded:
+            for path in self._paths(old):
+                try:
+                    if path is not None:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+        logger.info(
+            "Trained %s index at %s on %d vectors (%d lists) in %.1fs",
+            self.kind, self.root, rows, nlist, time.perf_counter() - started
+        )
+        return version
+
+    def stats(self):
+        with self._connect() as db:
+            rows, version = self._state(db)
+            trained = db.execute("SELECT value FROM meta WHERE key = 'trained_rows'").fetchone()
+        quantizer = self._load_quantizer(version) if self.kind != 'flat' else None
+        return {
+            'kind': self.kind,
+            'vectors': rows,
+            'dim': self.dim,
+            'trained_rows': int(trained[0]) if trained else 0,
+            'lists': len(quantizer['centroids']) if quantizer else 0,
+            'nprobe': self.nprobe,
+            'pq_subspaces': self.pq_subspaces,
+            'training': self._training,
+            'vector_bytes': os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0,
+        }
+
+
+class _Transaction:
+    """
+    Commit (or roll back) an explicit BEGIN on the connection when the
+    block ends; autocommit otherwise
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self.db.in_transaction:
+            self.db.execute('ROLLBACK' if exc_type else 'COMMIT')